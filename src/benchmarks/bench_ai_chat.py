@@ -0,0 +1,318 @@
+"""
+Load-test the AI path of cogs/ai_chat.py offline, against the local fake Gemini server.
+
+Synthetic /chat, /chat2 and mention traffic (Poisson arrivals) is driven through AIChat.chat_with_prompt and
+AIChat.on_message with stand-ins for the Discord objects, so the rate limiter, the scheduler, the model router,
+the response cache, conversation memory and streaming edits all run as in production.
+
+Run from the src folder:
+    python -m benchmarks.bench_ai_chat [--requests 200] [--rate 5] [--mix chat=0.5,chat2=0.2,mention=0.3]
+                                       [--users 20] [--latency 1.0] [--error-rate 0.05] [--no-rate-limit]
+                                       [--json result.json]
+
+The fake server options (latency, streaming, 429 injection, ...) are those of benchmarks.fake_gemini_server.
+The files written by the cog (usage ledger, conversations, image cache, rate limits) go to a temporary folder.
+/chat2 runs without the chat history index, which is not loaded.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from benchmarks.fake_gemini_server import start_server, add_config_arguments, config_from_arguments
+from utils.ai_metrics import percentile
+
+# config.py reads these at import, the benchmark needs none of the real values
+for name, value in {
+    "DISCORD_TOKEN": "benchmark", "D2K_SERVER_ID": "1", "PLAYER_ONLINE_CHANNEL_ID": "2",
+    "SEND_MESSAGE_CHANNEL_ID": "3", "VIDEO_CHANNEL_ID": "4", "APP_CREATOR_ID": "5",
+    "GEMINI_API_TOKEN": "benchmark", "YOUTUBE_API_TOKEN": "benchmark",
+}.items():
+    os.environ.setdefault(name, value)
+
+_ids = itertools.count(10_000)
+_questions = [
+    "best build order?",
+    "is sonic tank good vs devastator",
+    "who is the best player",
+    "how do I install the game on mac",
+    "when is the next tournament",
+    "what should I do against early harkonnen rush",
+]
+
+
+class RequestSink:
+    """Collects what the cog sends for one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_text = None
+        self.last_content = None
+        self.edits = 0
+
+    def on_content(self, content):
+        self.last_content = content
+        if self.first_text is None and not content.endswith("...*"):  # Not a "*Thinking...*" / queue status
+            self.first_text = time.perf_counter()
+
+
+class FakeSentMessage:
+    def __init__(self, sink, content):
+        self.id = next(_ids)
+        self.sink = sink
+        sink.on_content(content)
+
+    async def edit(self, content=None, **_kwargs):
+        self.sink.edits += 1
+        self.sink.on_content(content)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+
+    async def history(self, **_kwargs):
+        return
+        # noinspection PyUnreachableCode
+        yield
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.nick = None
+        self.global_name = f"User {user_id}"
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMessage:
+    def __init__(self, sink, guild, channel, author, content, mentions):
+        self.id = next(_ids)
+        self.sink = sink
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.mentions = mentions
+        self.attachments = []
+        self.reference = None
+        self.created_at = datetime.now(timezone.utc)
+
+    async def reply(self, content=None, **_kwargs):
+        return FakeSentMessage(self.sink, content)
+
+
+class FakeInteraction:
+    def __init__(self, sink, guild, channel, user):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.user = user
+        self.created_at = datetime.now(timezone.utc)
+
+        async def send_message(content=None, **_kwargs):
+            sink.on_content(content)
+
+        async def defer(**_kwargs):
+            pass
+
+        async def send(content=None, **_kwargs):
+            return FakeSentMessage(sink, content)
+
+        self.response = SimpleNamespace(send_message=send_message, defer=defer)
+        self.followup = SimpleNamespace(send=send)
+
+
+def classify(content):
+    if content is None:
+        return "no_reply"
+    if "exceeded the rate limit" in content:
+        return "rate_limited"
+    if "The AI is busy" in content:
+        return "busy"
+    if "An error occurred" in content:
+        return "error"
+    return "ok"
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, share = item.partition("=")
+        if kind not in ("chat", "chat2", "mention"):
+            raise argparse.ArgumentTypeError(f"Unknown request type {kind}")
+        mix[kind] = float(share)
+    return mix
+
+
+async def run(args):
+    config = config_from_arguments(args)
+    runner, base_url, app = await start_server(config)
+    os.environ["GEMINI_BASE_URL"] = base_url
+    from config import D2K_SERVER_ID
+    from cogs.ai_chat import AIChat
+    from utils.usage_ledger import UsageLedger
+    from utils.conversation_store import ConversationStore
+    from utils.image_cache import ImageCache
+    from utils.rate_limiter import MixedRateLimiter
+
+    bot_user = FakeUser(next(_ids))
+    bot = SimpleNamespace(
+        user=bot_user, cached_messages=[], http_client=SimpleNamespace(session=None), get_user=lambda _: None
+    )
+    guild = SimpleNamespace(id=D2K_SERVER_ID)
+    channels = [FakeChannel(next(_ids)) for _ in range(args.channels)]
+    users = [FakeUser(next(_ids)) for _ in range(args.users)]
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        cog = AIChat(bot)
+        cog.usage_ledger = UsageLedger(os.path.join(data_dir, "usage_ledger.bin"))
+        cog.conversation_store = ConversationStore(os.path.join(data_dir, "conversations.json"))
+        cog.image_cache = cog.image_ingestor.cache = ImageCache(os.path.join(data_dir, "image_cache"))
+        cog.cooldown_manager.path = os.path.join(data_dir, "rate_limits.bin")
+        if args.no_stream:
+            cog.stream_replies = False
+        if args.no_rate_limit:
+            cog.cooldown_manager = MixedRateLimiter()
+
+        kinds = list(args.mix)
+        weights = [args.mix[kind] for kind in kinds]
+        results = []  # (kind, sink, end)
+
+        async def one_request(kind):
+            sink = RequestSink()
+            user = random.choice(users)
+            channel = random.choice(channels)
+            question = random.choice(_questions)
+            if kind == "mention":
+                message = FakeMessage(sink, guild, channel, user, f"{bot_user.mention} {question}", [bot_user])
+                await cog.on_message(message)
+            else:
+                interaction = FakeInteraction(sink, guild, channel, user)
+                await cog.chat_with_prompt(interaction, question, use_chat_history=kind == "chat2",
+                                           use_cache=kind == "chat")
+            results.append((kind, sink, time.perf_counter()))
+
+        start = time.perf_counter()
+        tasks = []
+        for _ in range(args.requests):
+            tasks.append(asyncio.create_task(one_request(random.choices(kinds, weights)[0])))
+            await asyncio.sleep(random.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+        wall_time = time.perf_counter() - start
+        await asyncio.gather(*cog.background_tasks, return_exceptions=True)
+        cog.image_ingestor.close()
+
+    await runner.cleanup()
+
+    report = {"wall_time": wall_time, "requests": len(results), "types": {}}
+    for kind in kinds + ["all"]:
+        selected = [(sink, end) for k, sink, end in results if kind in ("all", k)]
+        outcomes = {}
+        for sink, _ in selected:
+            outcome = classify(sink.last_content)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        ok = [(sink, end) for sink, end in selected if classify(sink.last_content) == "ok"]
+        latencies = [end - sink.start for sink, end in ok]
+        first_text = [sink.first_text - sink.start for sink, _ in ok if sink.first_text is not None]
+        report["types"][kind] = {
+            "requests": len(selected),
+            "outcomes": outcomes,
+            "throughput": len(ok) / wall_time,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+            "first_text_p50": percentile(first_text, 50),
+            "first_text_p99": percentile(first_text, 99),
+            "edits_per_request": sum(sink.edits for sink, _ in selected) / len(selected) if selected else 0,
+        }
+    report["scheduler"] = cog.scheduler.get_stats()
+    report["router"] = cog.router.get_stats()
+    report["concurrency"] = cog.concurrency.get_stats()
+    report["circuits"] = {model: breaker.get_stats() for model, breaker in cog.breakers.items()}
+    report["response_cache"] = cog.response_cache.get_stats()
+    report["server"] = dict(app["stats"].__dict__)
+    return report
+
+
+def print_report(report):
+    def fmt(seconds):
+        return f"{seconds:.2f}s" if seconds is not None else "n/a"
+
+    print(f"{report['requests']} requests in {report['wall_time']:.1f}s")
+    print()
+    print(f"{'type':<8} {'requests':>8} {'ok/s':>6} {'p50':>7} {'p99':>7} {'first p50':>10} {'edits':>6}  outcomes")
+    for kind, stats in report["types"].items():
+        print(
+            f"{kind:<8} {stats['requests']:>8} {stats['throughput']:>6.2f} {fmt(stats['latency_p50']):>7} "
+            f"{fmt(stats['latency_p99']):>7} {fmt(stats['first_text_p50']):>10} {stats['edits_per_request']:>6.1f}  "
+            f"{stats['outcomes']}"
+        )
+    scheduler = report["scheduler"]
+    print()
+    print(
+        f"Scheduler: max queue depth {scheduler['max_queue_depth']}, wait p50 {fmt(scheduler['wait_p50'])}, "
+        f"p95 {fmt(scheduler['wait_p95'])}, {scheduler['rejected']} rejected"
+    )
+    router = report["router"]
+    print(f"Router: {router['hedges_sent']} hedges ({router['hedges_won']} won), {router['fallbacks']} fallbacks")
+    for model, stats in router["models"].items():
+        print(f"  {model}: {stats['requests']} requests, p50 {fmt(stats['p50'])}, p95 {fmt(stats['p95'])}, "
+              f"error rate {stats['error_rate']:.0%}")
+    print(f"Concurrency limit: {report['concurrency']}")
+    for model, stats in report["circuits"].items():
+        print(f"  circuit {model}: {stats['state']}, opened {stats['times_opened']} times, {stats['refused']} refused")
+    print(f"Response cache: {report['response_cache']}")
+    server = report["server"]
+    print(
+        f"Fake server: {server['requests']} requests ({server['streamed']} streamed), {server['rate_limited']} x 429, "
+        f"{server['server_errors']} x 503, max {server['max_in_flight']} in flight"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=5.0, help="Requests per second (Poisson arrivals)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=0.5,chat2=0.2,mention=0.3"))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--no-stream", action="store_true", help="Disable streamed replies")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Remove the per user and global limits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the cog")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
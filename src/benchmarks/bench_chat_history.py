@@ -0,0 +1,125 @@
+"""
+Compare the columnar chat store (utils.chat_store) with the CSV loader of benchmarks/csv_history.py.
+
+A synthetic export with the columns of exported_messages.csv is written to a temporary folder, newest row first
+like the Discord export (--ascending for oldest first).
+
+Run from the src folder:
+    python -m benchmarks.bench_chat_history [--rows 1000000] [--tail 1000] [--ascending] [--repeat 5]
+
+The CSV loader has to read every row to get the newest ones of an oldest-first file, or the rows of a time range or
+a sender. The store pays one conversion, then only maps its files and parses the rows returned. Appending an
+unchanged newest-first export to the store stops at its first row.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from utils.chat_store import ChatStore
+from benchmarks.csv_history import load_chat_history_lines, iter_chat_history_rows
+from utils.load_files import format_history_row
+
+_senders = [(f"player{i}", str(400_000_000_000_000_000 + i * 7919)) for i in range(50)]
+_words = "build order sonic tank devastator harvester spice rush ornithopter map game tournament gg lol".split()
+
+
+def write_export(path, rows, ascending=False, seed=0):
+    """Write a synthetic chat export of `rows` rows, one minute apart. Returns the timestamps of the first and last."""
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    minutes = range(rows) if ascending else range(rows - 1, -1, -1)
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Timestamp", "Sender", "Sender ID", "Message", "Reactions"])
+        for minute in minutes:
+            sender, sender_id = rng.choice(_senders)
+            message = " ".join(rng.choices(_words, k=rng.randint(1, 15)))
+            if rng.random() < 0.02:
+                message += "\nsecond line, \"quoted\""
+            reactions = json.dumps({"👍": rng.randint(1, 5)}) if rng.random() < 0.1 else "{}"
+            writer.writerow([
+                (start + timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M:%S"), sender, sender_id, message, reactions
+            ])
+    return start, start + timedelta(minutes=rows - 1)
+
+
+def timed(function, repeat):
+    """Median seconds of `repeat` calls, and the last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tail", type=int, default=1000, help="Number of newest rows loaded")
+    parser.add_argument("--ascending", action="store_true", help="Write the export oldest row first")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "exported_messages.csv")
+        start = time.perf_counter()
+        first, last = write_export(path, args.rows, args.ascending)
+        print(f"Wrote {args.rows} rows ({os.path.getsize(path) / 2 ** 20:.1f} MiB) in {time.perf_counter() - start:.1f} s")
+        day_start, day_end = last - timedelta(days=1), last + timedelta(minutes=1)
+        sender_id = _senders[0][1]
+
+        results = []
+
+        # CSV loader: reads from the top, so the newest rows of an oldest-first file need the whole file
+        def csv_tail():
+            if not args.ascending:
+                return load_chat_history_lines(args.tail, path)
+            return load_chat_history_lines(None, path)[-args.tail:]
+
+        def csv_filter(predicate):
+            return [line for line in (format_history_row(row) for row in iter_chat_history_rows(path) if predicate(row))
+                    if line is not None]
+
+        day_start_text, day_end_text = (value.strftime("%Y-%m-%d %H:%M:%S") for value in (day_start, day_end))
+        results.append(("csv", "full load", *timed(lambda: load_chat_history_lines(None, path), 1)))
+        results.append(("csv", f"newest {args.tail}", *timed(csv_tail, args.repeat)))
+        results.append(("csv", "last day", *timed(lambda: csv_filter(lambda row: day_start_text <= row[0] < day_end_text), 1)))
+        results.append(("csv", "one sender", *timed(lambda: csv_filter(lambda row: row[2] == sender_id), 1)))
+
+        def formatted(rows):
+            return [line for line in (row.format() for row in rows) if line is not None]
+
+        # Columnar store
+        store = ChatStore(os.path.join(folder, "chat_store"))
+        start = time.perf_counter()
+        store.append_csv(path)
+        results.append(("store", "convert (once)", time.perf_counter() - start, None))
+        results.append(("store", "append unchanged export", *timed(lambda: store.append_csv(path), 1)))
+
+        def reopen_store():
+            store.open()
+            return len(store)
+
+        results.append(("store", "open (mmap)", *timed(reopen_store, args.repeat)))
+        results.append(("store", f"newest {args.tail}", *timed(lambda: formatted(store.tail(args.tail)), args.repeat)))
+        results.append(("store", "last day", *timed(lambda: formatted(store.time_range(day_start, day_end)), args.repeat)))
+        results.append(("store", "one sender", *timed(lambda: formatted(store.by_sender(sender_id)), args.repeat)))
+        store.close()
+
+    print(f"Rows: {args.rows}, range {first} .. {last}")
+    print()
+    print(f"{'loader':<8} {'operation':<24} {'time (ms)':>12} {'lines':>10}")
+    for loader, operation, seconds, result in results:
+        lines = "" if result is None else (result if isinstance(result, int) else len(result))
+        print(f"{loader:<8} {operation:<24} {seconds * 1000:>12.2f} {lines:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the /chat2 system prompt built from the retrieval index with the old full dump of 1000 history lines.
+
+Run from the src folder:
+    python -m benchmarks.bench_chat_index [--queries "query 1" "query 2" ...] [--k 30]
+
+Tokens are estimated offline with utils.prompt_builder.estimate_tokens. Latency is the time to assemble the
+system prompt; the model's prompt processing time grows with the prompt tokens on top of that.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from utils.chat_index import ChatHistoryIndex
+from benchmarks.csv_history import load_chat_history, load_chat_history_lines
+from utils.load_files import load_text_prompt
+from utils.prompt_builder import estimate_tokens
+
+default_queries = [
+    "best build order?",
+    "who is the best player",
+    "when is the next tournament",
+    "how do I install the game on mac",
+    "franky quit again",
+    "is sonic tank good vs devastator",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", nargs="+", default=default_queries)
+    parser.add_argument("--k", type=int, default=30, help="Number of history snippets retrieved")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    system_prompt = load_text_prompt()
+
+    # Old behaviour: the same 1000 lines on every call, the first rows of the export
+    start = time.perf_counter()
+    full_dump = f"{system_prompt} \n Some chat history for you to get familiar to our culture:\n {load_chat_history()}"
+    full_dump_load = time.perf_counter() - start
+    full_dump_tokens = estimate_tokens(full_dump)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        lines = load_chat_history_lines()
+        start = time.perf_counter()
+        index = ChatHistoryIndex(index_dir).open()
+        index.sync_source("exported_messages", lines)
+        build_time = time.perf_counter() - start
+        index.close()
+
+        start = time.perf_counter()
+        index = ChatHistoryIndex(index_dir).open()
+        open_time = time.perf_counter() - start
+
+        print(f"History rows: {len(lines)}, indexed docs: {index.doc_count}")
+        print(f"Index build: {build_time * 1000:.1f} ms, open (mmap): {open_time * 1000:.2f} ms")
+        print(f"Full dump: ~{full_dump_tokens} tokens per call, built once in {full_dump_load * 1000:.1f} ms")
+        print()
+        print(f"{'query':<40} {'tokens':>8} {'saved':>8} {'search p50 (ms)':>16}")
+        retrieval_tokens = []
+        for query in args.queries:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                snippets = sorted(index.search_docs(query, k=args.k))
+                prompt = (
+                    f"{system_prompt} \n Some chat history for you to get familiar to our culture:\n "
+                    f"{chr(10).join(snippets)}"
+                )
+                timings.append(time.perf_counter() - start)
+            tokens = estimate_tokens(prompt)
+            retrieval_tokens.append(tokens)
+            print(f"{query[:40]:<40} {tokens:>8} {full_dump_tokens - tokens:>8} {statistics.median(timings) * 1000:>16.3f}")
+        index.close()
+
+    average = statistics.mean(retrieval_tokens)
+    print()
+    print(f"Average prompt: ~{average:.0f} tokens with retrieval vs ~{full_dump_tokens} with the full dump "
+          f"({1 - average / full_dump_tokens:.0%} fewer).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Benchmark and property checks of the rate limiter backends of utils/rate_limiter.py, with the limits of
+cogs/ai_chat.py.
+
+Run from the src folder:
+    python -m benchmarks.bench_rate_limiter [--keys 1000 100000 1000000] [--backends exact log gcra]
+                                            [--decisions 200000] [--traces 200] [--json result.json]
+
+Sections:
+    memory: bytes per key once every key holds its full state (its daily limit reached), measured with tracemalloc
+        on --memory-keys keys
+    throughput: decisions per second at each number of keys, after --fill messages per key, for a realistic load
+        (random keys, 100 decisions per simulated second) and an adversarial one (10 keys hammering the limiter
+        with a jittery clock that sometimes goes back, so the limits stay saturated)
+    double pass: try_add_message against the former check-then-commit path (is_allowed, then add_timestamp on
+        every limiter) on the same trace, at --double-pass-keys keys
+    properties: randomized traces replayed against every backend, with the checks of tests/rate_limiter_checks.py
+        (also run by the test suite). "log" must make the same decisions and report the same retry_after as "exact"
+        while the clock does not go back, and never allow more after it does. "gcra" must allow a full burst from
+        idle and never more than rate * (L + per) / per messages in any L seconds. Every backend must make the same
+        decisions after a snapshot is saved and loaded.
+
+The clock is simulated (passed as current_time), so the decisions do not depend on the machine and are the same run
+after run. Exits with status 1 if a property check fails. --json writes every result, to compare versions.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from tests.rate_limiter_checks import (SimulatedClock, check_gcra_bounds, check_same_decisions, check_snapshot,
+                                       random_case)
+from utils.rate_limiter import MixedRateLimiter, BACKENDS
+
+# Limits of AIChat: (rate, per) per user, then global
+per_user_limits = [(3, 60), (20, 3600), (50, 86400)]
+global_limits = [(10, 60), (500, 86400)]
+
+
+def make_limiter(backend, keys, use_global_limits=True):
+    limiter = MixedRateLimiter(backend)
+    for rate, per in per_user_limits:
+        limiter.add_per_user_limit(rate, per)
+    for rate, per in global_limits if use_global_limits else []:
+        limiter.add_global_limit(rate, per)
+    for sub_limiter in limiter.global_limiters + limiter.per_user_limiters:
+        sub_limiter.max_keys = keys
+    return limiter
+
+
+def fill(limiter, keys, messages_per_key, clock):
+    """Send messages_per_key messages for every key, spread over the day, without the global limits."""
+    per_user_limiters = limiter.per_user_limiters
+    step = 86400 / (keys * messages_per_key)
+    for _ in range(messages_per_key):
+        for key in range(keys):
+            current_time = clock.advance(step)
+            for sub_limiter in per_user_limiters:
+                sub_limiter.add_timestamp(current_time, key)
+
+
+def decision_trace(load, keys, decisions, seed):
+    """(key, time step) of every decision."""
+    rng = random.Random(seed)
+    if load == "adversarial":
+        hot_keys = [rng.randrange(keys) for _ in range(10)]
+        return [(rng.choice(hot_keys), rng.uniform(-0.0005, 0.0025)) for _ in range(decisions)]
+    return [(rng.randrange(keys), 0.01) for _ in range(decisions)]
+
+
+def double_pass_add(limiter, key, current_time):
+    """The former MixedRateLimiter.try_add_message: check every limit, then add the timestamp to every limit."""
+    if not limiter.is_allowed(key, current_time):
+        return False
+    for sub_limiter in limiter.global_limiters:
+        sub_limiter.add_timestamp(current_time)
+    for sub_limiter in limiter.per_user_limiters:
+        sub_limiter.add_timestamp(current_time, key)
+    return True
+
+
+def replay(limiter, trace, clock, add=None):
+    """Run the decisions of a trace. Returns (decisions per second, allowed)."""
+    add = add or limiter.try_add_message
+    allowed = 0
+    start = time.perf_counter()
+    for key, step in trace:
+        allowed += add(key, clock.advance(step))
+    return len(trace) / (time.perf_counter() - start), allowed
+
+
+def bench_memory(backend, keys):
+    clock = SimulatedClock()
+    tracemalloc.start()
+    limiter = make_limiter(backend, keys, use_global_limits=False)
+    fill(limiter, keys, per_user_limits[-1][0], clock)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {"backend": backend, "keys": keys, "bytes": memory, "bytes_per_key": memory / keys}
+
+
+def bench_throughput(backend, keys, fill_messages, decisions, seed):
+    clock = SimulatedClock()
+    limiter = make_limiter(backend, keys)
+    start = time.perf_counter()
+    fill(limiter, keys, fill_messages, clock)
+    result = {"backend": backend, "keys": keys, "fill_seconds": time.perf_counter() - start}
+    for load in ("realistic", "adversarial"):
+        throughput, allowed = replay(limiter, decision_trace(load, keys, decisions, seed), clock)
+        result[load] = {"decisions_per_second": throughput, "allowed": allowed}
+    return result
+
+
+def bench_double_pass(backend, keys, fill_messages, decisions, seed):
+    result = {"backend": backend, "keys": keys}
+    trace = decision_trace("realistic", keys, decisions, seed)
+    for name in ("single_pass", "double_pass"):
+        clock = SimulatedClock()
+        limiter = make_limiter(backend, keys)
+        fill(limiter, keys, fill_messages, clock)
+        add = (lambda key, current_time: double_pass_add(limiter, key, current_time)) if name == "double_pass" else None
+        throughput, allowed = replay(limiter, trace, clock, add)
+        result[name] = {"decisions_per_second": throughput, "allowed": allowed}
+    result["speedup"] = result["single_pass"]["decisions_per_second"] / result["double_pass"]["decisions_per_second"]
+    return result
+
+
+def check_properties(backends, traces, seed):
+    rng = random.Random(seed)
+    cases = [random_case(rng) for _ in range(traces)]
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        checks = [(f"{backend} matches exact", lambda limits, trace, backend=backend:
+                   check_same_decisions(backend, limits, trace))
+                  for backend in backends if backend == "log"]
+        if "gcra" in backends:
+            checks.append(("gcra burst and window bounds", check_gcra_bounds))
+        checks += [(f"{backend} snapshot round trip", lambda limits, trace, backend=backend:
+                    check_snapshot(backend, limits, trace, folder))
+                   for backend in backends]
+        for name, check in checks:
+            failures = []
+            for case_index, (limits, trace) in enumerate(cases):
+                failure = check(limits, trace)
+                if failure is not None:
+                    failures.append({"case": case_index, "limits": limits, **failure})
+            results[name] = {
+                "cases": len(cases), "failures": len(failures), "first_failure": failures[0] if failures else None
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--decisions", type=int, default=200_000)
+    parser.add_argument("--fill", type=int, default=3, help="Messages per key before the throughput runs")
+    parser.add_argument("--memory-keys", type=int, default=10_000)
+    parser.add_argument("--double-pass-keys", type=int, default=100_000)
+    parser.add_argument("--traces", type=int, default=200, help="Randomized traces of the property checks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "per_user_limits": per_user_limits,
+        "global_limits": global_limits,
+        "memory": [],
+        "throughput": [],
+        "double_pass": [],
+    }
+
+    print(f"Memory, {args.memory_keys} keys at their daily limit")
+    print(f"{'backend':<8} {'bytes / key':>12}")
+    for backend in args.backends:
+        result = bench_memory(backend, args.memory_keys)
+        results["memory"].append(result)
+        print(f"{backend:<8} {result['bytes_per_key']:>12.0f}")
+
+    print()
+    print(f"Throughput, {args.decisions} decisions after {args.fill} messages per key")
+    print(f"{'backend':<8} {'keys':>9} {'realistic / s':>15} {'adversarial / s':>16}")
+    for keys in args.keys:
+        for backend in args.backends:
+            result = bench_throughput(backend, keys, args.fill, args.decisions, args.seed)
+            results["throughput"].append(result)
+            print(f"{backend:<8} {keys:>9} {result['realistic']['decisions_per_second']:>15,.0f} "
+                  f"{result['adversarial']['decisions_per_second']:>16,.0f}")
+
+    print()
+    print(f"Single pass (try_add_message) vs check then commit, {args.double_pass_keys} keys")
+    print(f"{'backend':<8} {'single / s':>12} {'double / s':>12} {'speedup':>8}")
+    for backend in args.backends:
+        result = bench_double_pass(backend, args.double_pass_keys, args.fill, args.decisions, args.seed)
+        results["double_pass"].append(result)
+        print(f"{backend:<8} {result['single_pass']['decisions_per_second']:>12,.0f} "
+              f"{result['double_pass']['decisions_per_second']:>12,.0f} {result['speedup']:>7.2f}x")
+
+    print()
+    print(f"Properties, {args.traces} randomized traces")
+    results["properties"] = check_properties(args.backends, args.traces, args.seed)
+    for name, result in results["properties"].items():
+        status = "ok" if not result["failures"] else f"FAILED {result['failures']}, first: {result['first_failure']}"
+        print(f"{name:<32} {status}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if any(result["failures"] for result in results["properties"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+The CSV chat history loaders the benchmarks compare against, read straight from exported_messages.csv.
+
+load_chat_history is the loader the bot used before the chat store, kept as it was so the "old behaviour" of
+bench_chat_index is the one that ran.
+"""
+import csv
+from utils.load_files import csv_file_path, format_history_row
+
+
+def iter_chat_history_rows(path=csv_file_path):
+    """Yield the valid rows of the exported chat history CSV, skipping the header row."""
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        for i, row in enumerate(reader):
+            if i == 0 and row and row[0] == "Timestamp":
+                continue
+            if len(row) < 5:  # Ensure row has at least 5 columns
+                continue
+            yield row[:5]
+
+
+def load_chat_history_lines(lines=None, path=csv_file_path):
+    """Return the formatted chat history lines, at most `lines` rows (all if None)."""
+    chat_history = []
+    for i, row in enumerate(iter_chat_history_rows(path)):
+        if lines is not None and i >= lines:  # Stop reading after "lines" rows
+            break
+        line = format_history_row(row)
+        if line is not None:
+            chat_history.append(line)
+    return chat_history
+
+
+def load_chat_history(lines=1000, path=csv_file_path):
+    """The first `lines` rows of the file as one string, header row included, like the loader it replaces."""
+    chat_history = []
+    with open(path, "r", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        for i, row in enumerate(reader):
+            if i >= lines:  # Stop reading after "lines" rows
+                break
+            if len(row) < 5:  # Ensure row has at least 5 columns
+                continue
+            line = format_history_row(row)
+            if line is not None:
+                chat_history.append(line)
+    return chr(10).join(chat_history)
@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Gemini generateContent API, to load-test the AI path without calling Google.
+
+Serves `POST /{version}/models/{model}:generateContent` and `:streamGenerateContent` (server-sent events) with
+configurable latency, streaming chunks, token counts and injected 429 / 503 errors.
+
+Run from the src folder:
+    python -m benchmarks.fake_gemini_server [--port 8765] [--latency 1.0] [--error-rate 0.05] ...
+
+then point the bot at it with GEMINI_BASE_URL=http://127.0.0.1:8765 in .env.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from aiohttp import web
+
+_words = (
+    "the sonic tank outranges the devastator but dies to a focused group of troopers so scout first and "
+    "keep your harvesters moving while the ornithopters cover the refinery"
+).split()
+
+
+@dataclass
+class FakeGeminiConfig:
+    latency: float = 1.0  # Seconds until the response is complete
+    jitter: float = 0.3  # Relative latency spread, latency * (1 +- jitter)
+    model_latency: dict[str, float] = field(default_factory=dict)  # Per model overrides of latency
+    ttft_fraction: float = 0.3  # Share of the latency before the first streamed chunk
+    stream_chunks: int = 5
+    response_tokens: int = 150
+    thought_tokens: int = 0
+    error_rate: float = 0.0  # Share of requests answered with a 429
+    server_error_rate: float = 0.0  # Share of requests answered with a 503
+    retry_after: float | None = None  # Retry-After header of the 429s
+    max_concurrency: int | None = None  # Requests beyond this many in flight are answered with a 429
+
+
+@dataclass
+class FakeGeminiStats:
+    requests: int = 0
+    streamed: int = 0
+    rate_limited: int = 0
+    server_errors: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    by_model: dict[str, int] = field(default_factory=dict)
+
+
+def _error_response(code, status, message, headers=None):
+    body = {"error": {"code": code, "message": message, "status": status}}
+    return web.json_response(body, status=code, headers=headers)
+
+
+def _response_json(model, text, prompt_tokens, response_tokens, thought_tokens, finished=True):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": response_tokens,
+            "thoughtsTokenCount": thought_tokens,
+            "totalTokenCount": prompt_tokens + response_tokens + thought_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+def make_app(config: FakeGeminiConfig) -> web.Application:
+    """Build the aiohttp app. Its stats are in app["stats"], and GET /stats returns them as JSON."""
+    stats = FakeGeminiStats()
+    app = web.Application()
+    app["config"] = config
+    app["stats"] = stats
+
+    def latency_of(model):
+        base = config.model_latency.get(model, config.latency)
+        return max(0.0, base * (1 + random.uniform(-config.jitter, config.jitter)))
+
+    async def generate(request: web.Request):
+        model, _, action = request.match_info["model_action"].partition(":")
+        if action not in ("generateContent", "streamGenerateContent"):
+            return _error_response(404, "NOT_FOUND", f"Unknown action {action}")
+        body = await request.read()
+        stats.requests += 1
+        stats.by_model[model] = stats.by_model.get(model, 0) + 1
+
+        if config.max_concurrency is not None and stats.in_flight >= config.max_concurrency \
+                or random.random() < config.error_rate:
+            stats.rate_limited += 1
+            headers = {"Retry-After": f"{config.retry_after:g}"} if config.retry_after is not None else None
+            return _error_response(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).",
+                                   headers)
+        if random.random() < config.server_error_rate:
+            stats.server_errors += 1
+            return _error_response(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+
+        # Roughly 4 bytes per token, images included as base64
+        prompt_tokens = max(1, len(body) // 4)
+        words = [random.choice(_words) for _ in range(config.response_tokens)]
+        stats.prompt_tokens += prompt_tokens
+        stats.response_tokens += len(words)
+        latency = latency_of(model)
+
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            if action == "generateContent":
+                await asyncio.sleep(latency)
+                return web.json_response(_response_json(
+                    model, " ".join(words), prompt_tokens, len(words), config.thought_tokens
+                ))
+
+            stats.streamed += 1
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            chunks = max(1, config.stream_chunks)
+            await asyncio.sleep(latency * config.ttft_fraction)
+            interval = latency * (1 - config.ttft_fraction) / chunks
+            per_chunk = -(-len(words) // chunks)
+            for i in range(chunks):
+                if i:
+                    await asyncio.sleep(interval)
+                text = " ".join(words[i * per_chunk:(i + 1) * per_chunk]) + ("" if i == chunks - 1 else " ")
+                data = _response_json(
+                    model, text, prompt_tokens, min(len(words), (i + 1) * per_chunk), config.thought_tokens,
+                    finished=i == chunks - 1
+                )
+                await response.write(f"data: {json.dumps(data)}\r\n\r\n".encode("utf-8"))
+            await response.write_eof()
+            return response
+        finally:
+            stats.in_flight -= 1
+
+    async def get_stats(_request):
+        return web.json_response(stats.__dict__)
+
+    app.router.add_post("/{version}/models/{model_action}", generate)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+async def start_server(config: FakeGeminiConfig, host="127.0.0.1", port=0):
+    """
+    Start the server in the running event loop.
+
+    Returns:
+        (runner, base_url, app). Stop it with `await runner.cleanup()`.
+    """
+    app = make_app(config)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}", app
+
+
+def parse_model_latency(values):
+    model_latency = {}
+    for value in values:
+        model, _, seconds = value.partition("=")
+        model_latency[model] = float(seconds)
+    return model_latency
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Relative latency spread")
+    parser.add_argument("--model-latency", nargs="*", default=[], metavar="MODEL=SECONDS",
+                        help="Per model latency, e.g. gemini-2.0-flash=0.5")
+    parser.add_argument("--stream-chunks", type=int, default=5)
+    parser.add_argument("--response-tokens", type=int, default=150)
+    parser.add_argument("--thought-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share answered with a 503")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After header of the 429s")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Answer with a 429 beyond this many requests in flight (a quota)")
+
+
+def config_from_arguments(args) -> FakeGeminiConfig:
+    return FakeGeminiConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        model_latency=parse_model_latency(args.model_latency),
+        stream_chunks=args.stream_chunks,
+        response_tokens=args.response_tokens,
+        thought_tokens=args.thought_tokens,
+        error_rate=args.error_rate,
+        server_error_rate=args.server_error_rate,
+        retry_after=args.retry_after,
+        max_concurrency=args.max_concurrency,
+    )
+
+
+async def serve_forever(config, host, port):
+    runner, base_url, app = await start_server(config, host, port)
+    print(f"Fake Gemini server listening on {base_url} (set GEMINI_BASE_URL={base_url})")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            stats = app["stats"]
+            print(f"{time.strftime('%H:%M:%S')} requests: {stats.requests}, 429: {stats.rate_limited}, "
+                  f"503: {stats.server_errors}, max in flight: {stats.max_in_flight}")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(config_from_arguments(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from discord.ext import commands
 from discord import app_commands
 import logging
 from config import D2K_SERVER_ID
+from utils.http_client import HttpClientManager
 import os
 
 logger = logging.getLogger(__name__)
@@ -35,8 +36,14 @@ class MyClient(commands.Bot):
             "autoreaction",
             "ai_chat",
         ]
+        # Pooled HTTP client shared by all cogs for outbound (non-Discord) requests.
+        # Not named "http" because discord.Client already uses that attribute.
+        self.http_client = HttpClientManager()
 
     async def setup_hook(self):
+        # Start the shared HTTP client before cogs borrow its session
+        await self.http_client.start()
+
         # Clear global commands first (to be commented out)
         self.tree.clear_commands(guild=None)
         self.tree.clear_commands(guild=guild)
@@ -53,6 +60,11 @@ class MyClient(commands.Bot):
         self.tree.error(self.app_command_error_handler)
         await self.sync_commands()
 
+    async def close(self):
+        # Unloads the cogs first, so they are done with the shared session before it is closed
+        await super().close()
+        await self.http_client.close()
+
     async def sync_commands(self):
         try:
             logger.info(f"Syncing commands to guild {guild.id}.")
@@ -1,20 +1,41 @@
 import logging
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 # noinspection PyPackageRequirements
 from google import genai
 # noinspection PyPackageRequirements
 from google.genai import types
-# import asyncio
-from config import D2K_SERVER_ID, GEMINI_API_TOKEN
+# noinspection PyPackageRequirements
+from google.genai import errors as genai_errors
+import asyncio
+import aiohttp
+import httpx
+from config import D2K_SERVER_ID, GEMINI_API_TOKEN, GEMINI_BASE_URL, APP_CREATOR_ID
 import json
-from utils.load_files import load_text_prompt, load_chat_history
+import math
+import os
+import time
+from utils.load_files import load_text_prompt, read_text_prompt, text_file_path, csv_file_path
+from utils.chat_index import ChatHistoryIndex
+from utils.chat_store import ChatStore
+from utils.file_watcher import FileWatcher
 from utils.rate_limiter import MixedRateLimiter
-from utils.discord_msg import get_referenced_message, get_recent_messages, format_message
-from PIL import Image
-import aiohttp
-from io import BytesIO
+from utils.discord_msg import ReplyChainResolver, ProgressiveMessage, format_message
+from utils.message_buffer import ChannelMessageBuffer
+from utils.image_ingest import ImageIngestor, is_image_attachment
+from utils.image_cache import ImageCache
+from utils.prompt_builder import PromptBuilder
+from utils.response_cache import ResponseCache
+from utils.conversation_store import ConversationStore
+from utils.ai_metrics import LatencyRecorder
+from utils.usage_ledger import UsageLedger, MAX_REPORT_DAYS
+from utils.model_router import ModelRouter
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, AdaptiveConcurrency
+from utils.request_scheduler import (
+    RequestScheduler, QueueFullError,
+    PRIORITY_ADMIN, PRIORITY_MENTION, PRIORITY_CHAT, PRIORITY_CHAT_LONG, PRIORITY_BACKGROUND
+)
 from utils.command_checks import is_creator
 
 # Rate limits: https://ai.google.dev/gemini-api/docs/rate-limits#free-tier
@@ -29,19 +50,50 @@ guild = discord.Object(D2K_SERVER_ID)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("google_genai.models").setLevel(logging.WARNING)
 
-async def download_image(url: str) -> Image.Image | None:
-    """Asynchronously downloads an image from a URL and returns a PIL Image."""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    logger.error(f"Failed to download image: {resp.status}")
-                    return None
-                image_data = await resp.read()
-                return Image.open(BytesIO(image_data))
-    except Exception as e:
-        logger.error(f"Error downloading image: {e}")
-        return None
+def is_retryable_error(error: Exception) -> bool:
+    """Rate limited (429) or server side (5xx) errors, worth retrying with another model."""
+    return isinstance(error, genai_errors.APIError) and (error.code == 429 or error.code >= 500)
+
+def is_transport_error(error: Exception) -> bool:
+    """No answer from the server: timeout, connection refused or reset, DNS failure."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return False  # Answered
+    return isinstance(error, (httpx.TransportError, aiohttp.ClientError, TimeoutError, ConnectionError))
+
+def get_retry_after(error: Exception) -> float | None:
+    """Seconds the server asked to wait, from the Retry-After header or the RetryInfo of the error details."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None and headers.get("retry-after"):
+        try:
+            return float(headers.get("retry-after"))
+        except ValueError:
+            pass  # An HTTP date, the details may still have it
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []):
+            retry_delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if retry_delay:
+                try:
+                    return float(retry_delay.rstrip("s"))
+                except ValueError:
+                    pass
+    return None
+
+def busy_message(error: Exception) -> str:
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after:
+        return f"The AI is busy right now. Please try again in {math.ceil(retry_after)} seconds."
+    return "The AI is busy right now. Please try again in a minute."
+
+def rate_limit_message(retry_after: float) -> str:
+    if retry_after < 90:
+        wait = f"{max(1, math.ceil(retry_after))} seconds"
+    elif retry_after < 90 * 60:
+        wait = f"{math.ceil(retry_after / 60)} minutes"
+    else:
+        wait = f"{math.ceil(retry_after / 3600)} hours"
+    return f"You have exceeded the rate limit. Please try again in {wait}."
 
 class AIChat(commands.Cog):
     """
@@ -53,52 +105,368 @@ class AIChat(commands.Cog):
 
         # Load system prompt from file
         self.system_prompt_short = load_text_prompt()
-        chat_history = load_chat_history()
-        self.system_prompt_long = f"{self.system_prompt_short} \n Some chat history for you to get familiar to our culture:\n {chat_history}"
+        # Retrieval index over the exported chat history, /chat2 gets the snippets relevant to the message
+        self.chat_index = ChatHistoryIndex()
+        self.chat_index_ready = False
+        self.history_snippets = 30
+
+        # Replies of /chat for repeated questions, invalidated when the prompt changes
+        self.response_cache = ResponseCache(ttl=3600, max_entries=500)
+
+        # Memory of /chat and /chat2 per user and of mentions per channel / thread:
+        # a running summary (updated in the background by the fast model) plus the latest turns
+        self.conversation_store = ConversationStore(max_turns=6)
+        self.summary_model = "gemini-2.0-flash"
+        self.background_tasks = set()
 
         self.models = [
             "gemini-2.0-flash-thinking-exp-01-21",
             "gemini-2.0-flash",
         ]
-        self.model = self.models[0]
+        # Picks the model per request from rolling latency / error stats, in the order of self.models
+        self.router = ModelRouter(self.models)
+        # Hedge to a faster model when the primary runs past its p95 latency
+        self.hedge_requests = True
+        # p95 latency (seconds) each request type should stay within, None for no limit
+        self.latency_budgets = {
+            "mention": 20,
+            "chat": 30,
+            "chat2": None,
+        }
+        # Post a placeholder reply and edit it as chunks arrive, instead of waiting for the whole response
+        self.stream_replies = True
+        self.latency_recorder = LatencyRecorder()
+        # Persistent record of the tokens and latency of every request, for /usage
+        self.usage_ledger = UsageLedger()
 
-        self.aiclient = genai.Client(api_key=GEMINI_API_TOKEN)
-        self.cooldown_manager = MixedRateLimiter()
+        # GEMINI_BASE_URL points the client at another endpoint, e.g. the fake server of the benchmarks
+        self.aiclient = genai.Client(
+            api_key=GEMINI_API_TOKEN,
+            http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+        )
+        # Exact sliding windows over one timestamp log per user: the daily limits are Gemini budgets, and GCRA would
+        # let any 24 hours take up to twice as much. Saved to disk, so restarts and reloads do not reset them.
+        self.cooldown_manager = MixedRateLimiter("log", path=os.path.join("data", "rate_limits.bin"))
         self.cooldown_manager.add_per_user_limit(3, 60)
         self.cooldown_manager.add_per_user_limit(20, 3600)
         self.cooldown_manager.add_per_user_limit(50, 86400)
         self.cooldown_manager.add_global_limit(10, 60)
         self.cooldown_manager.add_global_limit(500, 86400)
+        # Seconds a request may wait for the rate limiter instead of being rejected. Slash commands must be
+        # answered within 3 seconds and the rejection is sent ephemeral before deferring, so they never wait.
+        self.rate_limit_waits = {"chat": 0, "mention": 10}
+
+        # Bounds the concurrent Gemini calls, the rest wait in a priority queue
+        self.scheduler = RequestScheduler(max_concurrency=3, max_queue_size=20)
+        # Stops calling a model that keeps failing, the router falls back to the others meanwhile
+        self.breakers = {model: CircuitBreaker(model) for model in self.models}
+        # Shrinks the scheduler's concurrency when Gemini is overloaded, grows it back while it keeps up
+        self.concurrency = AdaptiveConcurrency(
+            self.scheduler.set_max_concurrency, initial=3, max_limit=6, latency_target=20
+        )
+
+        # Downloads attachments concurrently and shrinks them to save upload bytes and image tokens.
+        # Images seen before (same attachment or near-duplicate) are served from the disk cache.
+        self.image_cache = ImageCache(max_bytes=200 * 1024 * 1024)
+        self.image_ingestor = ImageIngestor(cache=self.image_cache)
+
+        # Recent messages per channel, kept up to date from gateway events instead of fetching history per mention
+        self.message_buffer = ChannelMessageBuffer(depth=20)
+        # Walks reply chains through local caches first, batching the REST fetches it still needs
+        self.reply_chain_resolver = ReplyChainResolver(bot)
+        # Deduplicates the context of mentions and trims it to a token budget per request type
+        self.prompt_builder = PromptBuilder(budgets={"mention": 8000})
+
+        # Reloads the system prompt and the chat history index when their files change, without blocking the loop
+        self.file_watcher = FileWatcher()
+        self.file_watcher.watch(text_file_path, read_text_prompt, self.update_basic_system_prompt)
+        self.file_watcher.watch(csv_file_path, self.build_chat_index, self.swap_chat_index)
 
     async def cog_load(self):
+        # The first check loads every watched file: the prompt again, and the chat history index
+        await self.file_watcher.check()
+        if not self.chat_index_ready:
+            logger.warning("Chat history index not loaded, /chat2 goes without chat history.")
+        await asyncio.to_thread(self.conversation_store.load)
+        await asyncio.to_thread(self.image_cache.load)
+        await asyncio.to_thread(self.usage_ledger.load)
+        try:
+            await asyncio.to_thread(self.cooldown_manager.load)
+        except Exception as e:
+            logger.exception(f"Error when loading rate limiter state: {e}")
+        self.save_state_task.start()
+        self.watch_files_task.start()
         logger.info("Cog AI Chat has been loaded!")
 
     async def cog_unload(self):
+        self.save_state_task.cancel()
+        self.watch_files_task.cancel()
+        await self.save_conversations()
+        await self.save_usage()
+        await self.save_rate_limits()
+        for task in self.background_tasks:
+            task.cancel()
+        self.image_ingestor.close()
+        self.chat_index_ready = False
+        self.chat_index.close()
         logger.info("Cog AI Chat has been unloaded!")
 
-    def update_baisc_system_prompt(self):
-        self.system_prompt_short = load_text_prompt()
+    async def save_conversations(self):
+        try:
+            if self.conversation_store.dirty:
+                await asyncio.to_thread(self.conversation_store.save, self.conversation_store.snapshot())
+        except Exception as e:
+            logger.exception(f"Error when saving conversations: {e}")
+
+    async def save_usage(self):
+        try:
+            await asyncio.to_thread(self.usage_ledger.flush)
+        except Exception as e:
+            logger.exception(f"Error when saving usage ledger: {e}")
+
+    async def save_rate_limits(self):
+        try:
+            if self.cooldown_manager.dirty:
+                await asyncio.to_thread(self.cooldown_manager.save, self.cooldown_manager.snapshot())
+        except Exception as e:
+            logger.exception(f"Error when saving rate limiter state: {e}")
+
+    @tasks.loop(minutes=5)
+    async def save_state_task(self):
+        await self.save_conversations()
+        await self.save_usage()
+        await self.save_rate_limits()
+        try:
+            await asyncio.to_thread(self.image_cache.save)
+        except Exception as e:
+            logger.exception(f"Error when saving image cache index: {e}")
+
+    @tasks.loop(seconds=30)
+    async def watch_files_task(self):
+        await self.file_watcher.check()
+
+    async def summarize_turns(self, summary, turns):
+        """Fold conversation turns into the running summary with the fast model, at background priority."""
+        turns_text = "\n".join(f"{speaker}: {text}" for speaker, text in turns)
+        prompt = (
+            f"Current summary:\n{summary or '(empty)'}\n\n"
+            f"New turns:\n{turns_text}\n\n"
+            f"Rewrite the summary so it also covers the new turns. "
+            f"Keep names, facts, preferences and open questions. At most 150 words."
+        )
+        config = types.GenerateContentConfig(
+            system_instruction="You maintain a concise running summary of a Discord conversation with an AI bot.",
+            max_output_tokens=400,
+        )
+        async with self.scheduler.slot(PRIORITY_BACKGROUND):
+            start_time = time.perf_counter()
+            response, reply_text, _ = await self.call_model(self.summary_model, prompt, config)
+        self.record_usage(0, "summary", self.summary_model, response, 0, time.perf_counter() - start_time)
+        return reply_text.strip() if reply_text else ""
+
+    def record_usage(self, user_id, command, model, response, images, latency, cache_hit=False, error=False):
+        usage_metadata = getattr(response, "usage_metadata", None)
+        self.usage_ledger.record(
+            user_id, command, model,
+            prompt_tokens=getattr(usage_metadata, "prompt_token_count", 0),
+            response_tokens=getattr(usage_metadata, "candidates_token_count", 0),
+            thought_tokens=getattr(usage_metadata, "thoughts_token_count", 0),
+            images=images,
+            latency=latency,
+            cache_hit=cache_hit,
+            error=error
+        )
+
+    async def summarize_conversation(self, key):
+        try:
+            await self.conversation_store.summarize(key, self.summarize_turns)
+        except (QueueFullError, CircuitOpenError) as e:
+            logger.info(f"AI is busy, summary of conversation {key} postponed: {e}")
+        except Exception as e:
+            logger.warning(f"Error when summarizing conversation {key}: {e}")
+
+    def remember_turn(self, key, user_text, ai_text, user_name):
+        """Add an exchange to the conversation memory, summarizing older turns in the background."""
+        if self.conversation_store.add_turn(key, user_text, ai_text, user_name):
+            task = asyncio.create_task(self.summarize_conversation(key))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+    def build_chat_index(self, path):
+        """
+        Open the persisted index in a new instance and append the chat history rows it has not seen yet.
+        Runs in a worker thread, while the current instance keeps serving /chat2.
+
+        The export is first converted into the columnar chat store, which only appends (and parses) the new rows.
+        """
+        chat_index = ChatHistoryIndex(self.chat_index.path).open()
+        try:
+            with ChatStore() as store:
+                store.append_csv(path)
+                # The index saves how many store rows it has read, so the rows of a conversion whose sync failed
+                # are read again. A new index, or one ahead of a rebuilt store, reads every row, sync_source skips
+                # the ones it has.
+                start = chat_index.source_position("exported_messages")
+                if start > len(store):
+                    start = 0
+                lines = [line for line in (row.format() for row in store.rows(start)) if line is not None]
+                rows = len(store)
+            appended = chat_index.sync_source("exported_messages", lines, position=rows)
+        except Exception:
+            chat_index.close()
+            raise
+        logger.info(f"Chat history index ready with {chat_index.doc_count} messages ({appended} new).")
+        return chat_index
+
+    def swap_chat_index(self, chat_index):
+        old_index, self.chat_index = self.chat_index, chat_index
+        self.chat_index_ready = True
+        old_index.close()
+
+    def build_system_prompt(self, use_chat_history=False, history_query=None):
+        """The system prompt, with the chat history snippets most relevant to history_query if use_chat_history."""
+        if not use_chat_history or not history_query or not self.chat_index_ready:
+            return self.system_prompt_short
+        # Lines start with their timestamp, so sorting them puts them back in chronological order
+        snippets = sorted(self.chat_index.search_docs(history_query, k=self.history_snippets))
+        return (
+            f"{self.system_prompt_short} \n Some chat history for you to get familiar to our culture:\n "
+            f"{chr(10).join(snippets)}"
+        )
+
+    def update_basic_system_prompt(self, system_prompt):
+        self.system_prompt_short = system_prompt
+        self.response_cache.clear()
 
     @app_commands.command(name="ingestprompt", description="[Admin only]")
     @app_commands.check(is_creator)
     async def ingest_latest_prompt(self, interaction):
         try:
-            self.update_baisc_system_prompt()
-            logger.info("Text prompt reloaded into memory.")
-            await interaction.response.send_message(f"Prompt updated!", ephemeral=True)
+            await interaction.response.defer(ephemeral=True)
+            reloaded = await self.file_watcher.check()
+            logger.info(f"Reloaded on request: {reloaded}")
+            if reloaded:
+                await interaction.followup.send(f"Reloaded: {', '.join(reloaded)}", ephemeral=True)
+            else:
+                await interaction.followup.send("Nothing changed since the last reload.", ephemeral=True)
         except Exception as e:
             logger.exception(f"Error when ingesting latest prompt: {e}")
 
-    @app_commands.command(name="chat", description="Start a single-round conversation with the bot (no memory).")
-    @app_commands.describe(message="Type anything you want to say.")
+    @app_commands.command(name="aistats", description="[Admin only]")
+    @app_commands.check(is_creator)
+    async def ai_stats(self, interaction: discord.Interaction):
+        """Show the live stats of the model router, the request scheduler and the context caches."""
+        try:
+            def fmt(seconds):
+                return f"{seconds:.1f}s" if seconds is not None else "n/a"
+
+            router_stats = self.router.get_stats()
+            latency_stats = self.latency_recorder.get_stats()
+            lines = ["**Models** (rolling, in order of preference)"]
+            for model, stats in router_stats["models"].items():
+                ttft = latency_stats.get(model, {})
+                lines.append(
+                    f"`{model}`: {stats['requests']} requests, p50 {fmt(stats['p50'])}, p95 {fmt(stats['p95'])}, "
+                    f"error rate {stats['error_rate']:.0%}, first token p50 {fmt(ttft.get('ttft_p50'))}"
+                )
+            lines.append(
+                f"Hedges sent: {router_stats['hedges_sent']}, won: {router_stats['hedges_won']}, "
+                f"fallbacks: {router_stats['fallbacks']}"
+            )
+            scheduler_stats = self.scheduler.get_stats()
+            lines.append(
+                f"**Scheduler**: {scheduler_stats['in_flight']}/{scheduler_stats['max_concurrency']} in flight, "
+                f"{scheduler_stats['queue_depth']} queued (max {scheduler_stats['max_queue_depth']}), "
+                f"wait p50 {fmt(scheduler_stats['wait_p50'])}, p95 {fmt(scheduler_stats['wait_p95'])}, "
+                f"{scheduler_stats['rejected']} rejected"
+            )
+            concurrency_stats = self.concurrency.get_stats()
+            lines.append(
+                f"**Concurrency limit**: {concurrency_stats['limit']} "
+                f"({concurrency_stats['decreases']} decreases)"
+            )
+            for model, breaker in self.breakers.items():
+                breaker_stats = breaker.get_stats()
+                lines.append(
+                    f"Circuit `{model}`: {breaker_stats['state']}, opened {breaker_stats['times_opened']} times, "
+                    f"{breaker_stats['refused']} refused"
+                )
+            cache_stats = self.response_cache.get_stats()
+            lines.append(
+                f"**Response cache**: {cache_stats['entries']} entries, hit rate {cache_stats['hit_rate']}, "
+                f"~{cache_stats['saved_tokens']} tokens saved"
+            )
+            image_stats = self.image_cache.get_stats()
+            lines.append(
+                f"**Image cache**: {image_stats['images']} images ({image_stats['bytes'] / 1024 / 1024:.1f} MB), "
+                f"hit rate {image_stats['hit_rate']}, {image_stats['near_duplicates']} near-duplicates, "
+                f"{image_stats['evictions']} evicted"
+            )
+            lines.append(f"**Message buffer**: {self.message_buffer.get_stats()}")
+            lines.append(f"**Reply chains**: {self.reply_chain_resolver.get_stats()}")
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message("\n".join(lines)[:1990], ephemeral=True)
+        except Exception as e:
+            logger.exception(f"Error when showing AI stats: {e}")
+
+    @app_commands.command(name="usage", description="[Admin only]")
+    @app_commands.describe(days="Number of days to report, including today (UTC).")
+    @app_commands.check(is_creator)
+    async def usage(self, interaction: discord.Interaction, days: app_commands.Range[int, 1, MAX_REPORT_DAYS] = 7):
+        """Show the AI usage of the latest days: totals, top consumers and latency per model."""
+        try:
+            def fmt(seconds):
+                return f"{seconds:.1f}s" if seconds is not None else "n/a"
+
+            report = self.usage_ledger.get_period_report(days)
+            total = report["total"]
+            last_24h = report["last_24h"]
+            lines = [
+                f"**AI usage, last {days} days**: {total['requests']} requests, {total['total_tokens']} tokens "
+                f"({total['prompt_tokens']} prompt, {total['response_tokens']} response, "
+                f"{total['thought_tokens']} thoughts), {total['images']} images, {total['cache_hits']} cache hits, "
+                f"{total['errors']} errors",
+                f"Last 24h: {last_24h['requests']} requests, {last_24h['total_tokens']} tokens, "
+                f"p95 {fmt(last_24h['latency_p95'])}",
+                "**Top consumers**"
+            ]
+            for user_id, stats in report["users"]:
+                user = self.bot.get_user(user_id)
+                name = "(bot)" if user_id == 0 else (user.name if user else str(user_id))
+                lines.append(
+                    f"{name}: {stats['requests']} requests, {stats['total_tokens']} tokens, "
+                    f"p95 {fmt(stats['latency_p95'])}"
+                )
+            lines.append("**Models**")
+            for model, stats in sorted(report["models"].items(), key=lambda item: -item[1]["requests"]):
+                lines.append(
+                    f"`{model}`: {stats['requests']} requests, {stats['total_tokens']} tokens, "
+                    f"p50 {fmt(stats['latency_p50'])}, p95 {fmt(stats['latency_p95'])}, {stats['errors']} errors"
+                )
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message("\n".join(lines)[:1990], ephemeral=True)
+        except Exception as e:
+            logger.exception(f"Error when showing AI usage: {e}")
+
+    @app_commands.command(name="forget", description="Make the bot forget your /chat conversation.")
+    async def forget(self, interaction: discord.Interaction):
+        self.conversation_store.forget(f"user:{interaction.user.id}")
+        # noinspection PyUnresolvedReferences
+        await interaction.response.send_message("Done, I forgot our conversation.", ephemeral=True)
+
+    @app_commands.command(name="chat", description="Chat with the bot. It remembers your recent conversation.")
+    @app_commands.describe(
+        message="Type anything you want to say.",
+        fresh="Ask the AI again instead of reusing a recent answer to the same question."
+    )
     @app_commands.checks.cooldown(20, 3600, key=lambda i: (i.guild_id, i.user.id))  # 3 times per minute per user
     # @app_commands.checks.cooldown(50, 86400, key=lambda i: (i.guild_id, i.user.id))  # 50 times per day per user
     # @app_commands.checks.cooldown(10, 60, key=lambda i: i.guild_id)  # 15 times per minute for all users
     # @app_commands.checks.cooldown(500, 86400, key=lambda i: i.guild_id)  # 500 times per day for all users
-    async def chat(self, interaction: discord.Interaction, message: str):
-        await self.chat_with_prompt(interaction, message, use_chat_history=False)
+    async def chat(self, interaction: discord.Interaction, message: str, fresh: bool = False):
+        await self.chat_with_prompt(interaction, message, use_chat_history=False, use_cache=not fresh)
 
-    @app_commands.command(name="chat2", description="Start a single-round conversation with the bot (no memory). Slower than /chat, but might be smarter")
+    @app_commands.command(name="chat2", description="Chat with the bot, with our chat history as context. Slower than /chat, but might be smarter")
     @app_commands.describe(message="Type anything you want to say.")
     @app_commands.checks.cooldown(20, 3600, key=lambda i: (i.guild_id, i.user.id))  # 3 times per minute per user
     # @app_commands.checks.cooldown(50, 86400, key=lambda i: (i.guild_id, i.user.id))  # 50 times per day per user
@@ -107,8 +475,10 @@ class AIChat(commands.Cog):
     async def chat2(self, interaction: discord.Interaction, message: str):
         await self.chat_with_prompt(interaction, message, use_chat_history=True)
 
-    async def chat_with_prompt(self, interaction: discord.Interaction, message: str, use_chat_history=False):
+    async def chat_with_prompt(self, interaction: discord.Interaction, message: str, use_chat_history=False,
+                               use_cache=False):
         """Handles the `/chat` command."""
+        reply_message: ProgressiveMessage | None = None
         try:
             if interaction.guild is None or interaction.guild.id != D2K_SERVER_ID:
                 # noinspection PyUnresolvedReferences
@@ -121,10 +491,11 @@ class AIChat(commands.Cog):
                 await interaction.response.send_message("Your message cannot exceed 1000 characters.", ephemeral=True)
                 return
 
-            # Check against rate limiter
-            if not self.cooldown_manager.try_add_message(interaction.user):
+            # Check against rate limiter, before deferring so a rejection can still be ephemeral
+            if not await self.cooldown_manager.acquire(interaction.user.id, timeout=self.rate_limit_waits["chat"]):
+                retry_after = self.cooldown_manager.retry_after(interaction.user.id)
                 # noinspection PyUnresolvedReferences
-                await interaction.response.send_message("You have exceeded the rate limit. Please try again later.", ephemeral=True)
+                await interaction.response.send_message(rate_limit_message(retry_after), ephemeral=True)
                 return
 
             # Get user details
@@ -147,90 +518,413 @@ class AIChat(commands.Cog):
                 f"User (ID: {user_id}, Nickname: {user_nickname}, Timestamp: {timestamp}) says:\n"
                 f"{message}"
             )
+            conversation_key = f"user:{user_id}"
+            memory = self.conversation_store.build_context(conversation_key)
+            if memory:
+                prompt = f"{memory}\n\n{prompt}"
 
             logger.debug(f"Sending prompt: \n{prompt}")
 
             # noinspection PyUnresolvedReferences
             await interaction.response.defer()  # Defer response to allow processing time
 
-            ai_reply, response_info = await self.generate_ai_reply(prompt, use_chat_history=use_chat_history)
-            usage_metadata = response_info.get("usage_metadata", {})
+            header = f"**{user_nickname} (at {timestamp}):** {message}\n\n**Response:** "
+            if self.stream_replies:
+                placeholder = await interaction.followup.send(f"{header}*Thinking...*", wait=True)
+                reply_message = ProgressiveMessage(placeholder, prefix=header)
+
+            async def show_queue_position(position, estimated_wait):
+                nonlocal reply_message
+                status = f"*Queued, position {position} (about {estimated_wait:.0f}s)...*"
+                if reply_message:
+                    await reply_message.show_status(status)
+                else:
+                    placeholder = await interaction.followup.send(f"{header}{status}", wait=True)
+                    reply_message = ProgressiveMessage(placeholder, prefix=header)
+
+            if user_id == APP_CREATOR_ID:
+                priority = PRIORITY_ADMIN
+            else:
+                priority = PRIORITY_CHAT_LONG if use_chat_history else PRIORITY_CHAT
+
+            try:
+                ai_reply, response_info = await self.generate_ai_reply(
+                    prompt,
+                    use_chat_history=use_chat_history,
+                    on_partial=reply_message.update if reply_message else None,
+                    priority=priority,
+                    on_queued=show_queue_position,
+                    latency_budget=self.latency_budgets["chat2" if use_chat_history else "chat"],
+                    history_query=message,
+                    # A cached reply only answers the same conversation, the memory is part of the key
+                    cache_query=message if use_cache else None,
+                    cache_context=memory,
+                    user_id=user_id,
+                    command="chat2" if use_chat_history else "chat"
+                )
+            except (QueueFullError, CircuitOpenError) as e:
+                logger.warning(f"AI is busy, refusing request: {e}")
+                busy_text = busy_message(e)
+                if reply_message:
+                    await reply_message.finish(busy_text)
+                else:
+                    await interaction.followup.send(busy_text, ephemeral=True)
+                return
+            usage_metadata = response_info.get("usage_metadata") or {}
             logger.info(
                 f"Prompt tokens: {usage_metadata.get("prompt_token_count", None)}, "
                 f"Response tokens: {usage_metadata.get("candidates_token_count", None)}."
             )
 
-            # Format the final output
-            final_response = f"**{user_nickname} (at {timestamp}):** {message}\n\n**Response:** {ai_reply}"
+            self.remember_turn(conversation_key, message, ai_reply, user_nickname)
 
-            await interaction.followup.send(final_response[:1990])
+            # Format the final output
+            if reply_message:
+                await reply_message.finish(ai_reply)
+            else:
+                await interaction.followup.send(f"{header}{ai_reply}"[:1990])
 
         except Exception as e:
             logger.exception(f"Error in AI chat command: {e}")
-            await interaction.followup.send(f"An error occurred while generating a response. Try again later. {e}", ephemeral=True)
+            error_text = f"An error occurred while generating a response. Try again later. {e}"
+            if reply_message:
+                await reply_message.finish(error_text)
+            else:
+                await interaction.followup.send(error_text, ephemeral=True)
 
-    async def generate_ai_reply(self, message_content, use_chat_history=False):
-        system_prompt = self.system_prompt_long if use_chat_history else self.system_prompt_short
-        # Generate AI response
-        response = await self.aiclient.aio.models.generate_content(
-            model=self.model,
+    def build_generate_config(self, system_prompt):
+        return types.GenerateContentConfig(
+            system_instruction=system_prompt,
+            max_output_tokens=100000,
+            # seed=42,
+            safety_settings=[
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE
+                )
+            ]
+        )
+
+    async def call_model(self, model, message_content, config, on_partial=None):
+        """
+        One generate_content call, streamed if on_partial is given, guarded by the circuit breaker of the model.
+        Its latency (to the first token if streamed) or overload error feeds the adaptive concurrency limit.
+
+        Returns:
+            (response, reply_text, time_to_first_token). For a streamed call the response is the last chunk,
+            and time_to_first_token is None for a non-streamed call.
+
+        Raises:
+            CircuitOpenError: If the circuit of the model is open
+        """
+        breaker = self.breakers[model]
+        breaker.before_request()
+        start_time = time.perf_counter()
+        try:
+            result = await self._generate_content(model, message_content, config, on_partial)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except Exception as e:
+            if is_retryable_error(e):
+                breaker.record_failure(get_retry_after(e))
+                self.concurrency.record_overload()
+            elif is_transport_error(e):
+                breaker.record_failure()
+            elif isinstance(e, genai_errors.ClientError):
+                breaker.record_success()  # Answered with a 4xx, the request itself was wrong
+            else:
+                breaker.record_cancelled()  # Says nothing about the service (e.g. a bug here), only ends a probe
+            raise
+        breaker.record_success()
+        time_to_first_token = result[2]
+        self.concurrency.record_success(
+            time_to_first_token if time_to_first_token is not None else time.perf_counter() - start_time
+        )
+        return result
+
+    async def _generate_content(self, model, message_content, config, on_partial):
+        start_time = time.perf_counter()
+        if on_partial is None:
+            response = await self.aiclient.aio.models.generate_content(
+                model=model,
+                contents=message_content,
+                config=config,
+            )
+            return response, response.text, None
+
+        response = None
+        time_to_first_token = None
+        chunks = []
+        async for chunk in await self.aiclient.aio.models.generate_content_stream(
+            model=model,
             contents=message_content,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                max_output_tokens=100000,
-                # seed=42,
-                safety_settings=[
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    )
-                ]
-            ),
+            config=config,
+        ):
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start_time
+            response = chunk  # The last chunk carries the usage metadata of the whole response
+            if chunk.text:
+                chunks.append(chunk.text)
+                await on_partial("".join(chunks))
+        return response, "".join(chunks), time_to_first_token
+
+    async def call_model_hedged(self, model, hedge_model, hedge_delay, message_content, config, on_partial=None):
+        """
+        Call a model, and also the hedge model if the first one is not done after hedge_delay seconds.
+        The first call to produce output wins, the other is cancelled.
+
+        Returns:
+            (model, response, reply_text, time_to_first_token) of the winning call
+        """
+        winner = None  # For streamed calls, the first model to produce a chunk
+        tasks = {}
+
+        def forward_partial(task_model):
+            async def partial(text):
+                nonlocal winner
+                if winner is None:
+                    winner = task_model
+                if winner == task_model:
+                    await on_partial(text)
+            return partial
+
+        async def run(task_model):
+            start_time = time.perf_counter()
+            try:
+                result = await self.call_model(
+                    task_model, message_content, config, forward_partial(task_model) if on_partial else None
+                )
+            except asyncio.CancelledError:
+                # Lost the race. Its elapsed time is a lower bound of its latency, keep it so the stats stay honest
+                self.router.record_success(task_model, time.perf_counter() - start_time)
+                raise
+            except Exception as e:
+                if is_retryable_error(e):
+                    self.router.record_error(task_model)
+                raise
+            self.router.record_success(task_model, time.perf_counter() - start_time)
+            return task_model, *result
+
+        tasks[asyncio.create_task(run(model))] = model
+        try:
+            pending = set(tasks)
+            if hedge_model is not None:
+                # A call finished within the delay stays in pending, the loop below picks it up right away
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done and winner is None:
+                    logger.info(f"{model} is past its p95 latency ({hedge_delay:.1f}s), hedging with {hedge_model}.")
+                    self.router.hedges_sent += 1
+                    hedge_task = asyncio.create_task(run(hedge_model))
+                    tasks[hedge_task] = hedge_model
+                    pending.add(hedge_task)
+
+            error = None
+            spare_result = None  # Finished after another model already started streaming
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_model = tasks[task]
+                    if task.exception() is not None:
+                        error = task.exception()
+                        if winner == task_model:
+                            winner = None  # Let the other call take over the output
+                        continue
+                    if winner is None or winner == task_model:
+                        if task_model == hedge_model:
+                            self.router.hedges_won += 1
+                        return task.result()
+                    spare_result = task.result()
+            if spare_result is not None:
+                return spare_result
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call_model_routed(self, message_content, config, on_partial=None, latency_budget=None, attempts=None):
+        """
+        Call the model picked by the router for the latency budget.
+        Falls back to the next model on rate limit (429) or server (5xx) errors.
+
+        Args:
+            attempts: Optional list the models are appended to as they are tried
+
+        Returns:
+            (model, response, reply_text, time_to_first_token)
+        """
+        candidates = [model for model in self.router.choose(latency_budget) if self.breakers[model].allows_request()]
+        if not candidates:
+            raise CircuitOpenError("The circuits of all models are open.", retry_after=self.models_retry_after())
+        last_error = None
+        for i, model in enumerate(candidates):
+            if i > 0:
+                self.router.fallbacks += 1
+                logger.warning(f"Falling back to {model} after error: {last_error}")
+            hedge_model, hedge_delay = self.router.get_hedge(model) if self.hedge_requests else (None, None)
+            if hedge_model is not None and not self.breakers[hedge_model].allows_request():
+                hedge_model, hedge_delay = None, None
+            if attempts is not None:
+                attempts.append(model)
+            try:
+                return await self.call_model_hedged(
+                    model, hedge_model, hedge_delay, message_content, config, on_partial
+                )
+            except Exception as e:
+                if not is_retryable_error(e) and not isinstance(e, CircuitOpenError):
+                    raise
+                last_error = e
+        raise last_error
+
+    def models_retry_after(self):
+        """Seconds until a model accepts requests again, 0 if one does now."""
+        return min(breaker.retry_after() for breaker in self.breakers.values())
+
+    async def generate_ai_reply(self, message_content, use_chat_history=False, on_partial=None,
+                                priority=PRIORITY_CHAT, on_queued=None, latency_budget=None, history_query=None,
+                                cache_query=None, cache_context="", user_id=0, command="other"):
+        """
+        Generate the AI reply of a prompt.
+
+        Args:
+            message_content: The prompt, a string or a list of strings and images
+            use_chat_history: Add the chat history snippets relevant to history_query to the system prompt
+            on_partial: Optional async callback receiving the reply text generated so far.
+                If given, the response is streamed and the callback is called on every chunk.
+            priority: Priority in the request scheduler, lower values are served first
+            on_queued: Optional async callback (position, estimated_wait) called while waiting in the queue
+            latency_budget: Seconds (p95) the model call should take at most, used to pick the model
+            history_query: Text to retrieve chat history snippets for, usually the user's message
+            cache_query: If given, the reply is looked up in and stored to the response cache under this text and
+                user_id
+            cache_context: Text of message_content the reply depends on besides cache_query (e.g. the conversation
+                memory), part of the cache key
+            user_id: User the request is accounted to in the usage ledger
+            command: Command the request is accounted to in the usage ledger, one of usage_ledger.COMMANDS
+
+        Returns:
+            (ai_reply, response_info)
+
+        Raises:
+            QueueFullError: If too many requests are already waiting
+            CircuitOpenError: If every model is failing: circuits open, or rate limited / overloaded on every fallback
+        """
+        system_prompt = self.build_system_prompt(use_chat_history, history_query)
+        config = self.build_generate_config(system_prompt)
+
+        if cache_query is not None:
+            # Keyed on the preferred model, the reply is stored under the same key if a hedge or fallback answers
+            cache_key = self.response_cache.make_key(
+                cache_query, self.router.choose(latency_budget)[0], system_prompt, user_id, cache_context
+            )
+            cached_reply = self.response_cache.get(cache_key)
+            if cached_reply is not None:
+                logger.info(f"Serving cached reply (cache stats: {self.response_cache.get_stats()}).")
+                self.record_usage(user_id, command, "cache", None, 0, 0.0, cache_hit=True)
+                return cached_reply, {"cache_hit": True}
+
+        images = sum(1 for part in message_content if not isinstance(part, str)) \
+            if isinstance(message_content, list) else 0
+
+        # Answer right away when every model is failing, instead of queueing a request bound to fail
+        retry_after = self.models_retry_after()
+        if retry_after > 0:
+            raise CircuitOpenError("The circuits of all models are open.", retry_after=retry_after)
+
+        # Generate AI response
+        async with self.scheduler.slot(priority, on_queued):
+            start_time = time.perf_counter()
+            attempts = []
+            try:
+                model, response, reply_text, time_to_first_token = await self.call_model_routed(
+                    message_content, config, on_partial, latency_budget, attempts
+                )
+            except Exception as e:
+                # Accounted to the last model tried, or to the preferred one if every circuit was open
+                failed_model = attempts[-1] if attempts else self.router.choose(latency_budget)[0]
+                self.record_usage(user_id, command, failed_model, None, images, time.perf_counter() - start_time,
+                                  error=True)
+                if is_retryable_error(e):
+                    raise CircuitOpenError(f"All models failed: {e}", retry_after=get_retry_after(e)) from e
+                raise
+            total_latency = time.perf_counter() - start_time
+        self.latency_recorder.record(model, total_latency, time_to_first_token)
+        self.record_usage(user_id, command, model, response, images, total_latency)
+        logger.info(
+            f"Model {model} replied in {total_latency:.2f}s"
+            + (f" (first token after {time_to_first_token:.2f}s)." if time_to_first_token is not None else ".")
         )
+        logger.debug(f"Scheduler stats: {self.scheduler.get_stats()}")
 
-        ai_reply = response.text if response.text else "I couldn't generate a response. Try again!"
+        ai_reply = reply_text if reply_text else "I couldn't generate a response. Try again!"
+        if response is None:
+            return ai_reply, {}
         response_json = response.to_json_dict()
         total_token_count = response_json.get("usage_metadata", {}).get("total_token_count", 0)
         logger.debug(f"Total token count of this request: {total_token_count}")
+        if cache_query is not None and reply_text:
+            self.response_cache.put(cache_key, ai_reply, total_token_count or 0)
         response_info = response.model_dump()
         logger.debug(f"response info: \n{json.dumps(response_info, indent=2)}")
 
         return ai_reply, response_info
 
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if payload.guild_id == D2K_SERVER_ID:
+            self.message_buffer.edit(payload.message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id == D2K_SERVER_ID:
+            self.message_buffer.delete(payload.channel_id, payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.guild_id == D2K_SERVER_ID:
+            for message_id in payload.message_ids:
+                self.message_buffer.delete(payload.channel_id, message_id)
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
+        reply_message: ProgressiveMessage | None = None
         try:
-            # Ignore messages from the bot itself
-            if message.author == self.bot.user:
-                return
-
             # Check if the message is in the correct guild
             if message.guild is None or message.guild.id != D2K_SERVER_ID:
                 return
 
+            # Buffer every message of the guild (including the bot's own) as context for later mentions
+            self.message_buffer.add(message)
+
+            # Ignore messages from the bot itself
+            if message.author == self.bot.user:
+                return
+
             # Check if the bot was mentioned
             if self.bot.user not in message.mentions:
                 return
 
-            # Check against rate limiter
-            if not self.cooldown_manager.try_add_message(message.author):
-                await message.reply("You have exceeded the rate limit. Please try again later.")
+            # Check against rate limiter, waiting up to rate_limit_waits["mention"] seconds for a free slot before
+            # replying publicly with the time to wait
+            if not await self.cooldown_manager.acquire(message.author.id, timeout=self.rate_limit_waits["mention"]):
+                await message.reply(rate_limit_message(self.cooldown_manager.retry_after(message.author.id)))
                 return
 
             # Extract message content
@@ -249,43 +943,50 @@ class AIChat(commands.Cog):
             ###################
 
             # For recent messages, only read the message content
-            recents = await get_recent_messages(message.channel)
-            to_be_sent = ["Recent messages in the channel:"]
-            to_be_sent += recents
+            recents = await self.message_buffer.get_recent(message.channel)
+            logger.debug(f"Message buffer stats: {self.message_buffer.get_stats()}")
 
-            # For reply chain, read all the attached images
-            total_images = 0
-            reply_chain_messages = await get_referenced_message(message)
-            if reply_chain_messages:
-                to_be_sent.append("Reply chain of the latest message:")
-            for msg in reply_chain_messages:
-                to_be_sent.append(format_message(msg))
-                if msg.attachments:
-                    for attachment in msg.attachments:
-                        if attachment.content_type and attachment.content_type.startswith('image/'):
-                            image = await download_image(attachment.url)
-                            if image:
-                                total_images += 1
-                                to_be_sent.append(image)
+            # For reply chain, read all the attached images.
+            # Image attachments are placeholders until they are all ingested concurrently.
+            reply_chain_messages = await self.reply_chain_resolver.resolve(message)
+            reply_chain = [
+                (msg.id, format_message(msg), [a for a in msg.attachments if is_image_attachment(a)])
+                for msg in reply_chain_messages
+            ]
 
             # Get timestamp of the message and format it (UTC time)
             timestamp = message.created_at.strftime("%Y-%m-%d %H:%M:%S UTC")
 
             # Create the latest prompt
-            to_be_sent.append(
+            latest_parts = [
                 f"Latest message for you to reply:\n"
                 f"User (ID: {user_id}, Nickname: {user_nickname}, Timestamp: {timestamp}) says:\n"
                 f"{content}\n"
                 f"**The timestamps are just for your reference to provide more context. DO NOT add these prefixes or any other prefix when you reply! Your output should only be your reply, without any extra text.**"
-            )
+            ]
+            latest_parts += [attachment for attachment in message.attachments if is_image_attachment(attachment)]
+            conversation_key = f"channel:{message.channel.id}"
+            memory = self.conversation_store.build_context(conversation_key)
+            if memory:
+                latest_parts.insert(0, f"Your memory of this channel:\n{memory}")
 
-            if message.attachments:
-                for attachment in message.attachments:
-                    if attachment.content_type and attachment.content_type.startswith('image/'):
-                        image = await download_image(attachment.url)
-                        if image:
-                            total_images += 1
-                            to_be_sent.append(image)
+            # Deduplicate and trim the context to the token budget, before any image is downloaded
+            to_be_sent = self.prompt_builder.build("mention", recents, reply_chain, message.id, latest_parts)
+
+            # Fetch and preprocess all the images at once, then swap them in for the placeholders
+            attachments = [m for m in to_be_sent if isinstance(m, discord.Attachment)]
+            images = iter(await self.image_ingestor.ingest(self.bot.http_client.session, attachments))
+            total_images = 0
+            resolved = []
+            for m in to_be_sent:
+                if not isinstance(m, discord.Attachment):
+                    resolved.append(m)
+                    continue
+                image = next(images)
+                if image:
+                    total_images += 1
+                    resolved.append(types.Part.from_bytes(data=image, mime_type="image/jpeg"))
+            to_be_sent = resolved
 
             info_to_log = f"Sending prompt with {total_images} images: \n"
             for m in to_be_sent:
@@ -295,24 +996,58 @@ class AIChat(commands.Cog):
                     info_to_log += f"<IMG>\n"
             logger.debug(info_to_log)
 
+            async def show_queue_position(position, estimated_wait):
+                nonlocal reply_message
+                status = f"*Queued, position {position} (about {estimated_wait:.0f}s)...*"
+                if reply_message:
+                    await reply_message.show_status(status)
+                else:
+                    reply_message = ProgressiveMessage(await message.reply(status))
+
             # Show typing indicator
             async with message.channel.typing():
+                if self.stream_replies:
+                    reply_message = ProgressiveMessage(await message.reply("*Thinking...*"))
+
                 # Use long prompt for more context
-                ai_reply, response_info = await self.generate_ai_reply(
-                    to_be_sent,
-                    use_chat_history=False
-                )
-                usage_metadata = response_info.get("usage_metadata", {})
+                try:
+                    ai_reply, response_info = await self.generate_ai_reply(
+                        to_be_sent,
+                        use_chat_history=False,
+                        on_partial=reply_message.update if reply_message else None,
+                        priority=PRIORITY_ADMIN if user_id == APP_CREATOR_ID else PRIORITY_MENTION,
+                        on_queued=show_queue_position,
+                        latency_budget=self.latency_budgets["mention"],
+                        user_id=user_id,
+                        command="mention"
+                    )
+                except (QueueFullError, CircuitOpenError) as e:
+                    logger.warning(f"AI is busy, refusing request: {e}")
+                    busy_text = busy_message(e)
+                    if reply_message:
+                        await reply_message.finish(busy_text)
+                    else:
+                        await message.reply(busy_text)
+                    return
+                usage_metadata = response_info.get("usage_metadata") or {}
                 logger.info(
                     f"Prompt tokens: {usage_metadata.get("prompt_token_count", None)}, "
                     f"Response tokens: {usage_metadata.get("candidates_token_count", None)}."
                 )
-                await message.reply(ai_reply[:1990])
+                self.remember_turn(conversation_key, content, ai_reply, user_nickname)
+                if reply_message:
+                    await reply_message.finish(ai_reply)
+                else:
+                    await message.reply(ai_reply[:1990])
 
         except Exception as e:
             logger.exception(f"Error in AI chat command: {e}")
             # Explicitly reply
-            await message.reply(f"An error occurred while generating a response. Try again later. {e}")
+            error_text = f"An error occurred while generating a response. Try again later. {e}"
+            if reply_message:
+                await reply_message.finish(error_text)
+            else:
+                await message.reply(error_text)
 
 async def setup(bot):
     """Registers the cog with the bot."""
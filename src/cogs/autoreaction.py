@@ -9,7 +9,7 @@ from utils.rate_limiter import MixedRateLimiter
 logger = logging.getLogger(__name__)
 
 class AutoReact(commands.Cog):
-    def __init__(self, bot, max_messages=3, cooldown_period=60):
+    def __init__(self, bot, max_messages=3, cooldown_period=60, max_wait=20):
         self.bot = bot
         self.jo_pattern = re.compile(r'\bjo\b', re.IGNORECASE)  # Matches "Jo" or "jo" as a standalone word
         self.cooldown_manager = MixedRateLimiter()
@@ -26,6 +26,8 @@ class AutoReact(commands.Cog):
         # Customizable cooldown settings (maximum X messages per Y seconds)
         self.max_messages = max_messages
         self.cooldown_period = cooldown_period
+        # Seconds a reaction may be delayed to fit the cooldown before it is dropped
+        self.max_wait = max_wait
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -37,8 +39,9 @@ class AutoReact(commands.Cog):
         if not self.jo_pattern.search(message.content):
             return
 
-        # Check against rate limiter
-        if not self.cooldown_manager.try_add_message(message.author.id):
+        # Check against rate limiter, delaying the reaction a little rather than dropping it
+        if not await self.cooldown_manager.acquire(message.author.id, timeout=self.max_wait):
+            logger.debug(f"Reaction to message {message.id} dropped, {message.author.id} is rate limited.")
             return
 
         chosen_reactions = []
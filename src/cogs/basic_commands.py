@@ -76,7 +76,7 @@ class BasicCommands(commands.Cog):
         )
         embed.add_field(
             name="💬 /chat & /chat2",
-            value="Start a **single-round conversation** with the bot (no memory, no context preservation).",
+            value="**Chat** with the bot. It remembers your recent conversation, use /forget to clear it.",
             inline=False
         )
 
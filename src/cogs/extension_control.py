@@ -98,6 +98,30 @@ class ExtensionControl(commands.Cog):
         except Exception as e:
             logger.exception(f"Unexpected error when sending error message when unloading extension `{ext}`: {e}")
 
+    @app_commands.command(name="httpstats", description="[Admin only]")
+    @app_commands.check(is_creator)
+    async def httpstats(self, interaction: discord.Interaction):
+        """Slash command to show the per-host stats of the shared HTTP client"""
+        try:
+            stats = self.bot.http_client.get_stats()
+            if not stats:
+                # noinspection PyUnresolvedReferences
+                await interaction.response.send_message("No outbound HTTP requests yet.", ephemeral=True)
+                return
+            lines = []
+            for host, host_stats in stats.items():
+                histogram = ", ".join(f"{bucket}: {count}" for bucket, count in host_stats["latency_histogram_ms"].items() if count)
+                lines.append(
+                    f"**{host}**: {host_stats['requests']} requests, {host_stats['errors']} errors, "
+                    f"{host_stats['reused_connections']} reused / {host_stats['new_connections']} new connections, "
+                    f"avg {host_stats['avg_latency_ms']} ms\n"
+                    f"  Latency (ms): {histogram}"
+                )
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message("\n".join(lines)[:1990], ephemeral=True)
+        except Exception as e:
+            logger.exception(f"Unexpected error when showing HTTP stats: {e}")
+
 
 async def setup(bot):
     await bot.add_cog(ExtensionControl(bot), guild=guild)
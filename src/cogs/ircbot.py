@@ -255,10 +255,13 @@ class IRCCog(commands.Cog):
             channel_key=CNCNET_CHANNEL_KEY
         )
         self.CHANNEL_ID = PLAYER_ONLINE_CHANNEL_ID
+        # The player list message, edited in place and only when the player list changed
+        self.status_messages = msg_helper.StatusMessageCache()
         self.irc_thread = threading.Thread(target=self.irc_client.connect_and_run, daemon=True)
 
     async def cog_load(self):
         logger.info("Loading cog: IRCCog")
+        await asyncio.to_thread(self.status_messages.load)
         self.irc_thread.start()
         self.who_task.start()  # Start periodic WHO queries
         self.print_players_to_discord.start()  # Start print player list
@@ -322,7 +325,12 @@ class IRCCog(commands.Cog):
                     color=discord.Color.blue()
                 )
             embed.add_field(name="Last Updated", value=f"<t:{current_timestamp}:F>", inline=False)
-            await msg_helper.send_or_update_embed(self.bot.user.id, channel, embed)
+            await msg_helper.send_or_update_embed(self.bot.user.id, channel, embed, cache=self.status_messages)
+            if self.status_messages.dirty:
+                try:
+                    await asyncio.to_thread(self.status_messages.save, self.status_messages.snapshot())
+                except OSError as e:
+                    logger.error(f"Error saving status messages: {e}")
         else:
             logger.error(f"Channel with ID {self.CHANNEL_ID} not found.")
 
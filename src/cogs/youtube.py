@@ -40,18 +40,17 @@ def save_youtube_channels(data):
         json.dump(data, file, indent=4)
 
 
-async def get_youtuber_info(custom_handle):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url_channels, params={
-            "part": "snippet,id,contentDetails",
-            "forHandle": custom_handle,  # Use the handle to search for the channel ID
-            "key": YOUTUBE_API_TOKEN
-        }) as response:
-            if response.status != 200:
-                logger.error(f"[get_youtuber_info] Error fetching data: {response.status}")
-                return None
-
-            channel_data = await response.json()
+async def get_youtuber_info(session: aiohttp.ClientSession, custom_handle):
+    async with session.get(url_channels, params={
+        "part": "snippet,id,contentDetails",
+        "forHandle": custom_handle,  # Use the handle to search for the channel ID
+        "key": YOUTUBE_API_TOKEN
+    }) as response:
+        if response.status != 200:
+            logger.error(f"[get_youtuber_info] Error fetching data: {response.status}")
+            return None
+
+        channel_data = await response.json()
 
     if "items" not in channel_data or not channel_data["items"]:
         logger.error(f"[get_youtuber_info] ❌ No channel found for this handle: {custom_handle}")
@@ -60,17 +59,16 @@ async def get_youtuber_info(custom_handle):
 
     playlist_id = channel_info["contentDetails"]["relatedPlaylists"]["uploads"]
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url_playlist, params={
-            "part": "snippet",
-            "playlistId": playlist_id,
-            "maxResults": 1,
-            "key": YOUTUBE_API_TOKEN
-        }) as response:
-            if response.status != 200:
-                logger.error(f"[get_youtuber_info] Error fetching data in: {response.status}")
-                return None
-            play_list_data = await response.json()
+    async with session.get(url_playlist, params={
+        "part": "snippet",
+        "playlistId": playlist_id,
+        "maxResults": 1,
+        "key": YOUTUBE_API_TOKEN
+    }) as response:
+        if response.status != 200:
+            logger.error(f"[get_youtuber_info] Error fetching data in: {response.status}")
+            return None
+        play_list_data = await response.json()
     if "items" not in play_list_data or not play_list_data["items"]:
         logger.error(f"[get_youtuber_info] ❌ No videos found for playlist ID: {playlist_id}")
         return None
@@ -87,7 +85,7 @@ async def get_youtuber_info(custom_handle):
     return key_info
 
 
-async def get_latest_videos(playlist_id: str, after_timestamp: str, max_number=5):
+async def get_latest_videos(session: aiohttp.ClientSession, playlist_id: str, after_timestamp: str, max_number=5):
     """
     Fetch latest videos from a given playlist ID after the specified timestamp.
     """
@@ -95,18 +93,17 @@ async def get_latest_videos(playlist_id: str, after_timestamp: str, max_number=5
         logger.error("Malformed timestamp!")
         return []
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url_playlist, params={
-            "part": "snippet",
-            "playlistId": playlist_id,
-            "maxResults": max_number,
-            "key": YOUTUBE_API_TOKEN
-        }) as response:
-            if response.status != 200:
-                logger.error(f"[get_latest_videos] Error fetching data: {response.status}")
-                return []
+    async with session.get(url_playlist, params={
+        "part": "snippet",
+        "playlistId": playlist_id,
+        "maxResults": max_number,
+        "key": YOUTUBE_API_TOKEN
+    }) as response:
+        if response.status != 200:
+            logger.error(f"[get_latest_videos] Error fetching data: {response.status}")
+            return []
 
-            play_list_data = await response.json()
+        play_list_data = await response.json()
 
     if "items" not in play_list_data or not play_list_data["items"]:
         logger.error(f"[get_latest_videos] ❌ No videos found for playlist: {playlist_id}")
@@ -148,7 +145,9 @@ class YouTubeCog(commands.Cog):
         new_vid_list = []
         for player_name, player_info in self.player_youtube_info.items():
             last_video_ts = player_info["last_upload_datetime"]
-            new_videos = await get_latest_videos(player_info["playlist_id"], last_video_ts)
+            new_videos = await get_latest_videos(
+                self.bot.http_client.session, player_info["playlist_id"], last_video_ts
+            )
 
             if new_videos:
                 player_info["last_upload_datetime"] = new_videos[0]["published_at"]
@@ -227,11 +226,11 @@ class YouTubeCog(commands.Cog):
     @app_commands.check(is_creator)
     async def addytchannel(self, interaction, player_name: str, handle: str):
         update_player = player_name in self.player_youtube_info  # if already exists, then update, else add
-        try_get_indo = await get_youtuber_info(handle)
+        try_get_indo = await get_youtuber_info(self.bot.http_client.session, handle)
         if not try_get_indo:
             await interaction.response.send_message(f"❌ Youtuber handle **{handle}** not found.", ephemeral=True)
             return
-        self.player_youtube_info[player_name] = await get_youtuber_info(handle)
+        self.player_youtube_info[player_name] = try_get_indo
         save_youtube_channels(self.player_youtube_info)
         if update_player:
             await interaction.response.send_message(f"✅ Updated YouTube channel for **{player_name}**: {handle}", ephemeral=True)
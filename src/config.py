@@ -9,3 +9,4 @@ CNCNET_CHANNEL_KEY = os.getenv('CNCNET_CHANNEL_KEY')
 APP_CREATOR_ID = int(os.getenv('APP_CREATOR_ID'))
 GEMINI_API_TOKEN = os.getenv("GEMINI_API_TOKEN")
 YOUTUBE_API_TOKEN = os.getenv("YOUTUBE_API_TOKEN")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") or None  # Optional, e.g. the local stand-in of benchmarks/fake_gemini_server.py
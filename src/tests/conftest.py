@@ -0,0 +1,9 @@
+import os
+
+# config.py reads these at import, the tests need none of the real values
+for name, value in {
+    "DISCORD_TOKEN": "test", "D2K_SERVER_ID": "1", "PLAYER_ONLINE_CHANNEL_ID": "2",
+    "SEND_MESSAGE_CHANNEL_ID": "3", "VIDEO_CHANNEL_ID": "4", "APP_CREATOR_ID": "5",
+    "GEMINI_API_TOKEN": "test", "YOUTUBE_API_TOKEN": "test",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,122 @@
+"""
+Property checks of the rate limiter backends of utils/rate_limiter.py on randomized traces, run by
+test_rate_limiter.py and by the properties section of benchmarks/bench_rate_limiter.py.
+
+Every check returns None if the property holds, else a dict describing the first failure.
+"""
+import os
+import time
+from utils.rate_limiter import MixedRateLimiter
+
+
+class SimulatedClock:
+    """Deterministic clock, advanced explicitly and passed to the limiters as current_time."""
+
+    def __init__(self, start=1_700_000_000.0):
+        self.now = start
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
+
+
+def make_limiter(backend, limits, path=None):
+    """A limiter with the given per user limits only."""
+    limiter = MixedRateLimiter(backend, path=path)
+    for rate, per in limits:
+        limiter.add_per_user_limit(rate, per)
+    return limiter
+
+
+def random_case(rng):
+    """Random per-user limits and a trace of (key, time step): bursts, idle gaps and a clock that may go back."""
+    limits = [(rng.randint(1, 8), rng.choice([1, 5, 10, 60, 300])) for _ in range(rng.randint(1, 3))]
+    trace = []
+    for _ in range(rng.randint(50, 400)):
+        kind = rng.random()
+        if kind < 0.6:
+            step = rng.expovariate(rng.choice([0.5, 2, 20]))
+        elif kind < 0.95:
+            step = 0.0 if rng.random() < 0.3 else rng.uniform(0, 0.01)
+        else:
+            step = rng.choice([-0.5, 400.0])
+        trace.append((rng.randrange(5), step))
+    return limits, trace
+
+
+def check_same_decisions(backend, limits, trace):
+    """
+    backend must make the same decisions and report the same retry_after as exact. Returns a failure or None.
+
+    Once the clock went back, "exact" may have forgotten a key its shorter windows no longer hold while "log" keeps
+    it for the longest window, so from then on backend only must not allow more or report a shorter wait.
+    """
+    clock = SimulatedClock()
+    reference = make_limiter("exact", limits)
+    candidate = make_limiter(backend, limits)
+    went_back = False
+    for i, (key, step) in enumerate(trace):
+        went_back = went_back or step < 0
+        current_time = clock.advance(step)
+        expected_wait = reference.retry_after(key, current_time)
+        wait = candidate.retry_after(key, current_time)
+        if wait < expected_wait - 1e-6 or not went_back and wait > expected_wait + 1e-6:
+            return {"step": i, "retry_after": wait, "expected": expected_wait}
+        expected = reference.try_add_message(key, current_time)
+        allowed = candidate.try_add_message(key, current_time)
+        if allowed > expected or not went_back and allowed != expected:
+            return {"step": i, "allowed": allowed, "expected": expected}
+        if allowed != expected:
+            # The limiters now hold different timestamps, later decisions cannot be compared
+            return None
+    return None
+
+
+def check_gcra_bounds(limits, trace):
+    """
+    GCRA allows a full burst from idle, and never more than rate * (L + per) / per messages in L seconds
+    (plus the 1 ms tolerance of GCRARateLimiter).
+    """
+    clock = SimulatedClock()
+    limiter = make_limiter("gcra", limits)
+    burst_size = min(rate for rate, _ in limits)
+    burst = [limiter.try_add_message("idle", clock.now) for _ in range(burst_size)]
+    if not all(burst):
+        return {"burst": burst}
+    allowed = {}
+    for key, step in trace:
+        current_time = clock.advance(max(step, 0.0))  # The bound holds for a clock that does not go back
+        if limiter.try_add_message(key, current_time):
+            allowed.setdefault(key, []).append(current_time)
+    for key, times in allowed.items():
+        for rate, per in limits:
+            for length in (0.0, per / 2, per):
+                bound = rate * (length + per + 1e-3) / per
+                end = 0
+                for start, start_time in enumerate(times):
+                    while end < len(times) and times[end] - start_time <= length:
+                        end += 1
+                    if end - start > bound:
+                        return {"key": key, "limit": [rate, per], "length": length, "count": end - start}
+    return None
+
+
+def check_snapshot(backend, limits, trace, folder):
+    """Decisions after saving and loading a snapshot halfway must match those of the limiter that kept running."""
+    path = os.path.join(folder, f"{backend}.bin")
+    # Ends the first half in the past: load() drops what expired at the wall time, and so does the other limiter
+    clock = SimulatedClock(time.time() - 3600 - sum(step for _, step in trace))
+    limiter = make_limiter(backend, limits, path)
+    half = len(trace) // 2
+    for key, step in trace[:half]:
+        limiter.try_add_message(key, clock.advance(step))
+    limiter.save(limiter.snapshot())
+    restored = make_limiter(backend, limits, path)
+    restored.load()
+    clock.now = time.time()
+    for i, (key, step) in enumerate(trace[half:]):
+        current_time = clock.advance(abs(step))
+        expected = limiter.try_add_message(key, current_time)
+        if restored.try_add_message(key, current_time) != expected:
+            return {"step": half + i, "expected": expected}
+    return None
@@ -0,0 +1,197 @@
+import asyncio
+import csv
+import time
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("google.genai")
+
+import httpx
+from google.genai import errors as genai_errors
+from cogs.ai_chat import AIChat
+from utils.chat_index import ChatHistoryIndex
+from utils.circuit_breaker import CircuitBreaker, AdaptiveConcurrency, CLOSED, OPEN, HALF_OPEN
+from utils.model_router import ModelRouter
+
+
+def make_cog(latencies):
+    """Stand-in for AIChat, whose call_model answers after latencies[model] seconds."""
+    async def call_model(model, message_content, config, on_partial=None):
+        await asyncio.sleep(latencies[model])
+        return f"response of {model}", f"reply of {model}", None
+
+    return SimpleNamespace(call_model=call_model, router=ModelRouter(list(latencies)))
+
+
+def test_hedged_call_returns_primary_finished_before_hedge_delay():
+    cog = make_cog({"primary": 0.01, "hedge": 0.01})
+    result = asyncio.run(AIChat.call_model_hedged(cog, "primary", "hedge", 0.5, "question", None))
+    assert result == ("primary", "response of primary", "reply of primary", None)
+    assert cog.router.hedges_sent == 0
+
+
+def test_hedge_wins_when_primary_is_slow():
+    cog = make_cog({"primary": 5, "hedge": 0.01})
+    result = asyncio.run(AIChat.call_model_hedged(cog, "primary", "hedge", 0.05, "question", None))
+    assert result[0] == "hedge"
+    assert (cog.router.hedges_sent, cog.router.hedges_won) == (1, 1)
+
+
+def test_call_without_hedge_model():
+    cog = make_cog({"primary": 0.01})
+    result = asyncio.run(AIChat.call_model_hedged(cog, "primary", None, None, "question", None))
+    assert result[0] == "primary"
+
+
+def make_breaker_cog(error, failure_threshold=3):
+    """Stand-in for AIChat, whose model call raises error."""
+    async def generate_content(model, message_content, config, on_partial):
+        raise error
+
+    breaker = CircuitBreaker("model", failure_threshold=failure_threshold, reset_timeout=0)
+    return SimpleNamespace(_generate_content=generate_content, breakers={"model": breaker},
+                           concurrency=AdaptiveConcurrency(lambda limit: None))
+
+
+def call_model(cog):
+    with pytest.raises(Exception):
+        asyncio.run(AIChat.call_model(cog, "model", "question", None))
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectTimeout("timed out"), httpx.ReadTimeout("timed out"), httpx.ConnectError("name resolution failed"),
+    httpx.RemoteProtocolError("connection reset"), TimeoutError(), ConnectionResetError(),
+])
+def test_transport_errors_open_the_circuit(error):
+    cog = make_breaker_cog(error)
+    for _ in range(3):
+        call_model(cog)
+    assert cog.breakers["model"].state == OPEN
+
+
+def test_probe_that_times_out_opens_the_circuit_again():
+    cog = make_breaker_cog(httpx.ReadTimeout("timed out"), failure_threshold=1)
+    breaker = cog.breakers["model"]
+    call_model(cog)
+    assert breaker.allows_request() and breaker.state == HALF_OPEN  # reset_timeout 0: probing right away
+    call_model(cog)
+    assert breaker.times_opened == 2
+
+
+def test_bad_request_counts_as_an_answer():
+    error = genai_errors.ClientError(400, {"error": {"code": 400, "message": "bad", "status": "INVALID_ARGUMENT"}})
+    cog = make_breaker_cog(error, failure_threshold=1)
+    call_model(cog)
+    assert cog.breakers["model"].state == CLOSED
+
+
+def make_ai_chat():
+    bot = SimpleNamespace(user=SimpleNamespace(id=1), cached_messages=[], http_client=SimpleNamespace(session=None),
+                          get_user=lambda _: None)
+    return AIChat(bot)
+
+
+def max_in_window(times, window):
+    end = 0
+    best = 0
+    for start, start_time in enumerate(times):
+        while end < len(times) and times[end] - start_time < window:
+            end += 1
+        best = max(best, end - start)
+    return best
+
+
+def test_daily_budgets_are_hard_limits():
+    limiter = make_ai_chat().cooldown_manager
+    limiter.path = None
+    allowed = []
+    start = 1_700_000_000.0
+    for minute in range(2 * 24 * 60):  # A user trying every minute for two days
+        current_time = start + 60 * minute
+        if limiter.try_add_message(42, current_time):
+            allowed.append(current_time)
+    assert max_in_window(allowed, 86400) == 50
+
+
+def test_slash_commands_do_not_wait_for_the_rate_limiter():
+    cog = make_ai_chat()
+    limiter = cog.cooldown_manager
+    limiter.path = None
+
+    async def main():
+        for _ in range(3):
+            assert await limiter.acquire(42, timeout=cog.rate_limit_waits["chat"])
+        started = time.monotonic()
+        assert not await limiter.acquire(42, timeout=cog.rate_limit_waits["chat"])
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.1
+
+
+def test_build_chat_index_reads_the_rows_of_a_failed_sync_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The chat store is in data/
+    export = tmp_path / "exported_messages.csv"
+    with open(export, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Timestamp", "Sender", "Sender ID", "Message", "Reactions"])
+        for i in reversed(range(3)):
+            writer.writerow([f"2024-01-01 00:00:0{i}", "player", "1", f"sonic tank rush {i}", ""])
+    cog = SimpleNamespace(chat_index=ChatHistoryIndex(str(tmp_path / "chat_index")))
+
+    sync_source = ChatHistoryIndex.sync_source
+
+    def failing_sync_source(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ChatHistoryIndex, "sync_source", failing_sync_source)
+    with pytest.raises(OSError):
+        AIChat.build_chat_index(cog, str(export))
+    monkeypatch.setattr(ChatHistoryIndex, "sync_source", sync_source)
+    chat_index = AIChat.build_chat_index(cog, str(export))
+    assert chat_index.doc_count == 3
+    assert chat_index.source_position("exported_messages") == 3
+    chat_index.close()
+
+
+def test_cached_reply_is_keyed_on_the_user_and_the_preferred_model():
+    cog = make_ai_chat()
+    cog.usage_ledger.path = None
+    calls = []
+
+    async def call_model_routed(message_content, config, on_partial=None, latency_budget=None, attempts=None):
+        calls.append(message_content)
+        response = SimpleNamespace(to_json_dict=lambda: {}, model_dump=lambda: {})
+        return "fallback-model", response, f"reply {len(calls)}", None  # Not the preferred model
+
+    cog.call_model_routed = call_model_routed
+
+    async def main():
+        return [(await cog.generate_ai_reply("prompt", cache_query="best build order?", user_id=user_id))[0]
+                for user_id in (1, 1, 2)]
+
+    assert asyncio.run(main()) == ["reply 1", "reply 1", "reply 2"]
+    assert len(calls) == 2
+
+
+def test_cached_reply_is_keyed_on_the_conversation_memory():
+    cog = make_ai_chat()
+    cog.usage_ledger.path = None
+    calls = []
+
+    async def call_model_routed(message_content, config, on_partial=None, latency_budget=None, attempts=None):
+        calls.append(message_content)
+        response = SimpleNamespace(to_json_dict=lambda: {}, model_dump=lambda: {})
+        return cog.router.choose(latency_budget)[0], response, f"reply {len(calls)}", None
+
+    cog.call_model_routed = call_model_routed
+
+    async def main():
+        replies = []
+        for memory in ("", "We talked about Ordos.", "We talked about Ordos.", ""):
+            reply, _ = await cog.generate_ai_reply(f"{memory}\n\nwhy?", cache_query="why?", cache_context=memory)
+            replies.append(reply)
+        return replies
+
+    assert asyncio.run(main()) == ["reply 1", "reply 2", "reply 2", "reply 1"]
+    assert calls == ["\n\nwhy?", "We talked about Ordos.\n\nwhy?"]
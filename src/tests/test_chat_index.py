@@ -0,0 +1,31 @@
+from utils.chat_index import ChatHistoryIndex
+
+
+def test_sync_source_only_appends_new_docs(tmp_path):
+    docs = [f"[2024-01-01 00:00:{i:02d}] player{i}: sonic tank rush {i}" for i in range(60)]
+    index = ChatHistoryIndex(str(tmp_path)).open()
+    assert index.sync_source("exported_messages", docs[:40]) == 40
+    index.close()
+
+    index = ChatHistoryIndex(str(tmp_path)).open()
+    assert index.sync_source("exported_messages", docs) == 20
+    assert index.sync_source("exported_messages", docs) == 0
+    assert index.doc_count == 60
+    assert index.meta["sources"]["exported_messages"] == {"file": "exported_messages.keys", "count": 60, "position": 0}
+    assert (tmp_path / "exported_messages.keys").stat().st_size == 60 * 8
+    assert index.search_docs("rush 45", k=1) == [docs[45]]
+    index.close()
+
+
+def test_sync_source_saves_its_position(tmp_path):
+    index = ChatHistoryIndex(str(tmp_path)).open()
+    assert index.source_position("exported_messages") == 0
+    assert index.sync_source("exported_messages", ["first doc", "second doc"], position=3) == 2
+    assert index.sync_source("exported_messages", [], position=5) == 0
+    index.close()
+
+    index = ChatHistoryIndex(str(tmp_path)).open()
+    assert index.source_position("exported_messages") == 5
+    assert index.sync_source("exported_messages", ["second doc", "third doc"]) == 1
+    assert index.meta["sources"]["exported_messages"] == {"file": "exported_messages.keys", "count": 3, "position": 5}
+    index.close()
@@ -0,0 +1,27 @@
+import csv
+from utils.chat_store import ChatStore
+
+
+def write_export(path, rows):
+    """A chat export, newest row first like the Discord export."""
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Timestamp", "Sender", "Sender ID", "Message", "Reactions"])
+        for timestamp, sender, message in reversed(rows):
+            writer.writerow([timestamp, sender, f"{sender}-id", message, "{}"])
+
+
+def test_append_csv_only_appends_new_rows(tmp_path):
+    rows = [(f"2024-01-01 00:{i // 2:02d}:00", f"player{i % 3}", f"message {i}") for i in range(20)]
+    export = tmp_path / "exported_messages.csv"
+    write_export(export, rows[:12])
+    with ChatStore(str(tmp_path / "chat_store")) as store:
+        assert store.append_csv(str(export)) == 12
+
+    write_export(export, rows)
+    with ChatStore(str(tmp_path / "chat_store")) as store:
+        assert store.append_csv(str(export)) == 8
+        assert store.append_csv(str(export)) == 0
+        assert [row.message for row in store.tail(3)] == ["message 17", "message 18", "message 19"]
+        assert [row.message for row in store.by_sender("player1-id", 2)] == ["message 16", "message 19"]
+        assert store.tail(1)[0].format() == "[2024-01-01 00:09:00] player1: message 19 | Reactions: "
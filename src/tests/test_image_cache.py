@@ -0,0 +1,44 @@
+from io import BytesIO
+import pytest
+
+pytest.importorskip("PIL")
+
+from PIL import Image, ImageDraw
+from utils.image_cache import ImageCache, perceptual_hash
+
+
+def result_screen(score, **save_options):
+    """A game result screen: the same layout, only the score text differs."""
+    image = Image.new("RGB", (640, 360), (40, 40, 60))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40, 600, 120), fill=(200, 160, 60))
+    draw.rectangle((40, 160, 600, 320), fill=(90, 90, 110))
+    draw.text((300, 230), score, fill=(255, 255, 255))
+    output = BytesIO()
+    image.save(output, "JPEG", quality=90, **save_options)
+    return output.getvalue()
+
+
+def test_same_layout_different_images_are_not_aliased(tmp_path):
+    first, second = result_screen("12 - 3"), result_screen("4 - 15")
+    assert (perceptual_hash(first) ^ perceptual_hash(second)).bit_count() <= 4
+
+    cache = ImageCache(str(tmp_path))
+    cache.load()
+    first_hash, _ = cache.put(first, attachment_id=1)
+    second_hash, second_data = cache.put(second, attachment_id=2)
+    assert second_hash != first_hash
+    assert second_data == second
+    assert cache.lookup(attachment_id=2) == second_hash
+    assert cache.near_duplicates == 0
+
+
+def test_same_pixels_are_served_from_the_cache(tmp_path):
+    first, copy = result_screen("12 - 3"), result_screen("12 - 3", optimize=True)
+    assert first != copy
+
+    cache = ImageCache(str(tmp_path))
+    cache.load()
+    first_hash, _ = cache.put(first, attachment_id=1)
+    assert cache.put(copy, attachment_id=2) == (first_hash, first)
+    assert cache.near_duplicates == 1
@@ -0,0 +1,45 @@
+import random
+import pytest
+from tests.rate_limiter_checks import (SimulatedClock, check_gcra_bounds, check_same_decisions, check_snapshot,
+                                       make_limiter, random_case)
+
+CASES = [random_case(random.Random(seed)) for seed in range(300)]
+
+
+@pytest.mark.parametrize("limits, trace", CASES)
+def test_log_matches_exact(limits, trace):
+    assert check_same_decisions("log", limits, trace) is None
+
+
+@pytest.mark.parametrize("limits, trace", CASES[:100])
+def test_gcra_bounds(limits, trace):
+    assert check_gcra_bounds(limits, trace) is None
+
+
+@pytest.mark.parametrize("backend", ["exact", "log", "gcra"])
+def test_snapshot_round_trip(backend, tmp_path):
+    for limits, trace in CASES[:50]:
+        assert check_snapshot(backend, limits, trace, str(tmp_path)) is None
+
+
+def test_log_keeps_timestamps_exact_counts_after_the_clock_goes_back():
+    limits = [(3, 1)]
+    clock = SimulatedClock()
+    exact = make_limiter("exact", limits)
+    log = make_limiter("log", limits)
+    for step in (0.0, 0.0, 0.0, 1.2, 0.0, -0.5):
+        current_time = clock.advance(step)
+        assert log.try_add_message("key", current_time) == exact.try_add_message("key", current_time)
+
+
+def test_log_is_stricter_than_exact_with_windows_of_different_lengths():
+    limits = [(1, 1), (5, 60)]
+    clock = SimulatedClock()
+    exact = make_limiter("exact", limits)
+    log = make_limiter("log", limits)
+    decisions = []
+    for key, step in (("a", 0.0), ("b", 2.0), ("a", -1.5)):
+        current_time = clock.advance(step)
+        decisions.append((log.try_add_message(key, current_time), exact.try_add_message(key, current_time)))
+    # "exact" forgot "a" in its 1 second window when "b" came in, "log" still holds it for the 60 second window
+    assert decisions == [(True, True), (True, True), (False, True)]
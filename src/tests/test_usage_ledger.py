@@ -0,0 +1,48 @@
+import time
+from utils.usage_ledger import MAX_REPORT_DAYS, UsageLedger, histogram_percentile, latency_bucket
+
+
+def test_errors_are_counted_per_model(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "usage_ledger.bin"))
+    ledger.record(1, "chat", "model-a", prompt_tokens=100, response_tokens=20, latency=1.0)
+    ledger.record(1, "chat", "model-a", latency=30.0, error=True)
+    ledger.record(2, "mention", "model-b", latency=0.5, error=True)
+    ledger.flush()
+
+    for report_ledger in (ledger, UsageLedger(ledger.path)):
+        if report_ledger is not ledger:
+            report_ledger.load()
+        models = report_ledger.get_period_report()["models"]
+        assert (models["model-a"]["requests"], models["model-a"]["errors"]) == (2, 1)
+        assert (models["model-b"]["requests"], models["model-b"]["errors"]) == (1, 1)
+        assert sorted(report_ledger.rollups) == ["day_model", "day_user", "hour"]
+
+
+def test_latency_histogram_has_a_fixed_size(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "usage_ledger.bin"))
+    for i in range(1000):
+        ledger.record(1, "chat", "model-a", latency=0.5 + i / 100)
+    usage = next(iter(ledger.rollups["day_model"].values()))
+    assert sum(usage.latencies) == 1000
+    assert len(usage.latencies) == latency_bucket(1e6) + 1
+    p50 = histogram_percentile(usage.latencies, 50)
+    assert 5.5 <= p50 <= 5.5 * 1.12
+    assert histogram_percentile(usage.latencies[:0], 50) is None
+
+
+def test_rollups_drop_the_buckets_reports_cannot_ask_for(tmp_path, monkeypatch):
+    now = time.time()
+    ledger = UsageLedger(str(tmp_path / "usage_ledger.bin"))
+    for days_ago in (MAX_REPORT_DAYS + 10, 3, 0):
+        monkeypatch.setattr(time, "time", lambda: now - days_ago * 86400)
+        ledger.record(days_ago + 1, "chat", "model-a", prompt_tokens=10)
+    ledger.flush()
+    monkeypatch.setattr(time, "time", lambda: now)
+
+    for report_ledger in (ledger, UsageLedger(ledger.path)):
+        if report_ledger is not ledger:
+            report_ledger.load()
+        assert len(report_ledger.rollups["hour"]) == 1
+        assert sorted(user_id for _, user_id in report_ledger.rollups["day_user"]) == [1, 4]
+        assert len(report_ledger.rollups["day_model"]) == 2
+        assert report_ledger.get_period_report(MAX_REPORT_DAYS)["total"]["requests"] == 2
@@ -0,0 +1,47 @@
+from collections import defaultdict, deque
+import math
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sequence (q in [0, 100]). Returns None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyRecorder:
+    """Rolling time-to-first-token and total latency per model."""
+
+    def __init__(self, window=200):
+        """
+        Args:
+            window: Number of latest requests kept per model
+        """
+        self.window = window
+        self.ttft: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self.total: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, model, total, ttft=None):
+        """
+        Args:
+            model: Model name
+            total: Seconds until the response was complete
+            ttft: Seconds until the first chunk arrived. Same as total for non-streaming calls.
+        """
+        self.total[model].append(total)
+        self.ttft[model].append(total if ttft is None else ttft)
+
+    def get_stats(self):
+        stats = {}
+        for model, totals in self.total.items():
+            ttfts = self.ttft[model]
+            stats[model] = {
+                "count": len(totals),
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p95": percentile(ttfts, 95),
+                "total_p50": percentile(totals, 50),
+                "total_p95": percentile(totals, 95),
+            }
+        return stats
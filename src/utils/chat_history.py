@@ -0,0 +1,42 @@
+import json
+from datetime import datetime, timezone
+from utils.load_files import format_history_row
+
+
+def to_epoch(value):
+    """Seconds since the epoch of a datetime (naive is UTC, like the export timestamps) or a number."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+class HistoryRow:
+    """A row of the exported chat history. The reactions column is only parsed when accessed."""
+
+    __slots__ = ("timestamp", "sender", "sender_id", "message", "raw_reactions", "_reactions")
+
+    def __init__(self, timestamp, sender, sender_id, message, raw_reactions):
+        self.timestamp = timestamp
+        self.sender = sender
+        self.sender_id = sender_id
+        self.message = message
+        self.raw_reactions = raw_reactions
+        self._reactions = None
+
+    @property
+    def reactions(self):
+        """{emoji: count}, empty if the column is empty or not valid JSON."""
+        if self._reactions is None:
+            self._reactions = {}
+            if self.raw_reactions.strip():
+                try:
+                    self._reactions = json.loads(self.raw_reactions)
+                except json.JSONDecodeError:
+                    pass
+        return self._reactions
+
+    def format(self):
+        """The chat history line of the row, or None if it is empty. Same as load_files.format_history_row."""
+        return format_history_row((self.timestamp, self.sender, self.sender_id, self.message, self.raw_reactions))
@@ -0,0 +1,308 @@
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+index_dir_path = os.path.join("data", "chat_index")
+
+_word_re = re.compile(r"\w+")
+_stopwords = frozenset(
+    "a an and are as at be but by do for from had has have he her his i if in is it its me my no not of on or "
+    "our she so that the their them they this to u up was we were what when who will with you your im its dont".split()
+)
+
+# Segment header: magic, number of terms, number of postings, first doc ID, number of docs, total doc length
+_SEGMENT_HEADER = struct.Struct("<4sIIIIQ")
+_SEGMENT_MAGIC = b"D2KI"
+
+
+def tokenize(text):
+    """Lowercase words, without stopwords and long numbers (e.g. Discord IDs)."""
+    return [
+        word for word in _word_re.findall(text.lower())
+        if len(word) > 1 and word not in _stopwords and not (word.isdigit() and len(word) > 6)
+    ]
+
+
+def term_hash(term):
+    return zlib.crc32(term.encode("utf-8"))
+
+
+class Segment:
+    """An immutable, memory-mapped inverted index over a contiguous range of docs."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_terms, n_postings, self.doc_start, self.doc_count, self.total_length = \
+            _SEGMENT_HEADER.unpack_from(self._mmap, 0)
+        if magic != _SEGMENT_MAGIC:
+            raise ValueError(f"Not an index segment: {path}")
+        self._view = memoryview(self._mmap)
+        offset = _SEGMENT_HEADER.size
+        sections = []
+        for count in (n_terms, n_terms + 1, n_postings, n_postings, self.doc_count):
+            sections.append(self._view[offset:offset + 4 * count].cast("I"))
+            offset += 4 * count
+        self.terms, self.term_offsets, self.postings_doc, self.postings_tf, self.doc_lengths = sections
+
+    def postings(self, term):
+        """Return the range of postings of a term hash, empty if the term is not in this segment."""
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return range(self.term_offsets[i], self.term_offsets[i + 1])
+        return range(0)
+
+    def close(self):
+        for section in (self.terms, self.term_offsets, self.postings_doc, self.postings_tf, self.doc_lengths):
+            section.release()
+        self._view.release()
+        self._mmap.close()
+
+    @staticmethod
+    def write(path, doc_start, docs_tokens):
+        """Build the segment of docs [doc_start, doc_start + len(docs_tokens)) and write it atomically."""
+        postings = defaultdict(list)  # {term hash: [(doc ID, term frequency)]}
+        doc_lengths = array("I")
+        for i, tokens in enumerate(docs_tokens):
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(term_hash(token) for token in tokens).items():
+                postings[term].append((doc_start + i, tf))
+
+        terms = array("I", sorted(postings))
+        term_offsets = array("I", [0])
+        postings_doc = array("I")
+        postings_tf = array("I")
+        for term in terms:
+            for doc_id, tf in postings[term]:
+                postings_doc.append(doc_id)
+                postings_tf.append(tf)
+            term_offsets.append(len(postings_doc))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_SEGMENT_HEADER.pack(
+                _SEGMENT_MAGIC, len(terms), len(postings_doc), doc_start, len(docs_tokens), sum(doc_lengths)
+            ))
+            for section in (terms, term_offsets, postings_doc, postings_tf, doc_lengths):
+                file.write(section.tobytes())
+        os.replace(tmp_path, path)
+
+
+class ChatHistoryIndex:
+    """
+    BM25 retrieval index over chat history lines, persisted on disk and memory-mapped.
+
+    Docs are stored in an append-only text blob with an offset table. The inverted index is split into
+    immutable segments, so appending docs only writes a new small segment. Segments are merged once there
+    are too many of them.
+    """
+
+    def __init__(self, path=index_dir_path, k1=1.2, b=0.75, max_segments=8):
+        """
+        Args:
+            path: Directory of the index files
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+            max_segments: Segments are merged into one when there are more than this
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.meta = {"segments": [], "sources": {}}
+        self.segments: list[Segment] = []
+        self._docs_mmap = None
+        self.doc_offsets = array("Q", [0])
+
+    @property
+    def doc_count(self):
+        return len(self.doc_offsets) - 1
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def open(self):
+        """Open (memory-map) the index on disk. A missing index is opened empty."""
+        self.close()
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as file:
+                self.meta = json.load(file)
+        except FileNotFoundError:
+            self.meta = {"segments": [], "sources": {}}
+
+        self.doc_offsets = array("Q", [0])
+        if os.path.exists(self._file("docs.off")):
+            with open(self._file("docs.off"), "rb") as file:
+                self.doc_offsets = array("Q")
+                self.doc_offsets.frombytes(file.read())
+        if os.path.exists(self._file("docs.bin")) and os.path.getsize(self._file("docs.bin")) > 0:
+            with open(self._file("docs.bin"), "rb") as file:
+                self._docs_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.segments = [Segment(self._file(name)) for name in self.meta["segments"]]
+
+        # The doc files are appended before the meta is written. Ignore docs left by an interrupted append.
+        indexed_docs = sum(segment.doc_count for segment in self.segments)
+        del self.doc_offsets[indexed_docs + 1:]
+        return self
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        if self._docs_mmap is not None:
+            self._docs_mmap.close()
+            self._docs_mmap = None
+
+    def _save_meta(self):
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(self.meta, file)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def get_doc(self, doc_id):
+        return self._docs_mmap[self.doc_offsets[doc_id]:self.doc_offsets[doc_id + 1]].decode("utf-8")
+
+    def append(self, docs: list[str]):
+        """Add docs to the index. Writes the docs and one new segment, merging segments if there are too many."""
+        if not docs:
+            return
+        doc_start = self.doc_count
+        encoded = [doc.encode("utf-8") for doc in docs]
+        with open(self._file("docs.bin"), "r+b" if os.path.exists(self._file("docs.bin")) else "wb") as file:
+            file.seek(self.doc_offsets[-1])
+            file.truncate()
+            for data in encoded:
+                file.write(data)
+        new_offsets = array("Q")
+        for data in encoded:
+            new_offsets.append((new_offsets[-1] if new_offsets else self.doc_offsets[-1]) + len(data))
+        with open(self._file("docs.off"), "wb") as file:
+            file.write(self.doc_offsets.tobytes())
+            file.write(new_offsets.tobytes())
+
+        segment_name = f"seg_{doc_start:09d}.bin"
+        Segment.write(self._file(segment_name), doc_start, [tokenize(doc) for doc in docs])
+        self.meta["segments"].append(segment_name)
+        self._save_meta()
+        self.open()
+
+        if len(self.segments) > self.max_segments:
+            self.merge_segments()
+
+    def merge_segments(self):
+        """Rebuild the inverted index as a single segment."""
+        if len(self.segments) <= 1:
+            return
+        old_names = list(self.meta["segments"])
+        segment_name = f"seg_merged_{self.doc_count:09d}.bin"
+        Segment.write(self._file(segment_name), 0, [tokenize(self.get_doc(i)) for i in range(self.doc_count)])
+        self.meta["segments"] = [segment_name]
+        self._save_meta()
+        self.open()
+        for name in old_names:
+            if name != segment_name:
+                os.remove(self._file(name))
+        logger.info(f"Merged {len(old_names)} index segments.")
+
+    def search(self, query, k=30):
+        """Return the top-k (score, doc ID) of a query, best first."""
+        terms = set(term_hash(token) for token in tokenize(query))
+        n_docs = self.doc_count
+        if not terms or not n_docs:
+            return []
+        average_length = sum(segment.total_length for segment in self.segments) / n_docs
+
+        # Document frequency across all segments first, then score
+        ranges = {term: [(segment, segment.postings(term)) for segment in self.segments] for term in terms}
+        scores = defaultdict(float)
+        for term, segment_ranges in ranges.items():
+            df = sum(len(postings) for _, postings in segment_ranges)
+            if not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for segment, postings in segment_ranges:
+                for p in postings:
+                    doc_id = segment.postings_doc[p]
+                    tf = segment.postings_tf[p]
+                    length = segment.doc_lengths[doc_id - segment.doc_start]
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()))
+
+    def search_docs(self, query, k=30):
+        """Return the texts of the top-k docs of a query."""
+        return [self.get_doc(doc_id) for _, doc_id in self.search(query, k)]
+
+    def _load_source_keys(self, source):
+        """The doc hashes of a source, from its append-only key file (uint64 each, the first `count` are valid)."""
+        keys = array("Q")
+        if source["count"]:
+            with open(self._file(source["file"]), "rb") as file:
+                keys.frombytes(file.read(keys.itemsize * source["count"]))
+        return keys
+
+    def source_position(self, source_name):
+        """Where the synced docs of a source end in it (see sync_source), 0 if it was never synced."""
+        return self.meta["sources"].get(source_name, {}).get("position", 0)
+
+    def sync_source(self, source_name, docs: list[str], position=None):
+        """
+        Append the docs of a source that are not indexed yet.
+
+        The docs of a source are only ever added (e.g. a chat export that grows), so the index remembers
+        which docs it has seen and only appends the new ones. The hashes of the seen docs are appended to a key
+        file per source, the meta only keeps its name, number of keys and position.
+
+        Args:
+            source_name: Name of the source, also used for its key file name
+            position: Where the docs end in the source (e.g. the number of rows read), saved with the keys so the
+                next sync only needs the docs after source_position. None keeps the saved position.
+
+        Returns:
+            Number of appended docs
+        """
+        source = self.meta["sources"].get(source_name) or {"file": f"{source_name}.keys", "count": 0}
+        seen = set(self._load_source_keys(source))
+        new_keys = array("Q")
+        new_docs = []
+        for doc in docs:
+            key = int.from_bytes(hashlib.blake2b(doc.encode("utf-8"), digest_size=8).digest(), "little")
+            if key not in seen:
+                seen.add(key)
+                new_keys.append(key)
+                new_docs.append(doc)
+
+        if new_keys:
+            # Like the doc files, the key file is written before the meta, which tells how many keys are valid
+            path = self._file(source["file"])
+            with open(path, "r+b" if os.path.exists(path) else "wb") as file:
+                file.seek(new_keys.itemsize * source["count"])
+                file.truncate()
+                file.write(new_keys.tobytes())
+        updated = {
+            "file": source["file"],
+            "count": source["count"] + len(new_keys),
+            "position": source.get("position", 0) if position is None else position,
+        }
+        if new_docs:
+            self.meta["sources"][source_name] = updated
+            self.append(new_docs)  # Saves the meta
+        elif updated != self.meta["sources"].get(source_name):
+            self.meta["sources"][source_name] = updated
+            self._save_meta()
+        return len(new_docs)
@@ -0,0 +1,252 @@
+import csv
+import hashlib
+import json
+import logging
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from utils.chat_history import HistoryRow, to_epoch
+from utils.load_files import csv_file_path
+
+logger = logging.getLogger(__name__)
+
+store_dir_path = os.path.join("data", "chat_store")
+
+# Column files: fixed-width arrays, and blobs with their offset arrays
+_ARRAYS = {"timestamps": "q", "senders": "I"}
+_BLOBS = ("messages", "reactions")
+
+
+def row_key(timestamp, sender_id, message):
+    return hashlib.blake2b(f"{timestamp}\0{sender_id}\0{message}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ChatStore:
+    """
+    Columnar, append-only store of the exported chat history, memory-mapped for reading.
+
+    Rows are kept oldest first in column files: timestamps (int64 epoch seconds) and senders (uint32 index in an
+    interned table of (name, ID)), plus the message texts and raw reactions JSON as blobs with uint64 offset arrays.
+    Reading a row slices the mapped files; the reactions are only parsed when accessed.
+
+    Converting an export only appends the rows newer than the ones stored: the store remembers its newest timestamp
+    and the keys of the rows at that timestamp. Column files are written before the meta, and truncated to the
+    lengths in the meta when appending, so an interrupted conversion leaves no partial rows.
+    """
+
+    def __init__(self, path=store_dir_path):
+        """
+        Args:
+            path: Directory of the store files
+        """
+        self.path = path
+        self.meta = {"rows": 0, "lengths": {}, "senders": [], "newest": None, "newest_keys": []}
+        self._sender_ids = {}  # {(name, sender ID): index in meta["senders"]}
+        self._mmaps = []
+        self._views = []
+        self.timestamps = self.senders = ()
+        self.message_offsets = self.reaction_offsets = ()
+        self.message_data = self.reaction_data = b""
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def open(self):
+        """Map the store on disk. A missing store is opened empty."""
+        self.close()
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as file:
+                self.meta = json.load(file)
+        except FileNotFoundError:
+            self.meta = {"rows": 0, "lengths": {}, "senders": [], "newest": None, "newest_keys": []}
+        self._sender_ids = {tuple(sender): i for i, sender in enumerate(self.meta["senders"])}
+
+        rows = self.meta["rows"]
+        self.timestamps = self._map("timestamps.bin", "q", rows)
+        self.senders = self._map("senders.bin", "I", rows)
+        self.message_offsets = self._map("messages.off", "Q", rows + 1 if rows else 0)
+        self.reaction_offsets = self._map("reactions.off", "Q", rows + 1 if rows else 0)
+        self.message_data = self._map("messages.bin", "B", self.message_offsets[-1] if rows else 0)
+        self.reaction_data = self._map("reactions.bin", "B", self.reaction_offsets[-1] if rows else 0)
+        return self
+
+    def _map(self, name, code, count):
+        """Map the first `count` items of a column file, zero-copy."""
+        size = count * array(code).itemsize
+        if not size:
+            return memoryview(b"").cast(code) if code != "B" else b""
+        with open(self._file(name), "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mapped)
+        view = memoryview(mapped)[:size]
+        self._views.append(view)
+        if code == "B":
+            return view
+        view = view.cast(code)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        for mapped in self._mmaps:
+            mapped.close()
+        self._views = []
+        self._mmaps = []
+        self.timestamps = self.senders = ()
+        self.message_offsets = self.reaction_offsets = ()
+        self.message_data = self.reaction_data = b""
+
+    def _save_meta(self):
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(self.meta, file)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _intern_sender(self, name, sender_id):
+        key = (name, sender_id)
+        index = self._sender_ids.get(key)
+        if index is None:
+            index = self._sender_ids[key] = len(self.meta["senders"])
+            self.meta["senders"].append([name, sender_id])
+        return index
+
+    def _new_rows(self, path):
+        """
+        The rows of a CSV export newer than the store, oldest first, as (epoch, sender, sender ID, message, reactions).
+
+        Discord exports are newest first, so reading stops at the first row older than the store.
+        """
+        newest = self.meta["newest"]
+        newest_keys = set(self.meta["newest_keys"])
+        rows = []
+        previous = None
+        descending = True
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            reader = csv.reader(file)
+            for i, row in enumerate(reader):
+                if i == 0 and row and row[0] == "Timestamp":
+                    continue
+                if len(row) < 5:
+                    continue
+                try:
+                    timestamp = to_epoch(datetime.fromisoformat(row[0]))
+                except ValueError:
+                    continue
+                if previous is not None and timestamp > previous:
+                    descending = False
+                previous = timestamp
+                if newest is not None and timestamp < newest:
+                    if descending:
+                        break  # Every following row is older, and so already stored
+                    continue
+                if timestamp == newest and row_key(timestamp, row[2], row[3]) in newest_keys:
+                    continue
+                rows.append((timestamp, row[1], row[2], row[3], row[4]))
+        if descending:
+            rows.reverse()
+        rows.sort(key=lambda row: row[0])  # Stable, rows of the same second keep their order
+        return rows
+
+    def append_csv(self, path=csv_file_path):
+        """
+        Append the rows of a CSV export that are not in the store yet, then reopen the store.
+
+        Returns:
+            Number of appended rows
+        """
+        if not self._mmaps:
+            self.open()
+        rows = self._new_rows(path)
+        if not rows:
+            return 0
+
+        columns = {name: array(code) for name, code in _ARRAYS.items()}
+        blobs = {name: [] for name in _BLOBS}
+        offsets = {name: array("Q") for name in _BLOBS}
+        end = {name: self.meta["lengths"].get(f"{name}.bin", 0) for name in _BLOBS}
+        for timestamp, sender, sender_id, message, reactions in rows:
+            columns["timestamps"].append(timestamp)
+            columns["senders"].append(self._intern_sender(sender, sender_id))
+            for name, text in (("messages", message), ("reactions", reactions)):
+                data = text.encode("utf-8")
+                blobs[name].append(data)
+                end[name] += len(data)
+                offsets[name].append(end[name])
+
+        files = {f"{name}.bin": column.tobytes() for name, column in columns.items()}
+        for name in _BLOBS:
+            files[f"{name}.bin"] = b"".join(blobs[name])
+            first_offset = b"" if self.meta["rows"] else array("Q", [0]).tobytes()
+            files[f"{name}.off"] = first_offset + offsets[name].tobytes()
+
+        self.close()
+        for name, data in files.items():
+            length = self.meta["lengths"].get(name, 0)
+            with open(self._file(name), "r+b" if os.path.exists(self._file(name)) else "wb") as file:
+                file.seek(length)
+                file.truncate()
+                file.write(data)
+            self.meta["lengths"][name] = length + len(data)
+
+        newest = rows[-1][0]
+        newest_keys = set(self.meta["newest_keys"]) if newest == self.meta["newest"] else set()
+        newest_keys.update(row_key(row[0], row[2], row[3]) for row in rows if row[0] == newest)
+        self.meta["rows"] += len(rows)
+        self.meta["newest"] = newest
+        self.meta["newest_keys"] = sorted(newest_keys)
+        self._save_meta()
+        self.open()
+        logger.info(f"Appended {len(rows)} rows of {path} to the chat store ({len(self)} rows).")
+        return len(rows)
+
+    def message(self, i):
+        return str(self.message_data[self.message_offsets[i]:self.message_offsets[i + 1]], "utf-8")
+
+    def sender(self, i):
+        """(name, sender ID) of row i."""
+        return tuple(self.meta["senders"][self.senders[i]])
+
+    def row(self, i):
+        name, sender_id = self.sender(i)
+        raw_reactions = str(self.reaction_data[self.reaction_offsets[i]:self.reaction_offsets[i + 1]], "utf-8")
+        return HistoryRow(format_timestamp(self.timestamps[i]), name, sender_id, self.message(i), raw_reactions)
+
+    def rows(self, start=0, stop=None):
+        return [self.row(i) for i in range(*slice(start, stop).indices(len(self)))]
+
+    def tail(self, n):
+        """The n newest rows, oldest first."""
+        return self.rows(max(0, len(self) - n))
+
+    def time_range(self, start=None, end=None):
+        """The rows with start <= timestamp < end (datetime, naive is UTC, or epoch seconds), oldest first."""
+        lo = 0 if start is None else bisect_left(self.timestamps, to_epoch(start))
+        hi = len(self) if end is None else bisect_left(self.timestamps, to_epoch(end))
+        return self.rows(lo, hi)
+
+    def by_sender(self, sender_id, limit=None):
+        """The rows of a sender (under any of their names), oldest first. Only the newest `limit` if not None."""
+        sender_id = str(sender_id)
+        indices = {i for i, (_, value) in enumerate(self.meta["senders"]) if value == sender_id}
+        rows = [i for i, sender in enumerate(self.senders) if sender in indices]
+        if limit is not None:
+            rows = rows[-limit:] if limit else []
+        return [self.row(i) for i in rows]
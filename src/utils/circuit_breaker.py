@@ -0,0 +1,203 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the service is failing."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # Seconds until the service is tried again
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while.
+
+    Closed: requests go through, consecutive failures are counted. After `failure_threshold` of them the circuit
+    opens: requests are refused right away for `reset_timeout` seconds (or longer if the server asked to retry
+    later), doubling each time it opens again, up to `max_reset_timeout`. A failure with a retry-after hint opens
+    the circuit right away, for the time the server asked. Then it is half-open: up to `half_open_max` probe
+    requests go through. A successful probe closes the circuit, a failed one opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=15, max_reset_timeout=300, half_open_max=1):
+        """
+        Args:
+            name: Name of the service, for logs
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open the first time
+            max_reset_timeout: Maximum seconds the circuit stays open
+            half_open_max: Maximum number of probe requests in flight while half-open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_max = half_open_max
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.current_timeout = reset_timeout
+        self.probes_in_flight = 0
+
+        self.times_opened = 0
+        self.refused = 0
+
+    def _refresh(self, now):
+        if self.state == OPEN and now >= self.open_until:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            logger.info(f"Circuit of {self.name} is half-open, probing.")
+
+    def retry_after(self):
+        """Seconds until a request may go through, 0 if it may now."""
+        now = time.monotonic()
+        self._refresh(now)
+        if self.state == OPEN:
+            return self.open_until - now
+        if self.state == HALF_OPEN and self.probes_in_flight >= self.half_open_max:
+            return 1.0  # Waiting for the probe
+        return 0.0
+
+    def allows_request(self):
+        return self.retry_after() == 0
+
+    def before_request(self):
+        """
+        Call before a request.
+
+        Raises:
+            CircuitOpenError: If the request must not be sent
+        """
+        wait = self.retry_after()
+        if wait > 0:
+            self.refused += 1
+            raise CircuitOpenError(f"Circuit of {self.name} is {self.state}.", retry_after=wait)
+        if self.state == HALF_OPEN:
+            self.probes_in_flight += 1
+
+    def record_success(self):
+        """The service answered (even with an error that is not its fault, e.g. a bad request)."""
+        if self.state == HALF_OPEN:
+            logger.info(f"Circuit of {self.name} is closed again.")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.current_timeout = self.reset_timeout
+        self.probes_in_flight = 0
+
+    def record_failure(self, retry_after=None):
+        """
+        The service is failing (rate limited, overloaded, down).
+
+        Args:
+            retry_after: Seconds the server asked to wait, if it said so
+        """
+        now = time.monotonic()
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self.current_timeout = min(self.current_timeout * 2, self.max_reset_timeout)
+            self._open(now, max(self.current_timeout, retry_after or 0))
+        elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open(now, max(self.current_timeout, retry_after or 0))
+        elif self.state == CLOSED and retry_after:
+            # The server said when it takes requests again (e.g. quota exhausted), no need to wait for more failures
+            self._open(now, retry_after)
+        elif self.state == OPEN and retry_after:
+            self.open_until = max(self.open_until, now + retry_after)
+
+    def record_cancelled(self):
+        """A request was cancelled before the service answered, e.g. the loser of a hedged request."""
+        if self.state == HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def _open(self, now, duration):
+        self.state = OPEN
+        self.probes_in_flight = 0
+        self.times_opened += 1
+        self.open_until = now + duration
+        logger.warning(
+            f"Circuit of {self.name} is open for {self.open_until - now:.0f}s "
+            f"after {self.consecutive_failures} consecutive failures."
+        )
+
+    def get_stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after(), 1),
+            "times_opened": self.times_opened,
+            "refused": self.refused,
+        }
+
+
+class AdaptiveConcurrency:
+    """
+    Additive increase, multiplicative decrease (AIMD) of a concurrency limit.
+
+    Every success within the latency target adds 1 / limit, so the limit grows by about one per round of
+    requests. An overload error or a response slower than the target multiplies the limit by `decrease_factor`,
+    at most once per `decrease_interval` seconds, so a burst of failures of the same round counts once.
+    The limit is applied through the `apply` callback, e.g. RequestScheduler.set_max_concurrency.
+    """
+
+    def __init__(self, apply, initial=3, min_limit=1, max_limit=8, latency_target=30.0, decrease_factor=0.5,
+                 decrease_interval=5.0):
+        """
+        Args:
+            apply: Callable receiving the new integer limit when it changes
+            initial: Starting limit
+            min_limit: Lowest limit
+            max_limit: Highest limit
+            latency_target: Seconds above which a response counts as a congestion signal
+            decrease_factor: Multiplier of the limit on congestion
+            decrease_interval: Minimum seconds between two decreases
+        """
+        self.apply = apply
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.limit = float(initial)
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.apply(int(self.limit))
+
+    def _set(self, limit):
+        old = int(self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+        if int(self.limit) != old:
+            logger.info(f"Concurrency limit {old} -> {int(self.limit)}.")
+            self.apply(int(self.limit))
+
+    def record_success(self, latency):
+        if latency > self.latency_target:
+            self.record_overload()
+            return
+        if self.limit < self.max_limit:
+            self.increases += 1
+            self._set(self.limit + 1 / self.limit)
+
+    def record_overload(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        self._set(self.limit * self.decrease_factor)
+
+    def get_stats(self):
+        return {
+            "limit": int(self.limit),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+conversations_file_path = os.path.join("data", "conversations.json")
+
+class Conversation:
+    """Running summary plus the latest turns of one conversation."""
+
+    def __init__(self, summary="", turns=None, pending=None, last_active=None):
+        self.summary = summary
+        self.turns: list[tuple[str, str]] = turns or []  # [(speaker, text)], oldest first
+        self.pending: list[tuple[str, str]] = pending or []  # Turns pushed out, waiting to be summarized
+        self.last_active = last_active or time.time()
+        self.summarizing = False
+
+    def size(self):
+        return len(self.summary) + sum(len(text) for _, text in self.turns + self.pending)
+
+    def to_dict(self):
+        return {
+            "summary": self.summary,
+            "turns": self.turns,
+            "pending": self.pending,
+            "last_active": self.last_active,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            summary=data.get("summary", ""),
+            turns=[tuple(turn) for turn in data.get("turns", [])],
+            pending=[tuple(turn) for turn in data.get("pending", [])],
+            last_active=data.get("last_active"),
+        )
+
+
+class ConversationStore:
+    """
+    Bounded conversation memory per user or per thread.
+
+    Each conversation keeps its latest `max_turns` turns verbatim. Older turns are queued to be folded into a
+    running summary (in the background, by the caller), so a prompt carries a summary plus a few turns instead
+    of an ever-growing transcript. Idle conversations are evicted LRU first, and the total size is capped.
+    """
+
+    def __init__(self, path=conversations_file_path, max_turns=6, max_conversations=200,
+                 max_total_chars=2_000_000, idle_ttl=7 * 86400):
+        """
+        Args:
+            path: JSON file the conversations are persisted to
+            max_turns: Number of latest turns kept verbatim per conversation
+            max_conversations: Maximum number of conversations kept
+            max_total_chars: Maximum number of characters kept across all conversations
+            idle_ttl: Seconds of inactivity after which a conversation is forgotten
+        """
+        self.path = path
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self.max_total_chars = max_total_chars
+        self.idle_ttl = idle_ttl
+        self.conversations: OrderedDict[str, Conversation] = OrderedDict()  # Least recently active first
+        self.dirty = False
+
+    def get(self, key) -> Conversation | None:
+        conversation = self.conversations.get(key)
+        if conversation is not None and time.time() - conversation.last_active > self.idle_ttl:
+            del self.conversations[key]
+            return None
+        return conversation
+
+    def forget(self, key):
+        if self.conversations.pop(key, None) is not None:
+            self.dirty = True
+
+    def build_context(self, key) -> str:
+        """Return the memory of a conversation as prompt text, empty if there is none."""
+        conversation = self.get(key)
+        if conversation is None:
+            return ""
+        lines = []
+        if conversation.summary:
+            lines.append(f"Summary of the earlier conversation:\n{conversation.summary}")
+        # Turns waiting to be summarized are still sent, so nothing is lost in between
+        recent_turns = conversation.pending + conversation.turns
+        if recent_turns:
+            lines.append("Latest turns of the conversation:")
+            lines += [f"{speaker}: {text}" for speaker, text in recent_turns]
+        return "\n".join(lines)
+
+    def add_turn(self, key, user_text, ai_text, user_name="User"):
+        """
+        Record one exchange. Returns True if the conversation has turns waiting to be summarized.
+        """
+        conversation = self.get(key)
+        if conversation is None:
+            conversation = self.conversations[key] = Conversation()
+        self.conversations.move_to_end(key)
+        conversation.last_active = time.time()
+        conversation.turns += [(user_name, user_text), ("You", ai_text)]
+        overflow = len(conversation.turns) - self.max_turns
+        if overflow > 0:
+            conversation.pending += conversation.turns[:overflow]
+            del conversation.turns[:overflow]
+        self.dirty = True
+        self._evict()
+        return bool(conversation.pending)
+
+    async def summarize(self, key, summarizer):
+        """
+        Fold the pending turns of a conversation into its summary.
+
+        Args:
+            key: Conversation key
+            summarizer: Async callable (summary, turns) -> new summary
+        """
+        conversation = self.get(key)
+        if conversation is None or conversation.summarizing or not conversation.pending:
+            return
+        conversation.summarizing = True
+        try:
+            pending = list(conversation.pending)
+            new_summary = await summarizer(conversation.summary, pending)
+            if new_summary:
+                conversation.summary = new_summary
+                # New turns may have been pushed out meanwhile, only drop the summarized ones
+                del conversation.pending[:len(pending)]
+                self.dirty = True
+        finally:
+            conversation.summarizing = False
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, c in self.conversations.items() if now - c.last_active > self.idle_ttl]:
+            del self.conversations[key]
+        while len(self.conversations) > self.max_conversations:
+            self.conversations.popitem(last=False)
+        total_chars = sum(conversation.size() for conversation in self.conversations.values())
+        while total_chars > self.max_total_chars and len(self.conversations) > 1:
+            _, conversation = self.conversations.popitem(last=False)
+            total_chars -= conversation.size()
+
+    def snapshot(self):
+        """Serializable copy of the store, taken on the event loop before saving in a worker thread."""
+        self.dirty = False
+        return {key: conversation.to_dict() for key, conversation in self.conversations.items()}
+
+    def save(self, snapshot):
+        """Write a snapshot atomically."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(snapshot, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading conversations, starting empty: {e}")
+            return
+        conversations = sorted(
+            ((key, Conversation.from_dict(value)) for key, value in data.items()),
+            key=lambda item: item[1].last_active
+        )
+        self.conversations = OrderedDict(conversations)
+        self._evict()
+        logger.info(f"Loaded {len(self.conversations)} conversations.")
@@ -1,10 +1,101 @@
+import hashlib
+import json
 import logging
+import os
 import discord
 import asyncio
+import time
+from collections import OrderedDict
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-async def send_or_update_embed(bot_user_id, channel, embed, content=""):
+status_messages_file_path = os.path.join("data", "status_messages.json")
+
+
+class StatusMessageCache:
+    """
+    The status message that send_or_update_embed keeps up to date in each channel, persisted across restarts.
+
+    The message ID is remembered, so an update is a single edit instead of reading the channel history first. The
+    history is only read again if the message was deleted. An update with the same content as the last edit (not
+    counting the ignored fields, like "Last Updated") is skipped, unless the last edit is older than
+    `refresh_interval` seconds, so the ignored fields still get refreshed now and then.
+    """
+
+    def __init__(self, path=status_messages_file_path, refresh_interval=300, ignored_fields=("Last Updated",)):
+        """
+        Args:
+            path: JSON file the message IDs are persisted to
+            refresh_interval: Seconds after which an unchanged message is edited anyway
+            ignored_fields: Names of the embed fields left out of the comparison
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.ignored_fields = ignored_fields
+        self.message_ids: dict[int, int] = {}  # {channel ID: message ID}
+        self.shown: dict[int, tuple[str, float]] = {}  # {channel ID: (content hash, time.monotonic() of the edit)}
+        self.dirty = False
+
+        self.rest_calls = {"history": 0, "send": 0, "edit": 0}
+        self.skipped_updates = 0
+
+    def content_hash(self, embed: discord.Embed, content=""):
+        data = embed.to_dict()
+        data["fields"] = [field for field in data.get("fields", []) if field.get("name") not in self.ignored_fields]
+        text = json.dumps([content, data], sort_keys=True)
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def is_unchanged(self, channel_id, content_hash):
+        """The message of the channel already shows this content, and was edited less than refresh_interval ago."""
+        shown = self.shown.get(channel_id)
+        return (channel_id in self.message_ids and shown is not None and shown[0] == content_hash
+                and time.monotonic() - shown[1] < self.refresh_interval)
+
+    def remember(self, channel_id, message_id, content_hash):
+        if self.message_ids.get(channel_id) != message_id:
+            self.message_ids[channel_id] = message_id
+            self.dirty = True
+        self.shown[channel_id] = (content_hash, time.monotonic())
+
+    def forget(self, channel_id):
+        if self.message_ids.pop(channel_id, None) is not None:
+            self.dirty = True
+        self.shown.pop(channel_id, None)
+
+    def snapshot(self):
+        """Serializable copy of the message IDs, taken on the event loop before saving in a worker thread."""
+        self.dirty = False
+        return {str(channel_id): message_id for channel_id, message_id in self.message_ids.items()}
+
+    def save(self, snapshot):
+        """Write a snapshot atomically."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(snapshot, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading status messages, looking them up again: {e}")
+            return
+        self.message_ids = {int(channel_id): int(message_id) for channel_id, message_id in data.items()}
+        logger.info(f"Loaded the status messages of {len(self.message_ids)} channels.")
+
+    def get_stats(self):
+        return {
+            "rest_calls": dict(self.rest_calls),
+            "skipped_updates": self.skipped_updates,
+            "channels": len(self.message_ids),
+        }
+
+
+async def send_or_update_embed(bot_user_id, channel, embed, content="", cache: StatusMessageCache | None = None):
     """Send a new message or update the latest bot message and delete older ones.
 
     Args:
@@ -12,10 +103,41 @@ async def send_or_update_embed(bot_user_id, channel, embed, content=""):
         channel: The channel to send/update messages in
         embed: The embed to send
         content: The message content to send
+        cache: Remembers the message to edit and skips unchanged updates. Without it, the latest bot message is
+            looked up in the channel history on every call.
     """
+    content_hash = None
+    if cache is not None:
+        content_hash = cache.content_hash(embed, content)
+        if cache.is_unchanged(channel.id, content_hash):
+            cache.skipped_updates += 1
+            return
+        message_id = cache.message_ids.get(channel.id)
+        if message_id is not None:
+            try:
+                cache.rest_calls["edit"] += 1
+                await channel.get_partial_message(message_id).edit(content=content, embed=embed)
+                cache.remember(channel.id, message_id, content_hash)
+                return
+            except discord.NotFound:
+                # Deleted, look for the latest bot message again
+                logger.info(f"Status message {message_id} in {channel.name} (ID: {channel.id}) not found.")
+                cache.forget(channel.id)
+            except discord.errors.DiscordServerError as e:
+                logger.warning(f"Discord server error while updating message in {channel.name} (ID: {channel.id}): {e}")
+                return
+            except discord.errors.HTTPException as e:
+                logger.warning(f"HTTP error while updating message in {channel.name} (ID: {channel.id}): {e}")
+                return
+            except Exception as e:
+                logger.exception(f"Unexpected error while updating message in {channel.name} (ID: {channel.id}): {e}")
+                return
+
     # Get all messages from the bot in this channel (limited to a reasonable amount)
     bot_messages = []
     try:
+        if cache is not None:
+            cache.rest_calls["history"] += 1
         # This could raise discord.errors.DiscordServerError: 500 Internal Server Error or 503 Service Unavailable
         async for message in channel.history(limit=5):
             if message.author.id == bot_user_id:
@@ -33,11 +155,17 @@ async def send_or_update_embed(bot_user_id, channel, embed, content=""):
     try:
         if not bot_messages:
             # No existing messages, send a new one
-            await channel.send(embed=embed)
+            if cache is not None:
+                cache.rest_calls["send"] += 1
+            latest_message = await channel.send(embed=embed)
         else:
             # Update the most recent message
             latest_message = bot_messages[0]  # First message is the most recent
+            if cache is not None:
+                cache.rest_calls["edit"] += 1
             await latest_message.edit(content=content, embed=embed)
+        if cache is not None:
+            cache.remember(channel.id, latest_message.id, content_hash)
     except discord.errors.DiscordServerError as e:
         logger.warning(f"Discord server error while sending/updating message in {channel.name} (ID: {channel.id}): {e}")
     except discord.errors.HTTPException as e:
@@ -80,6 +208,55 @@ async def send_a_message_then_delete(bot, channel_id, message="Test message", de
         logger.exception(f"Unexpected error when deleting message in {channel.name} (ID: {channel.id}): {e}")
 
 
+class ProgressiveMessage:
+    """
+    A message that is edited in place while its content is being generated.
+
+    Edits are throttled to one per `min_interval` seconds, so a fast stream of chunks
+    stays under Discord's edit rate limit (5 edits per 5 seconds per channel).
+    """
+
+    def __init__(self, message: discord.Message, prefix="", max_length=1990, min_interval=1.5):
+        """
+        Args:
+            message: The placeholder message that was already sent
+            prefix: Text shown before the generated content
+            max_length: Content is truncated to this length
+            min_interval: Minimum seconds between two edits
+        """
+        self.message = message
+        self.prefix = prefix
+        self.max_length = max_length
+        self.min_interval = min_interval
+        self.last_edit = time.monotonic()  # The placeholder was just sent
+        self.shown_content = None
+
+    async def _edit(self, content):
+        content = content[:self.max_length]
+        if content == self.shown_content:
+            return
+        self.shown_content = content
+        self.last_edit = time.monotonic()
+        await self.message.edit(content=content)
+
+    async def update(self, text):
+        """Show partial text, unless the last edit was too recent. Skipped text shows up with a later update."""
+        if time.monotonic() - self.last_edit < self.min_interval:
+            return
+        try:
+            await self._edit(f"{self.prefix}{text} ▌")  # Cursor to show that more is coming
+        except discord.HTTPException as e:
+            logger.warning(f"HTTP error while updating streamed message: {e}")
+
+    async def show_status(self, status):
+        """Show a status line (e.g. the queue position) in place of the content."""
+        await self._edit(f"{self.prefix}{status}")
+
+    async def finish(self, text):
+        """Show the final text, regardless of throttling."""
+        await self._edit(f"{self.prefix}{text}")
+
+
 def format_message(message: discord.Message):
     """Format a single message for the prompt."""
     user = message.author
@@ -106,49 +283,118 @@ def format_message(message: discord.Message):
     )
 
 
-async def get_recent_messages(channel, limit=20) -> list[str]:
-    """Get the latest messages from the channel as context."""
-    messages = []
-    try:
-        async for msg in channel.history(limit=limit):
-            messages.append(format_message(msg))
-    except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
-        logger.warning(f"Error getting channel context: {e}")
-    except Exception as e:
-        logger.exception(f"Unexpected error when getting channel context: {e}")
+class ReplyChainResolver:
+    """
+    Resolve reply chains with as few REST calls as possible.
 
-    # Reverse to get chronological order
-    messages.reverse()
-    return messages
+    Each hop is looked up in `reference.resolved`, an LRU of recently fetched messages and the bot's own
+    message cache before calling REST. When REST is needed, a window of history ending at the target is fetched,
+    because the earlier messages of a chain are usually among the messages right before it.
+    """
 
+    def __init__(self, bot, cache_size=500, fetch_window=20):
+        """
+        Args:
+            bot: The bot client, for its message cache
+            cache_size: Maximum number of fetched messages kept in the LRU
+            fetch_window: Number of messages fetched per REST call
+        """
+        self.bot = bot
+        self.cache_size = cache_size
+        self.fetch_window = fetch_window
+        self.message_cache: OrderedDict[int, discord.Message] = OrderedDict()
 
-async def get_referenced_message(message: discord.Message, depth=0, max_depth=10) -> list[discord.Message]:
-    """
-    Recursively get the referenced messages in a reply chain.
+        self.hops_by_source = {"resolved": 0, "lru": 0, "bot_cache": 0, "rest": 0}
+        self.rest_calls = 0
 
-    Args:
-        message: The Discord message object
-        depth: Current depth in the reply chain
-        max_depth: Maximum depth to traverse
+    def _remember(self, message: discord.Message):
+        self.message_cache[message.id] = message
+        self.message_cache.move_to_end(message.id)
+        if len(self.message_cache) > self.cache_size:
+            self.message_cache.popitem(last=False)
 
-    Returns:
-        The message reply chain in chronological order
-    """
-    if depth >= max_depth or not message.reference or not message.reference.message_id:
-        return []
+    def _get_cached(self, reference: discord.MessageReference):
+        """Return (message, source) if the referenced message is available locally, else (None, None)."""
+        if isinstance(reference.resolved, discord.Message):
+            return reference.resolved, "resolved"
+        message = self.message_cache.get(reference.message_id)
+        if message is not None:
+            self.message_cache.move_to_end(reference.message_id)
+            return message, "lru"
+        message = discord.utils.get(self.bot.cached_messages, id=reference.message_id)
+        if message is not None:
+            return message, "bot_cache"
+        return None, None
 
-    try:
-        referenced_msg = await message.channel.fetch_message(message.reference.message_id)
+    async def _fetch_window(self, channel, message_id):
+        """Fetch the target message together with the messages right before it, and cache all of them."""
+        self.rest_calls += 1
+        target = None
+        async for msg in channel.history(limit=self.fetch_window, before=discord.Object(id=message_id + 1)):
+            self._remember(msg)
+            if msg.id == message_id:
+                target = msg
+        if target is None:
+            # Not in the window (e.g. deleted), fall back to fetching it directly so errors surface as usual
+            self.rest_calls += 1
+            target = await channel.fetch_message(message_id)
+            self._remember(target)
+        return target
+
+    async def resolve(self, message: discord.Message, max_depth=10) -> list[discord.Message]:
+        """
+        Get the referenced messages in a reply chain.
+
+        Args:
+            message: The Discord message object
+            max_depth: Maximum depth to traverse
 
-        # Recursively get earlier messages in the chain first
-        earlier_messages = await get_referenced_message(referenced_msg, depth + 1, max_depth)
+        Returns:
+            The message reply chain in chronological order
+        """
+        chain = []
+        hops = {source: 0 for source in self.hops_by_source}
+        current = message
+        try:
+            while len(chain) < max_depth and current.reference and current.reference.message_id:
+                reference = current.reference
+                referenced_msg, source = self._get_cached(reference)
+                if referenced_msg is None:
+                    if reference.channel_id == current.channel.id:
+                        channel = current.channel
+                    else:
+                        channel = self.bot.get_channel(reference.channel_id)
+                    if channel is None:
+                        logger.warning(f"Channel {reference.channel_id} of referenced message not found.")
+                        break
+                    referenced_msg = await self._fetch_window(channel, reference.message_id)
+                    source = "rest"
+                hops[source] += 1
+                chain.append(referenced_msg)
+                current = referenced_msg
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+            logger.warning(f"Error fetching referenced message: {e}")
+        except Exception as e:
+            logger.exception(f"Unexpected error when fetching referenced message: {e}")
+
+        for source, count in hops.items():
+            self.hops_by_source[source] += count
+        if chain:
+            logger.info(
+                f"Resolved reply chain of {len(chain)} hops: {len(chain) - hops['rest']} from cache, "
+                f"{hops['rest']} from REST ({hops})."
+            )
 
         # Return in chronological order (earliest first)
-        return earlier_messages + [referenced_msg]
+        chain.reverse()
+        return chain
 
-    except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
-        logger.warning(f"Error fetching referenced message: {e}")
-        return []
-    except Exception as e:
-        logger.exception(f"Unexpected error when fetching referenced message: {e}")
-        return []
+    def get_stats(self):
+        cache_hops = sum(count for source, count in self.hops_by_source.items() if source != "rest")
+        return {
+            "cache_hops": cache_hops,
+            "rest_hops": self.hops_by_source["rest"],
+            "rest_calls": self.rest_calls,
+            "hops_by_source": dict(self.hops_by_source),
+            "cached_messages": len(self.message_cache),
+        }
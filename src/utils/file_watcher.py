@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class WatchedFile:
+    path: str
+    load: Callable[[str], Any]  # Runs in a worker thread, returns the new value
+    apply: Callable[[Any], None]  # Runs on the event loop, swaps the new value in
+    signature: tuple | None = None  # (inode, size, mtime) when last seen
+    content_hash: str | None = None  # Hash of the content last loaded
+    reloads: int = 0
+    errors: int = 0
+
+
+class FileWatcher:
+    """
+    Reloads data files when they change, by polling.
+
+    A file is only hashed when its inode, size or modification time changed, and only reloaded when its content
+    hash changed, so touching or rewriting a file with the same content reloads nothing. Loading runs in a worker
+    thread; the new value is then applied on the event loop in one assignment, so readers never see a half-loaded
+    state. A file that failed to load keeps its old value and is retried at the next check.
+    """
+
+    def __init__(self):
+        self.files: dict[str, WatchedFile] = {}
+        self._lock = asyncio.Lock()
+
+    def watch(self, path, load, apply):
+        """
+        Args:
+            path: File to watch
+            load: load(path) -> value, called in a worker thread when the file changed (and at the first check)
+            apply: apply(value), called on the event loop with the loaded value
+        """
+        self.files[path] = WatchedFile(path, load, apply)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def poll(self):
+        """Return the watched files whose content changed since they were last loaded. Blocking (stat and hash)."""
+        changed = []
+        for watched in self.files.values():
+            signature = self._signature(watched.path)
+            if signature is None or signature == watched.signature:
+                continue
+            content_hash = hash_file(watched.path)
+            watched.signature = signature
+            if content_hash != watched.content_hash:
+                changed.append((watched, content_hash))
+        return changed
+
+    async def check(self):
+        """
+        Reload the files that changed.
+
+        Returns:
+            Paths of the reloaded files
+        """
+        async with self._lock:
+            reloaded = []
+            for watched, content_hash in await asyncio.to_thread(self.poll):
+                try:
+                    value = await asyncio.to_thread(watched.load, watched.path)
+                    watched.apply(value)
+                except Exception as e:
+                    watched.signature = None  # Retry at the next check
+                    watched.errors += 1
+                    logger.exception(f"Error when reloading {watched.path}: {e}")
+                    continue
+                watched.content_hash = content_hash
+                watched.reloads += 1
+                reloaded.append(watched.path)
+                logger.info(f"Reloaded {watched.path}.")
+            return reloaded
@@ -0,0 +1,140 @@
+import logging
+import time
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in ms) of the latency histogram buckets. The last bucket catches everything slower.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+
+class HostStats:
+    """Request counters and latency histogram of a single host."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.total_latency = 0.0
+        self.latency_histogram = [0] * len(LATENCY_BUCKETS_MS)
+
+    def record(self, latency, reused):
+        self.requests += 1
+        self.total_latency += latency
+        if reused:
+            self.reused_connections += 1
+        else:
+            self.new_connections += 1
+        latency_ms = latency * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.latency_histogram[i] += 1
+                break
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "avg_latency_ms": round(self.total_latency * 1000 / self.requests, 1) if self.requests else None,
+            "latency_histogram_ms": {
+                (f"<={bound}" if bound != float("inf") else "inf"): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.latency_histogram)
+            },
+        }
+
+
+class HttpClientManager:
+    """
+    Bot-wide aiohttp session with keep-alive connection pooling, DNS caching and timeouts.
+
+    Owned by the bot client: started in setup_hook and closed on shutdown.
+    Cogs borrow `session` instead of opening a new ClientSession per request,
+    so repeated calls to the same host skip DNS, TCP and TLS setup.
+    """
+
+    def __init__(self, limit=100, limit_per_host=10, dns_ttl=300, keepalive_timeout=60,
+                 total_timeout=30, connect_timeout=10):
+        """
+        Args:
+            limit: Maximum number of simultaneous connections in the pool
+            limit_per_host: Maximum number of simultaneous connections to the same host
+            dns_ttl: Seconds a resolved DNS entry is cached
+            keepalive_timeout: Seconds an idle connection is kept open for reuse
+            total_timeout: Default timeout of a whole request in seconds
+            connect_timeout: Default timeout for acquiring a connection in seconds
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: aiohttp.ClientSession | None = None
+        self.host_stats: dict[str, HostStats] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP client is not started.")
+        return self._session
+
+    async def start(self):
+        """Create the pooled session. Must be called from within the running event loop."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[self._create_trace_config()],
+        )
+        logger.info(
+            f"HTTP client started (limit={self.limit}, limit_per_host={self.limit_per_host}, dns_ttl={self.dns_ttl}s)."
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP client closed.")
+        self._session = None
+
+    def _get_host_stats(self, host):
+        stats = self.host_stats.get(host)
+        if stats is None:
+            stats = self.host_stats[host] = HostStats()
+        return stats
+
+    def _create_trace_config(self):
+        """Hook into aiohttp's request tracing to collect per-host stats."""
+
+        async def on_request_start(_, ctx, params):
+            ctx.host = params.url.host
+            ctx.start = time.perf_counter()
+            ctx.reused = False
+
+        async def on_connection_reuseconn(_, ctx, __):
+            ctx.reused = True
+
+        async def on_request_end(_, ctx, __):
+            self._get_host_stats(ctx.host).record(time.perf_counter() - ctx.start, ctx.reused)
+
+        async def on_request_exception(_, ctx, __):
+            self._get_host_stats(ctx.host).errors += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def get_stats(self):
+        """Return per-host stats as a dict of {host: stats dict}."""
+        return {host: stats.to_dict() for host, stats in self.host_stats.items()}
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from urllib.parse import urlsplit
+from PIL import Image, ImageChops
+
+logger = logging.getLogger(__name__)
+
+image_cache_dir_path = os.path.join("data", "image_cache")
+
+
+def perceptual_hash(image_data: bytes) -> int:
+    """
+    64-bit difference hash (dHash) of an image: compares neighbouring pixels of a 9x8 grayscale thumbnail.
+    Re-encoded, resized or lightly edited copies of an image get hashes a few bits apart.
+    """
+    with Image.open(BytesIO(image_data)) as image:
+        pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()  # One byte per pixel
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def same_pixels(image_data: bytes, other_data: bytes, max_difference) -> bool:
+    """Whether two images have the same size and no pixel differing by more than max_difference on any channel."""
+    with Image.open(BytesIO(image_data)) as image, Image.open(BytesIO(other_data)) as other:
+        if image.size != other.size:
+            return False
+        difference = ImageChops.difference(image.convert("RGB"), other.convert("RGB"))
+    return max(high for _, high in difference.getextrema()) <= max_difference
+
+
+def normalize_url(url: str) -> str:
+    """Attachment URL without its query, Discord CDN URLs carry expiring signature parameters."""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+class ImageCache:
+    """
+    Content-addressed disk cache of preprocessed images.
+
+    Files are named after the SHA-256 of the preprocessed bytes. Attachment IDs and URLs are aliases of a file,
+    so a known attachment is served without a download. A new image is served as a cached one if their bytes are
+    the same, or if they have the same pixels up to JPEG noise. The perceptual hash only picks the cached images
+    worth comparing pixel by pixel: screenshots of the same layout (e.g. two game result screens) get the same
+    hash while showing different things.
+    The total size is capped, the least recently used images are evicted first.
+
+    The methods touching the disk are meant to run in a worker thread and are thread safe.
+    """
+
+    def __init__(self, path=image_cache_dir_path, max_bytes=200 * 1024 * 1024, max_distance=4,
+                 max_pixel_difference=8, max_candidates=3):
+        """
+        Args:
+            path: Directory of the cached images and of the index
+            max_bytes: Maximum total size of the cached images
+            max_distance: Maximum number of differing perceptual hash bits for a cached image to be compared
+            max_pixel_difference: Maximum difference of any pixel channel for two images to be the same
+            max_candidates: Maximum number of cached images compared pixel by pixel with a new one
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self.max_candidates = max_candidates
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, dict] = OrderedDict()  # {content hash: {"size", "phash"}}, LRU first
+        self.aliases: dict[str, str] = {}  # {"id:<attachment ID>" or "url:<URL>": content hash}
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.near_duplicates = 0
+        self.evictions = 0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def _alias_keys(attachment_id, url):
+        keys = []
+        if attachment_id is not None:
+            keys.append(f"id:{attachment_id}")
+        if url:
+            keys.append(f"url:{normalize_url(url)}")
+        return keys
+
+    def load(self):
+        """Load the index. Files missing on disk are dropped from it."""
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            with open(self._file("index.json"), "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            data = {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading image cache index, starting empty: {e}")
+            data = {}
+        with self.lock:
+            self.entries = OrderedDict(
+                (content_hash, entry) for content_hash, entry in data.get("entries", [])
+                if os.path.exists(self._file(f"{content_hash}.jpg"))
+            )
+            self.aliases = {key: value for key, value in data.get("aliases", {}).items() if value in self.entries}
+            self.total_bytes = sum(entry["size"] for entry in self.entries.values())
+            # Images written after the last index save are unknown, remove them so they do not escape the size cap
+            for name in os.listdir(self.path):
+                if name.endswith((".jpg", ".tmp")) and name.removesuffix(".jpg") not in self.entries:
+                    os.remove(self._file(name))
+        logger.info(f"Loaded image cache index: {len(self.entries)} images, {self.total_bytes} bytes.")
+
+    def save(self):
+        """Write the index atomically, keeping the LRU order."""
+        with self.lock:
+            data = {"entries": list(self.entries.items()), "aliases": dict(self.aliases)}
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._file("index.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(data, file)
+        os.replace(tmp_path, self._file("index.json"))
+
+    def lookup(self, attachment_id=None, url=None) -> str | None:
+        """Return the content hash cached for an attachment, or None. Memory only, safe on the event loop."""
+        for key in self._alias_keys(attachment_id, url):
+            content_hash = self.aliases.get(key)
+            if content_hash is not None and content_hash in self.entries:
+                return content_hash
+        return None
+
+    def _read_file(self, content_hash, touch=True) -> bytes | None:
+        """The bytes of a cached image, marked recently used if touch. None if it is gone."""
+        try:
+            with open(self._file(f"{content_hash}.jpg"), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            with self.lock:
+                self._remove(content_hash)
+            return None
+        if touch:
+            with self.lock:
+                if content_hash in self.entries:
+                    self.entries.move_to_end(content_hash)
+        return data
+
+    def read(self, content_hash) -> bytes | None:
+        """Return the bytes of a cached image and mark it recently used. None if it is gone."""
+        data = self._read_file(content_hash)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, image_data: bytes, attachment_id=None, url=None) -> tuple[str, bytes]:
+        """
+        Cache a preprocessed image under its attachment ID and URL.
+
+        Returns:
+            (content hash, image bytes). For an image with the same pixels as a cached one, those of the cached image.
+        """
+        content_hash = hashlib.sha256(image_data).hexdigest()
+        phash = perceptual_hash(image_data)
+        with self.lock:
+            self.misses += 1
+            exact = content_hash in self.entries
+            candidates = [] if exact else self._near_duplicate_candidates(phash)
+        cached_hash = cached = None
+        if exact:
+            cached_hash, cached = content_hash, self._read_file(content_hash)
+        for candidate in candidates:
+            candidate_data = self._read_file(candidate, touch=False)
+            if candidate_data is not None and same_pixels(candidate_data, image_data, self.max_pixel_difference):
+                cached_hash, cached = candidate, self._read_file(candidate)
+                break
+        if cached is not None:
+            with self.lock:
+                if cached_hash != content_hash:
+                    self.near_duplicates += 1
+                for key in self._alias_keys(attachment_id, url):
+                    self.aliases[key] = cached_hash
+            return cached_hash, cached
+
+        tmp_path = self._file(f"{content_hash}.jpg.tmp")
+        os.makedirs(self.path, exist_ok=True)
+        with open(tmp_path, "wb") as file:
+            file.write(image_data)
+        os.replace(tmp_path, self._file(f"{content_hash}.jpg"))
+        with self.lock:
+            if content_hash not in self.entries:
+                self.total_bytes += len(image_data)
+            self.entries[content_hash] = {"size": len(image_data), "phash": phash}
+            for key in self._alias_keys(attachment_id, url):
+                self.aliases[key] = content_hash
+            self._evict()
+        return content_hash, image_data
+
+    def _near_duplicate_candidates(self, phash) -> list[str]:
+        """The cached images within max_distance perceptual hash bits, closest first."""
+        candidates = []
+        for content_hash, entry in self.entries.items():
+            distance = (entry["phash"] ^ phash).bit_count()
+            if distance <= self.max_distance:
+                candidates.append((distance, content_hash))
+        candidates.sort()
+        return [content_hash for _, content_hash in candidates[:self.max_candidates]]
+
+    def _remove(self, content_hash):
+        entry = self.entries.pop(content_hash, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry["size"]
+        try:
+            os.remove(self._file(f"{content_hash}.jpg"))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        evicted = set()
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            content_hash = next(iter(self.entries))
+            self._remove(content_hash)
+            evicted.add(content_hash)
+            self.evictions += 1
+        if evicted:
+            self.aliases = {key: value for key, value in self.aliases.items() if value not in evicted}
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "images": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "near_duplicates": self.near_duplicates,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import aiohttp
+import discord
+from PIL import Image
+from utils.image_cache import ImageCache
+
+logger = logging.getLogger(__name__)
+
+
+def is_image_attachment(attachment: discord.Attachment) -> bool:
+    return bool(attachment.content_type and attachment.content_type.startswith("image/"))
+
+
+def preprocess_image(image_data: bytes, max_resolution: int, jpeg_quality: int) -> bytes:
+    """
+    Decode an image, downscale it to fit in max_resolution x max_resolution and re-encode it as JPEG.
+    CPU bound, so it is run in a worker thread.
+    """
+    with Image.open(BytesIO(image_data)) as image:
+        image.thumbnail((max_resolution, max_resolution))  # Keeps the aspect ratio, never upscales
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # Flatten transparency onto a white background, JPEG has no alpha channel
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+        return output.getvalue()
+
+
+class ImageIngestor:
+    """
+    Fetch image attachments concurrently and shrink them before they are sent to the AI model.
+
+    Downloads share a bounded semaphore, oversized files are refused before download
+    using attachment.size, and decoding / downscaling / re-encoding runs in a worker pool
+    so it does not block the event loop. Preprocessed images are kept in an ImageCache,
+    so an attachment seen before is read from disk instead of downloaded again.
+    """
+
+    def __init__(self, max_concurrency=4, max_bytes=8 * 1024 * 1024, max_resolution=1024, jpeg_quality=85,
+                 max_workers=2, cache: ImageCache | None = None):
+        """
+        Args:
+            max_concurrency: Maximum number of simultaneous downloads
+            max_bytes: Attachments larger than this are skipped
+            max_resolution: Longest side (in pixels) of the image sent to the model
+            jpeg_quality: Quality of the re-encoded JPEG
+            max_workers: Number of threads decoding and re-encoding images
+            cache: Cache of the preprocessed images, None to always download
+        """
+        self.max_bytes = max_bytes
+        self.max_resolution = max_resolution
+        self.jpeg_quality = jpeg_quality
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image_ingest")
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            try:
+                self.cache.save()
+            except OSError as e:
+                logger.error(f"Error saving image cache index: {e}")
+
+    async def _download(self, session: aiohttp.ClientSession, url: str) -> bytes | None:
+        async with self.semaphore:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    logger.error(f"Failed to download image: {resp.status}")
+                    return None
+                if resp.content_length is not None and resp.content_length > self.max_bytes:
+                    logger.warning(f"Skipping image of {resp.content_length} bytes (limit {self.max_bytes}).")
+                    return None
+                # The declared size can be missing or wrong, so also enforce the limit while reading
+                chunks = []
+                total = 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    total += len(chunk)
+                    if total > self.max_bytes:
+                        logger.warning(f"Skipping image larger than {self.max_bytes} bytes.")
+                        return None
+                    chunks.append(chunk)
+                return b"".join(chunks)
+
+    def _process(self, image_data: bytes, attachment: discord.Attachment) -> tuple[str | None, bytes]:
+        image_data = preprocess_image(image_data, self.max_resolution, self.jpeg_quality)
+        if self.cache is None:
+            return None, image_data
+        return self.cache.put(image_data, attachment.id, attachment.url)
+
+    async def ingest_one(self, session: aiohttp.ClientSession,
+                         attachment: discord.Attachment) -> tuple[str | None, bytes | None]:
+        """
+        Download and preprocess one attachment, or read it from the cache.
+
+        Returns:
+            (content hash, JPEG bytes). The hash is None without a cache, the bytes are None if skipped or failed.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if self.cache is not None:
+                content_hash = self.cache.lookup(attachment.id, attachment.url)
+                if content_hash is not None:
+                    image_data = await loop.run_in_executor(self.executor, self.cache.read, content_hash)
+                    if image_data is not None:
+                        return content_hash, image_data
+            if attachment.size > self.max_bytes:
+                logger.info(f"Skipping attachment {attachment.id} of {attachment.size} bytes (limit {self.max_bytes}).")
+                return None, None
+            image_data = await self._download(session, attachment.url)
+            if image_data is None:
+                return None, None
+            return await loop.run_in_executor(self.executor, self._process, image_data, attachment)
+        except Exception as e:
+            logger.error(f"Error ingesting image {attachment.id}: {e}")
+            return None, None
+
+    async def ingest(self, session: aiohttp.ClientSession, attachments: list[discord.Attachment]) -> list[bytes | None]:
+        """
+        Ingest all attachments concurrently. The results keep the order of the attachments.
+
+        An attachment listed twice is fetched once, and an image with the same content (bytes, or pixels up to
+        JPEG noise) as an earlier one is returned as None, so a prompt never carries the same image twice.
+        """
+        unique = list({attachment.id: attachment for attachment in attachments}.values())
+        results = await asyncio.gather(*(self.ingest_one(session, attachment) for attachment in unique))
+        by_id = {attachment.id: result for attachment, result in zip(unique, results)}
+
+        seen_ids = set()
+        seen_hashes = set()
+        images = []
+        duplicates = 0
+        for attachment in attachments:
+            content_hash, image_data = by_id[attachment.id]
+            if attachment.id in seen_ids or (content_hash is not None and content_hash in seen_hashes):
+                images.append(None)
+                duplicates += 1
+                continue
+            seen_ids.add(attachment.id)
+            if content_hash is not None:
+                seen_hashes.add(content_hash)
+            images.append(image_data)
+        if duplicates:
+            logger.info(f"Dropped {duplicates} duplicate images from the prompt.")
+        return images
@@ -0,0 +1,126 @@
+import logging
+from collections import OrderedDict
+import discord
+from utils.discord_msg import format_message
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelMessageBuffer:
+    """
+    Per-channel ring buffer of preformatted messages, filled from gateway events.
+
+    The buffer of a channel holds its latest `depth` messages, so building the context of a mention
+    needs no REST call. History is only fetched to fill a cold buffer (e.g. right after startup).
+    Across channels the total number of messages is capped; the least recently used channel is dropped first.
+    """
+
+    def __init__(self, depth=20, max_total_messages=2000):
+        """
+        Args:
+            depth: Number of latest messages kept per channel
+            max_total_messages: Maximum number of messages kept across all channels
+        """
+        self.depth = depth
+        self.max_total_messages = max_total_messages
+
+        # {channel_id: OrderedDict({message_id: formatted message})}, least recently used channel first
+        self.channels: OrderedDict[int, OrderedDict[int, str]] = OrderedDict()
+        # Channels whose buffer was filled from history, so it holds every recent message (not just new ones)
+        self.warm_channels: set[int] = set()
+        self.total_messages = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _get_buffer(self, channel_id) -> OrderedDict[int, str]:
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            buffer = self.channels[channel_id] = OrderedDict()
+        else:
+            self.channels.move_to_end(channel_id)
+        return buffer
+
+    def _drop_channel(self, channel_id):
+        buffer = self.channels.pop(channel_id, None)
+        if buffer is not None:
+            self.total_messages -= len(buffer)
+        self.warm_channels.discard(channel_id)
+
+    def _enforce_memory_cap(self):
+        while self.total_messages > self.max_total_messages and len(self.channels) > 1:
+            channel_id = next(iter(self.channels))
+            logger.debug(f"Message buffer full, dropping channel {channel_id}.")
+            self._drop_channel(channel_id)
+
+    def add(self, message: discord.Message):
+        """Record a new message (from on_message)."""
+        buffer = self._get_buffer(message.channel.id)
+        if message.id in buffer:
+            return
+        buffer[message.id] = format_message(message)
+        self.total_messages += 1
+        if len(buffer) > self.depth:
+            buffer.popitem(last=False)
+            self.total_messages -= 1
+        self._enforce_memory_cap()
+
+    def edit(self, message: discord.Message):
+        """Refresh an edited message (from on_raw_message_edit) if it is buffered."""
+        buffer = self.channels.get(message.channel.id)
+        if buffer is not None and message.id in buffer:
+            buffer[message.id] = format_message(message)
+
+    def delete(self, channel_id, message_id):
+        """Forget a deleted message (from on_raw_message_delete)."""
+        buffer = self.channels.get(channel_id)
+        if buffer is None or buffer.pop(message_id, None) is None:
+            return
+        self.total_messages -= 1
+        # The buffer no longer reaches back `depth` messages, so refill it from history on the next miss
+        self.warm_channels.discard(channel_id)
+
+    async def get_recent(self, channel, limit=20) -> list[tuple[int, str]]:
+        """
+        Get the latest messages from the channel as (message_id, formatted message) in chronological order.
+        Served from the buffer when it is warm or already holds `limit` messages, otherwise filled from history.
+        """
+        limit = min(limit, self.depth)
+        if limit <= 0:
+            return []
+        buffer = self._get_buffer(channel.id)
+        if channel.id in self.warm_channels or len(buffer) >= limit:
+            self.hits += 1
+            return list(buffer.items())[-limit:]
+
+        self.misses += 1
+        try:
+            history = [msg async for msg in channel.history(limit=self.depth)]
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+            logger.warning(f"Error getting channel context: {e}")
+            return list(buffer.items())[-limit:]
+        except Exception as e:
+            logger.exception(f"Unexpected error when getting channel context: {e}")
+            return list(buffer.items())[-limit:]
+
+        # Merge with anything that arrived through the gateway meanwhile, keep the newest `depth`
+        merged = {msg.id: format_message(msg) for msg in history}
+        merged.update(buffer)
+        self.total_messages -= len(buffer)
+        buffer.clear()
+        for message_id in sorted(merged)[-self.depth:]:
+            buffer[message_id] = merged[message_id]
+        self.total_messages += len(buffer)
+        self.warm_channels.add(channel.id)
+        self._enforce_memory_cap()
+        return list(buffer.items())[-limit:]
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "channels": len(self.channels),
+            "messages": self.total_messages,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
@@ -0,0 +1,124 @@
+import time
+from collections import deque
+from utils.ai_metrics import percentile
+
+
+class ModelStats:
+    """Rolling latency and error samples of one model."""
+
+    def __init__(self, window, max_age):
+        self.max_age = max_age
+        self.samples = deque(maxlen=window)  # (timestamp, latency or None if failed)
+
+    def _prune(self, now):
+        while self.samples and now - self.samples[0][0] > self.max_age:
+            self.samples.popleft()
+
+    def record(self, latency, now):
+        self.samples.append((now, latency))
+
+    def summary(self, now):
+        self._prune(now)
+        latencies = [latency for _, latency in self.samples if latency is not None]
+        errors = sum(1 for _, latency in self.samples if latency is None)
+        return {
+            "requests": len(self.samples),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "error_rate": errors / len(self.samples) if self.samples else 0.0,
+        }
+
+
+class ModelRouter:
+    """
+    Pick the model of each request from rolling latency and error stats.
+
+    Models are listed in order of preference (e.g. smartest first). A request takes the first model whose p95
+    latency fits its latency budget and whose error rate is acceptable, the others are fallbacks.
+    The router also tells when to send a hedged request to the fastest model: once the primary runs past its p95.
+    """
+
+    def __init__(self, models, window=100, max_age=3600, max_error_rate=0.5, min_samples=5):
+        """
+        Args:
+            models: Model names in order of preference
+            window: Number of latest requests kept per model
+            max_age: Seconds after which a sample is forgotten, so a failing model is tried again eventually
+            max_error_rate: Models failing more often than this are only used as fallbacks
+            min_samples: Number of samples needed before latency stats are trusted
+        """
+        self.models = list(models)
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.stats = {model: ModelStats(window, max_age) for model in self.models}
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.fallbacks = 0
+
+    def record_success(self, model, latency):
+        self.stats[model].record(latency, time.time())
+
+    def record_error(self, model):
+        self.stats[model].record(None, time.time())
+
+    def _is_healthy(self, summary):
+        return summary["requests"] < self.min_samples or summary["error_rate"] <= self.max_error_rate
+
+    def _fits_budget(self, summary, latency_budget):
+        if latency_budget is None or summary["p95"] is None or summary["requests"] < self.min_samples:
+            return True
+        return summary["p95"] <= latency_budget
+
+    def choose(self, latency_budget=None) -> list[str]:
+        """
+        Order the models for a request.
+
+        Args:
+            latency_budget: Seconds the request should take at most (p95), None for no limit
+
+        Returns:
+            Model names, the first one is the primary and the others are fallbacks in order
+        """
+        now = time.time()
+        summaries = {model: self.stats[model].summary(now) for model in self.models}
+
+        def rank(model):
+            summary = summaries[model]
+            healthy = self._is_healthy(summary)
+            fits = self._fits_budget(summary, latency_budget)
+            # Healthy models within budget in preference order, then healthy ones, then the rest
+            return (not healthy, not fits, self.models.index(model))
+
+        return sorted(self.models, key=rank)
+
+    def get_hedge(self, primary):
+        """
+        Return (hedge_model, delay): send a hedged request to hedge_model if the primary is not done after `delay`
+        seconds. Returns (None, None) if there is no faster healthy model or too few samples.
+        """
+        now = time.time()
+        primary_summary = self.stats[primary].summary(now)
+        if primary_summary["requests"] < self.min_samples or primary_summary["p95"] is None:
+            return None, None
+
+        best_model, best_p50 = None, None
+        for model in self.models:
+            if model == primary:
+                continue
+            summary = self.stats[model].summary(now)
+            if summary["p50"] is None or not self._is_healthy(summary):
+                continue
+            if summary["p50"] < primary_summary["p95"] and (best_p50 is None or summary["p50"] < best_p50):
+                best_model, best_p50 = model, summary["p50"]
+        if best_model is None:
+            return None, None
+        return best_model, primary_summary["p95"]
+
+    def get_stats(self):
+        now = time.time()
+        return {
+            "models": {model: self.stats[model].summary(now) for model in self.models},
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,121 @@
+import logging
+import re
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Gemini bills a small image as a fixed number of tokens. Ingested images are downscaled, so use it as the estimate.
+IMAGE_TOKENS = 258
+
+_token_re = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of a text: one token per word or punctuation mark, plus one per 8 characters of long words.
+    Close enough to the real tokenizer for budgeting, without a round trip to count_tokens.
+    """
+    return sum(1 + len(token) // 8 for token in _token_re.findall(text))
+
+
+class PromptBuilder:
+    """
+    Assemble the parts of a mention prompt within a token budget.
+
+    Messages appearing in several sections (e.g. in both the recent messages and the reply chain) are sent once.
+    When the prompt is over the budget of its request type, the oldest recent messages are dropped first,
+    then the oldest messages of the reply chain. The latest message is always kept.
+    """
+
+    def __init__(self, budgets: dict[str, int], cache_size=5000):
+        """
+        Args:
+            budgets: Token budget per request type, e.g. {"mention": 8000}
+            cache_size: Maximum number of per-message token estimates kept
+        """
+        self.budgets = budgets
+        self.cache_size = cache_size
+        self.token_cache: OrderedDict[tuple[int, int], int] = OrderedDict()
+
+    def message_tokens(self, message_id, text):
+        """Token estimate of a message, cached per message ID (and length, in case it was edited)."""
+        key = (message_id, len(text))
+        tokens = self.token_cache.get(key)
+        if tokens is None:
+            tokens = self.token_cache[key] = estimate_tokens(text)
+            if len(self.token_cache) > self.cache_size:
+                self.token_cache.popitem(last=False)
+        else:
+            self.token_cache.move_to_end(key)
+        return tokens
+
+    def build(self, request_type, recent, reply_chain, latest_message_id, latest_parts):
+        """
+        Args:
+            request_type: Key of the token budget
+            recent: Recent messages of the channel, [(message_id, text)] in chronological order
+            reply_chain: Reply chain of the latest message, [(message_id, text, images)] in chronological order.
+                The images are kept as they are (e.g. attachments to be ingested later).
+            latest_message_id: ID of the message to reply to, removed from the other sections
+            latest_parts: Parts of the latest message (prompt text followed by its images), always kept
+
+        Returns:
+            The list of prompt parts
+        """
+        budget = self.budgets[request_type]
+
+        # Deduplicate: the latest message and the reply chain win over the recent messages
+        chain_ids = {message_id for message_id, _, _ in reply_chain}
+        deduped_recent = [
+            (message_id, text) for message_id, text in recent
+            if message_id != latest_message_id and message_id not in chain_ids
+        ]
+        seen = set()
+        deduped_chain = []
+        for message_id, text, images in reply_chain:
+            if message_id != latest_message_id and message_id not in seen:
+                seen.add(message_id)
+                deduped_chain.append((message_id, text, images))
+
+        recent_tokens = [self.message_tokens(message_id, text) for message_id, text in recent]
+        chain_tokens = [
+            self.message_tokens(message_id, text) + IMAGE_TOKENS * len(images)
+            for message_id, text, images in reply_chain
+        ]
+        latest_tokens = sum(estimate_tokens(p) if isinstance(p, str) else IMAGE_TOKENS for p in latest_parts)
+        naive_tokens = sum(recent_tokens) + sum(chain_tokens) + latest_tokens
+
+        recent_costs = [self.message_tokens(message_id, text) for message_id, text in deduped_recent]
+        chain_costs = [
+            self.message_tokens(message_id, text) + IMAGE_TOKENS * len(images)
+            for message_id, text, images in deduped_chain
+        ]
+        total = sum(recent_costs) + sum(chain_costs) + latest_tokens
+
+        # Trim the lowest value context first: oldest recent messages, then the oldest of the reply chain
+        recent_start = 0
+        while total > budget and recent_start < len(deduped_recent):
+            total -= recent_costs[recent_start]
+            recent_start += 1
+        chain_start = 0
+        while total > budget and chain_start < len(deduped_chain):
+            total -= chain_costs[chain_start]
+            chain_start += 1
+
+        parts = []
+        if recent_start < len(deduped_recent):
+            parts.append("Recent messages in the channel:")
+            parts += [text for _, text in deduped_recent[recent_start:]]
+        if chain_start < len(deduped_chain):
+            parts.append("Reply chain of the latest message:")
+            for _, text, images in deduped_chain[chain_start:]:
+                parts.append(text)
+                parts += images
+        parts += latest_parts
+
+        logger.info(
+            f"Prompt for {request_type}: ~{total} tokens (budget {budget}), saved ~{naive_tokens - total} tokens. "
+            f"Dropped {len(recent) - len(deduped_recent)} + {len(reply_chain) - len(deduped_chain)} duplicates, "
+            f"trimmed {recent_start} recent and {chain_start} reply chain messages."
+        )
+        return parts
@@ -1,21 +1,60 @@
-from collections import defaultdict, deque
+import asyncio
+import json
+import logging
+import os
+import struct
+from array import array
+from collections import OrderedDict, deque
 import time
 
+logger = logging.getLogger(__name__)
+
+# Snapshot header: magic, version, length of the JSON description that follows
+_SNAPSHOT_HEADER = struct.Struct("<4sHI")
+_SNAPSHOT_MAGIC = b"D2KR"
+_SNAPSHOT_VERSION = 1
+_GLOBAL_KEY = -1  # Key of the global limiters (None) in snapshots
+
+
+def _dump_items(items):
+    """(keys, counts, values) arrays of [(key, values)], skipping keys that are neither None nor an int."""
+    keys, counts, values = array("q"), array("I"), array("d")
+    for key, key_values in items:
+        if key is not None and not isinstance(key, int):
+            continue
+        keys.append(_GLOBAL_KEY if key is None else key)
+        counts.append(len(key_values))
+        values.extend(key_values)
+    return keys, counts, values
+
+
+def _load_items(keys, counts, values):
+    """Inverse of _dump_items, yields (key, values)."""
+    offset = 0
+    for key, count in zip(keys, counts):
+        yield None if key == _GLOBAL_KEY else key, values[offset:offset + count]
+        offset += count
+
 
 class SimpleRateLimiter:
-    def __init__(self, rate, per):
+    multi_window = False
+
+    def __init__(self, rate, per, max_keys=100_000):
         """
         Initialize a rate limit configuration.
 
         Args:
             rate: Maximum number of messages allowed in the time window
             per: Time window in seconds
+            max_keys: Maximum number of keys tracked. Past it, the least recently active key is forgotten.
         """
         self.rate = rate
         self.per = per
+        self.max_keys = max_keys
 
-        # Either a global rate limiter (key=None) or a per-user limiter
-        self.timestamps_dict = defaultdict(lambda: deque(maxlen=rate))
+        # Either a global rate limiter (key=None) or a per-user limiter.
+        # Least recently active key first, so idle keys are swept from the front.
+        self.timestamps_dict: OrderedDict[object, deque] = OrderedDict()
 
     def check_limit(self, current_time=None, user_id=None):
         """
@@ -30,9 +69,9 @@ class SimpleRateLimiter:
         if current_time is None:
             current_time = time.time()
 
-        timestamps = self.timestamps_dict[user_id]
+        timestamps = self.timestamps_dict.get(user_id)
         # If haven't sent rate yet, allow
-        if len(timestamps) < self.rate:
+        if timestamps is None or len(timestamps) < self.rate:
             return True
 
         # Check if the oldest message is outside the time window
@@ -53,18 +92,306 @@ class SimpleRateLimiter:
         if current_time is None:
             current_time = time.time()
 
-        timestamps = self.timestamps_dict[user_id]
-        if len(timestamps) >= self.rate:
-            timestamps.popleft()  # Remove the oldest timestamp
+        timestamps = self.timestamps_dict.get(user_id)
+        if timestamps is None:
+            timestamps = self.timestamps_dict[user_id] = deque(maxlen=self.rate)
+        else:
+            self.timestamps_dict.move_to_end(user_id)
+
+        timestamps.append(current_time)  # The deque drops the oldest timestamp when full
+        self.sweep(current_time)
+
+    def reserve(self, current_time, user_id=None):
+        """Return the state to commit if a message is allowed now, else None. Does not modify the state."""
+        return current_time if self.check_limit(current_time, user_id) else None
+
+    def retry_after(self, current_time, user_id=None):
+        """Seconds until a message would be allowed, 0 if it is allowed now."""
+        timestamps = self.timestamps_dict.get(user_id)
+        if timestamps is None or len(timestamps) < self.rate:
+            return 0.0
+        return max(0.0, timestamps[0] + self.per - current_time)
+
+    def commit(self, user_id, state, current_time):
+        """Record a message allowed by reserve."""
+        self.add_timestamp(state, user_id)
+
+    @property
+    def limits(self):
+        return [(self.rate, self.per)]
+
+    def dump_state(self):
+        return _dump_items(self.timestamps_dict.items())
+
+    def restore_state(self, state, current_time):
+        """Restore a dump_state, least recently active key first, dropping the expired timestamps."""
+        for key, timestamps in _load_items(*state):
+            timestamps = [timestamp for timestamp in timestamps if current_time - timestamp <= self.per]
+            if timestamps:
+                self.timestamps_dict.pop(key, None)
+                self.timestamps_dict[key] = deque(timestamps, maxlen=self.rate)
+        self.sweep(current_time)
+
+    def sweep(self, current_time=None):
+        """
+        Forget the keys with no timestamp left in the window, then the least recently active keys past max_keys.
+
+        Keys are ordered by their newest timestamp, so this stops at the first key still active: each key is
+        removed at most once per insertion, amortized O(1) per add_timestamp.
+        """
+        if current_time is None:
+            current_time = time.time()
+        timestamps_dict = self.timestamps_dict
+        while timestamps_dict:
+            key, timestamps = next(iter(timestamps_dict.items()))
+            newest = timestamps[-1]
+            if current_time - newest > self.per:
+                newest = max(timestamps)  # The latest timestamp is not the newest if the clock went back
+            if current_time - newest <= self.per and len(timestamps_dict) <= self.max_keys:
+                break
+            del timestamps_dict[key]
+
+
+class GCRARateLimiter:
+    """
+    Rate limit with the generic cell rate algorithm: one float of state per key, constant time decisions.
+
+    Each key has a theoretical arrival time (TAT), the time at which it would be back to a full budget if messages
+    were spread evenly, one per emission interval (per / rate). A message is allowed if the TAT after it is at most
+    `per` ahead of now. A burst of `rate` messages is allowed from a full budget, like SimpleRateLimiter, but the
+    budget then refills steadily (one message per emission interval) instead of all at once when the oldest
+    message of the window expires. So a window of `per` seconds can see nearly 2 * rate messages (a burst at
+    its start, then the refill), use it where such bursts are acceptable and not for hard budgets.
+    """
+
+    multi_window = False
+
+    def __init__(self, rate, per, max_keys=100_000):
+        """
+        Args:
+            rate: Maximum number of messages allowed in the time window
+            per: Time window in seconds
+            max_keys: Maximum number of keys tracked. Past it, the least recently active key is forgotten.
+        """
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self.interval = per / rate
+        # A burst of rate messages adds up rate intervals to epoch timestamps, each addition rounds by ~1e-7 s
+        self.tolerance = per + 1e-3
+
+        # {user_id (None for global): TAT}, least recently active key first
+        self.tat_dict: OrderedDict[object, float] = OrderedDict()
+
+    def reserve(self, current_time, user_id=None):
+        """Return the TAT after a message if it is allowed now, else None. Does not modify the state."""
+        tat = self.tat_dict.get(user_id, current_time)
+        new_tat = (tat if tat > current_time else current_time) + self.interval
+        return new_tat if new_tat - current_time <= self.tolerance else None
+
+    def retry_after(self, current_time, user_id=None):
+        """Seconds until a message would be allowed, 0 if it is allowed now."""
+        tat = self.tat_dict.get(user_id, current_time)
+        return max(0.0, (tat if tat > current_time else current_time) + self.interval - current_time - self.tolerance)
+
+    def commit(self, user_id, state, current_time):
+        """Record a message allowed by reserve."""
+        tat_dict = self.tat_dict
+        if user_id in tat_dict:
+            tat_dict.move_to_end(user_id)
+        tat_dict[user_id] = state
+        self.sweep(current_time)
+
+    def check_limit(self, current_time=None, user_id=None):
+        if current_time is None:
+            current_time = time.time()
+        return self.reserve(current_time, user_id) is not None
+
+    def add_timestamp(self, current_time=None, user_id=None):
+        if current_time is None:
+            current_time = time.time()
+        tat = self.tat_dict.get(user_id, current_time)
+        self.commit(user_id, (tat if tat > current_time else current_time) + self.interval, current_time)
+
+    @property
+    def limits(self):
+        return [(self.rate, self.per)]
+
+    def dump_state(self):
+        return _dump_items((key, (tat,)) for key, tat in self.tat_dict.items())
+
+    def restore_state(self, state, current_time):
+        """Restore a dump_state, least recently active key first, dropping the keys back to a full budget."""
+        for key, tats in _load_items(*state):
+            if tats and tats[0] > current_time:
+                self.tat_dict.pop(key, None)
+                self.tat_dict[key] = tats[0]
+        self.sweep(current_time)
+
+    def sweep(self, current_time=None):
+        """
+        Forget the keys back to a full budget (TAT passed), then the least recently active keys past max_keys.
+        Stops at the first key still limited, amortized O(1) per commit.
+        """
+        if current_time is None:
+            current_time = time.time()
+        tat_dict = self.tat_dict
+        while tat_dict:
+            key, tat = next(iter(tat_dict.items()))
+            if tat > current_time and len(tat_dict) <= self.max_keys:
+                break
+            del tat_dict[key]
+
+
+class MultiWindowRateLimiter:
+    """
+    Several time windows over one timestamp log per key, with the semantics of one SimpleRateLimiter each.
+
+    A window of `rate` messages per `per` seconds allows a message if the rate-th latest timestamp is older than
+    `per`, so every window is checked by indexing the same log. The log keeps the latest max(rate) timestamps in
+    arrival order, like the deques of SimpleRateLimiter, until the key leaves the longest window.
+
+    The decisions are those of one SimpleRateLimiter per window, except after the clock goes back with windows of
+    different lengths: a SimpleRateLimiter forgets a key once it leaves its own window, the log keeps it for the
+    longest one. The older timestamps can then still count, so this backend may refuse what "exact" allows, never
+    the other way around.
+    """
+
+    multi_window = True
+
+    def __init__(self, max_keys=100_000):
+        """
+        Args:
+            max_keys: Maximum number of keys tracked. Past it, the least recently active key is forgotten.
+        """
+        self.max_keys = max_keys
+        self.limits: list[tuple[int, float]] = []  # (rate, per)
+        self.max_rate = 0
+        self.max_per = 0
+
+        # {user_id (None for global): timestamps in arrival order}, least recently active key first
+        self.logs: OrderedDict[object, array] = OrderedDict()
+
+    def add_limit(self, rate, per):
+        self.limits.append((rate, per))
+        self.max_rate = max(self.max_rate, rate)
+        self.max_per = max(self.max_per, per)
+
+    def reserve(self, current_time, user_id=None):
+        """Return the time to commit if a message is allowed now in every window, else None."""
+        log = self.logs.get(user_id)
+        if log is not None:
+            length = len(log)
+            for rate, per in self.limits:
+                if length >= rate and current_time - log[-rate] <= per:
+                    return None
+        return current_time
+
+    def retry_after(self, current_time, user_id=None):
+        """Seconds until a message would be allowed in every window, 0 if it is allowed now."""
+        log = self.logs.get(user_id)
+        wait = 0.0
+        if log is not None:
+            length = len(log)
+            for rate, per in self.limits:
+                if length >= rate:
+                    wait = max(wait, log[-rate] + per - current_time)
+        return wait
+
+    def commit(self, user_id, state, current_time):
+        log = self.logs.get(user_id)
+        if log is None:
+            log = self.logs[user_id] = array("d")
+        else:
+            self.logs.move_to_end(user_id)
+        log.append(state)
+        self._compact(log)
+        self.sweep(current_time)
+
+    def _compact(self, log):
+        """Drop the timestamps past the largest rate, the oldest first."""
+        drop = len(log) - self.max_rate
+        if drop > 0:
+            del log[:drop]
+
+    def check_limit(self, current_time=None, user_id=None):
+        if current_time is None:
+            current_time = time.time()
+        return self.reserve(current_time, user_id) is not None
+
+    def add_timestamp(self, current_time=None, user_id=None):
+        if current_time is None:
+            current_time = time.time()
+        self.commit(user_id, current_time, current_time)
+
+    def dump_state(self):
+        return _dump_items(self.logs.items())
+
+    def restore_state(self, state, current_time):
+        """Restore a dump_state, least recently active key first, dropping the expired timestamps."""
+        for key, timestamps in _load_items(*state):
+            log = array("d", (timestamp for timestamp in timestamps if current_time - timestamp <= self.max_per))
+            self._compact(log)
+            if log:
+                self.logs.pop(key, None)
+                self.logs[key] = log
+        self.sweep(current_time)
+
+    def sweep(self, current_time=None):
+        """
+        Forget the keys whose newest timestamp left the longest window, then the least recently active keys past
+        max_keys. Stops at the first key still active, amortized O(1) per commit.
+        """
+        if current_time is None:
+            current_time = time.time()
+        logs = self.logs
+        while logs:
+            key, log = next(iter(logs.items()))
+            newest = log[-1] if log else float("-inf")
+            if current_time - newest > self.max_per and log:
+                newest = max(log)  # The latest timestamp is not the newest if the clock went back
+            if current_time - newest <= self.max_per and len(logs) <= self.max_keys:
+                break
+            del logs[key]
+
 
-        timestamps.append(current_time)
+# Limiter classes of MixedRateLimiter: "exact" keeps the timestamps of each window, "log" one timestamp log for all
+# the windows (same decisions as "exact", or stricter after the clock goes back), "gcra" one TAT per key and window
+# (smaller, but not a hard budget)
+BACKENDS = {
+    "exact": SimpleRateLimiter,
+    "log": MultiWindowRateLimiter,
+    "gcra": GCRARateLimiter,
+}
 
 
 class MixedRateLimiter:
-    def __init__(self):
-        """Initialize a flexible rate limiter with no initial limits."""
-        self.global_limiters: list[SimpleRateLimiter] = []
-        self.per_user_limiters: list[SimpleRateLimiter] = []
+    def __init__(self, backend="exact", path=None):
+        """
+        Initialize a flexible rate limiter with no initial limits.
+
+        Args:
+            backend: "exact" (sliding window of timestamps), "log" (exact, one timestamp log per key for all the
+                windows) or "gcra" (one float per key and limit, smoother refill)
+            path: File the state is saved to and loaded from, None to keep it in memory only
+        """
+        self.backend = backend
+        self.path = path
+        # Messages were added since the last snapshot
+        self.dirty = False
+        self.limiter_class = BACKENDS[backend]
+        # {user_id: [lock, number of callers using it]}, the lock queues the callers of acquire in FIFO order
+        self._queues: dict[object, list] = {}
+        self.global_limiters: list[SimpleRateLimiter | MultiWindowRateLimiter | GCRARateLimiter] = []
+        self.per_user_limiters: list[SimpleRateLimiter | MultiWindowRateLimiter | GCRARateLimiter] = []
+
+    def _add_limit(self, limiters, rate, per):
+        if not self.limiter_class.multi_window:
+            limiters.append(self.limiter_class(rate, per))
+            return
+        if not limiters:
+            limiters.append(self.limiter_class())
+        limiters[0].add_limit(rate, per)
 
     def add_global_limit(self, rate, per):
         """
@@ -74,7 +401,7 @@ class MixedRateLimiter:
             rate: Maximum number of messages allowed globally in the time window
             per: Time window in seconds
         """
-        self.global_limiters.append(SimpleRateLimiter(rate, per))
+        self._add_limit(self.global_limiters, rate, per)
 
     def add_per_user_limit(self, rate, per):
         """
@@ -84,20 +411,22 @@ class MixedRateLimiter:
             rate: Maximum number of messages allowed per user in the time window
             per: Time window in seconds
         """
-        self.per_user_limiters.append(SimpleRateLimiter(rate, per))
+        self._add_limit(self.per_user_limiters, rate, per)
 
-    def is_allowed(self, user_id):
+    def is_allowed(self, user_id, current_time=None):
         """
         Check if a user is allowed to send a message based on all configured limits,
         without modifying any state.
 
         Args:
             user_id: The ID of the user
+            current_time: Defaults to now
 
         Returns:
-            (bool, str): (True if allowed, None) or (False, reason) if not allowed
+            bool
         """
-        current_time = time.time()
+        if current_time is None:
+            current_time = time.time()
 
         # Check global limits first
         for limiter in self.global_limiters:
@@ -111,30 +440,170 @@ class MixedRateLimiter:
 
         return True
 
-    def try_add_message(self, user_id):
+    def try_add_message(self, user_id, current_time=None):
         """
         Try to add a message for a user and return whether it was successful.
-        Only updates timestamps if all checks pass.
+        Only updates the state if all checks pass.
+
+        Each limit computes its new state while checking, so the commit does not evaluate the limits again.
 
         Args:
             user_id: The ID of the user
+            current_time: Defaults to now
 
         Returns:
             bool
         """
-        current_time = time.time()
+        if current_time is None:
+            current_time = time.time()
 
-        # First, check if the message is allowed without modifying state
-        allowed = self.is_allowed(user_id)
+        reservations = []
+        for limiter in self.global_limiters:
+            state = limiter.reserve(current_time)
+            if state is None:
+                return False
+            reservations.append((limiter, None, state))
+        for limiter in self.per_user_limiters:
+            state = limiter.reserve(current_time, user_id)
+            if state is None:
+                return False
+            reservations.append((limiter, user_id, state))
 
-        if not allowed:
-            return False
+        # All checks passed, update all limiters
+        for limiter, key, state in reservations:
+            limiter.commit(key, state, current_time)
+        self.dirty = True
 
-        # If all checks passed, update all limiters
-        for limiter in self.global_limiters:
-            limiter.add_timestamp(current_time)
+        return True
 
+    def retry_after(self, user_id, current_time=None):
+        """
+        Seconds until the user could send a message under every limit, 0 if they can now.
+        Exact for every backend, as long as nobody else sends a message in the meantime (global limits).
+        """
+        if current_time is None:
+            current_time = time.time()
+        wait = 0.0
+        for limiter in self.global_limiters:
+            wait = max(wait, limiter.retry_after(current_time))
         for limiter in self.per_user_limiters:
-            limiter.add_timestamp(current_time, user_id)
+            wait = max(wait, limiter.retry_after(current_time, user_id))
+        return wait
 
-        return True
+    async def acquire(self, user_id, timeout=None):
+        """
+        Wait until a message of the user is allowed, then add it.
+
+        The callers of a user are served in FIFO order: each one sleeps until the next free slot across all the
+        limits. Gives up without waiting if the next slot is further away than the timeout.
+
+        Args:
+            user_id: The ID of the user
+            timeout: Maximum seconds to wait, None to wait as long as needed
+
+        Returns:
+            bool: True if the message was added, False if it could not be within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = [asyncio.Lock(), 0]
+        queue[1] += 1
+        lock = queue[0]
+        try:
+            if deadline is None or not lock.locked():
+                await lock.acquire()  # Does not suspend when free, wait_for with no time left would cancel it
+            else:
+                try:
+                    await asyncio.wait_for(lock.acquire(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    return False
+            try:
+                while not self.try_add_message(user_id):
+                    wait = self.retry_after(user_id)
+                    if deadline is not None and time.monotonic() + wait > deadline:
+                        return False
+                    await asyncio.sleep(max(wait, 0.001))  # At the boundary the window is still full
+                return True
+            finally:
+                lock.release()
+        finally:
+            queue[1] -= 1
+            if not queue[1]:
+                del self._queues[user_id]
+
+    def _scoped_limiters(self):
+        return [("global", limiter) for limiter in self.global_limiters] + \
+            [("user", limiter) for limiter in self.per_user_limiters]
+
+    def snapshot(self):
+        """Copy of the state of every limiter, taken on the event loop before saving in a worker thread."""
+        self.dirty = False
+        return [(scope, limiter.limits, limiter.dump_state()) for scope, limiter in self._scoped_limiters()]
+
+    def save(self, snapshot):
+        """
+        Write a snapshot atomically: a JSON description of the limiters, then the arrays of keys, number of values
+        per key and values (timestamps or TATs) of each limiter.
+        """
+        description = json.dumps({
+            "backend": self.backend,
+            "limiters": [
+                {"scope": scope, "limits": limits, "keys": len(keys), "values": len(values)}
+                for scope, limits, (keys, counts, values) in snapshot
+            ],
+        }).encode("utf-8")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(description)))
+            file.write(description)
+            for _, _, arrays in snapshot:
+                for section in arrays:
+                    file.write(section.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        Restore the state saved at self.path, dropping the expired entries. The state of a limiter whose limits
+        changed since the save is dropped.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        try:
+            magic, version, description_length = _SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                raise ValueError("not a rate limiter snapshot")
+            offset = _SNAPSHOT_HEADER.size
+            description = json.loads(data[offset:offset + description_length])
+            offset += description_length
+            saved = []
+            for entry in description["limiters"]:
+                arrays = []
+                for code, count in (("q", entry["keys"]), ("I", entry["keys"]), ("d", entry["values"])):
+                    section = array(code)
+                    end = offset + section.itemsize * count
+                    if end > len(data):
+                        raise ValueError("truncated")
+                    section.frombytes(data[offset:end])
+                    arrays.append(section)
+                    offset = end
+                saved.append((entry["scope"], [tuple(limit) for limit in entry["limits"]], arrays))
+        except (ValueError, KeyError, struct.error) as e:
+            logger.error(f"Error loading rate limiter state from {self.path}, starting empty: {e}")
+            return
+        if description["backend"] != self.backend:
+            logger.warning(f"Rate limiter state of {self.path} is for the {description['backend']} backend, ignored.")
+            return
+
+        current_time = time.time()
+        restored = 0
+        for (scope, limiter), (saved_scope, saved_limits, arrays) in zip(self._scoped_limiters(), saved):
+            if (scope, [tuple(limit) for limit in limiter.limits]) != (saved_scope, saved_limits):
+                logger.warning(f"Limits changed since the rate limiter state was saved, dropping {saved_limits}.")
+                continue
+            limiter.restore_state(arrays, current_time)
+            restored += 1
+        logger.info(f"Restored the state of {restored} rate limiters from {self.path}.")
@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from utils.ai_metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_ADMIN = 0
+PRIORITY_MENTION = 1
+PRIORITY_CHAT = 2
+PRIORITY_CHAT_LONG = 3
+PRIORITY_BACKGROUND = 4
+
+
+class QueueFullError(Exception):
+    """Raised when a request is refused because the waiting queue is full."""
+
+
+class RequestScheduler:
+    """
+    Limit the number of concurrent requests and queue the rest by priority.
+
+    Requests of equal priority are served first come, first served. Waiters can get updates
+    of their queue position and estimated waiting time, e.g. to show them to the user.
+    Requests are refused with QueueFullError when too many are already waiting (admission control).
+    """
+
+    def __init__(self, max_concurrency=3, max_queue_size=20, position_update_interval=5):
+        """
+        Args:
+            max_concurrency: Maximum number of requests running at the same time
+            max_queue_size: Maximum number of waiting requests, more are refused
+            position_update_interval: Seconds between two position checks of a waiting request
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.position_update_interval = position_update_interval
+
+        self.in_flight = 0
+        self._queue = []  # Heap of [priority, sequence, future]
+        self._sequence = itertools.count()
+
+        # Metrics
+        self.service_times = deque(maxlen=100)
+        self.wait_times = deque(maxlen=200)
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self):
+        return sum(1 for entry in self._queue if not entry[2].done())
+
+    def set_max_concurrency(self, max_concurrency):
+        """Change the concurrency limit at runtime. Raising it lets waiting requests start right away."""
+        self.max_concurrency = max(1, max_concurrency)
+        self._wake_next()
+
+    def estimate_wait(self, position):
+        """Estimated seconds until the request at the given queue position (1-based) starts."""
+        average_service_time = sum(self.service_times) / len(self.service_times) if self.service_times else 10
+        return average_service_time * math.ceil(position / self.max_concurrency)
+
+    def _position_of(self, entry):
+        return 1 + sum(1 for other in self._queue if other[:2] < entry[:2] and not other[2].done())
+
+    def _wake_next(self):
+        while self.in_flight < self.max_concurrency and self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():  # Cancelled while waiting
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def _acquire(self, priority, on_queued):
+        if self.in_flight < self.max_concurrency and not self.queue_depth:
+            self.in_flight += 1
+            return
+
+        if self.queue_depth >= self.max_queue_size:
+            self.rejected += 1
+            raise QueueFullError(f"{self.queue_depth} requests are already waiting.")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future]
+        heapq.heappush(self._queue, entry)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        last_position = None
+        try:
+            while True:
+                position = self._position_of(entry)
+                if on_queued is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queued(position, self.estimate_wait(position))
+                    except Exception as e:
+                        logger.warning(f"Error reporting queue position: {e}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=self.position_update_interval)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation, hand it to the next waiter
+                self._release()
+            else:
+                future.cancel()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_CHAT, on_queued=None):
+        """
+        Wait for a free slot, hold it inside the `async with` block.
+
+        Args:
+            priority: Lower values are served first
+            on_queued: Optional async callback (position, estimated_wait) called when the request has to wait,
+                and again whenever its position changes
+
+        Raises:
+            QueueFullError: If the queue is full
+        """
+        enqueue_time = time.monotonic()
+        await self._acquire(priority, on_queued)
+        start_time = time.monotonic()
+        wait_time = start_time - enqueue_time
+        self.wait_times.append(wait_time)
+        if wait_time > 1:
+            logger.info(f"Request waited {wait_time:.1f}s in the queue (priority {priority}).")
+        try:
+            yield wait_time
+        finally:
+            self.service_times.append(time.monotonic() - start_time)
+            self.completed += 1
+            self._release()
+
+    def get_stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_p50": percentile(self.wait_times, 50),
+            "wait_p95": percentile(self.wait_times, 95),
+        }
@@ -0,0 +1,81 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Case, whitespace and trailing punctuation insensitive form of a message, e.g. "Best build order ?" -> "best build order"."""
+    return _whitespace_re.sub(" ", message).strip().lower().rstrip("?!.").rstrip()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache:
+    """
+    Exact-match cache of AI replies with a TTL and a size-bounded LRU.
+
+    Keyed on the normalized message, the model, a hash of the system prompt, the user and a hash of the rest of the
+    prompt the reply depends on (e.g. the conversation memory), so a reply is never served for another model, an
+    outdated prompt, another user (the prompt names the user, who the reply may address) or another conversation.
+    """
+
+    def __init__(self, ttl=3600, max_entries=500):
+        """
+        Args:
+            ttl: Seconds a reply stays valid
+            max_entries: Maximum number of cached replies, the least recently used is evicted first
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, tuple[float, str, int]] = OrderedDict()  # {key: (expiry, reply, tokens)}
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def make_key(message, model, system_prompt, user_id=None, context=""):
+        return normalize_message(message), model, hash_text(system_prompt), user_id, hash_text(context)
+
+    def get(self, key):
+        """Return the cached reply, or None if missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.saved_tokens += entry[2]
+        return entry[1]
+
+    def put(self, key, reply, tokens=0):
+        """
+        Args:
+            key: From make_key
+            reply: The AI reply
+            tokens: Total tokens of the request, counted as saved on every hit
+        """
+        self.entries[key] = (time.monotonic() + self.ttl, reply, tokens)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "saved_tokens": self.saved_tokens,
+        }
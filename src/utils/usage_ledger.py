@@ -0,0 +1,279 @@
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+usage_ledger_file_path = os.path.join("data", "usage_ledger.bin")
+
+COMMANDS = ("other", "chat", "chat2", "mention", "summary")
+
+# Longest period /usage reports, older rollup buckets are dropped
+MAX_REPORT_DAYS = 365
+
+FLAG_CACHE_HIT = 1
+FLAG_ERROR = 2
+
+# Record: timestamp, user ID, command, model, prompt / response / thought tokens, images, latency (seconds), flags
+_RECORD = struct.Struct("<dQBBIIIHfB")
+
+# Latency histogram: bucket i counts the latencies up to _LATENCY_BASE * _LATENCY_GROWTH ** i seconds (12% apart,
+# up to about 20 minutes), the last bucket the slower ones
+_LATENCY_BASE = 0.05
+_LATENCY_GROWTH = 1.12
+_LATENCY_BUCKETS = 90
+
+
+def latency_bucket(latency):
+    if latency <= _LATENCY_BASE:
+        return 0
+    return min(_LATENCY_BUCKETS - 1, math.ceil(math.log(latency / _LATENCY_BASE, _LATENCY_GROWTH)))
+
+
+def histogram_percentile(counts, q):
+    """Nearest-rank percentile (q in [0, 100]) of a latency histogram, as the upper bound of its bucket."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = max(1, math.ceil(q / 100 * total))
+    for i, count in enumerate(counts):
+        rank -= count
+        if rank <= 0:
+            return round(_LATENCY_BASE * _LATENCY_GROWTH ** i, 3)
+
+
+class Usage:
+    """Counters of a rollup bucket."""
+
+    __slots__ = ("requests", "prompt_tokens", "response_tokens", "thought_tokens", "images", "cache_hits", "errors",
+                 "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.thought_tokens = 0
+        self.images = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.latencies = array("I", [0]) * _LATENCY_BUCKETS  # Histogram of the requests that reached a model
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.response_tokens + self.thought_tokens
+
+    def add(self, prompt_tokens, response_tokens, thought_tokens, images, latency, flags):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.response_tokens += response_tokens
+        self.thought_tokens += thought_tokens
+        self.images += images
+        if flags & FLAG_CACHE_HIT:
+            self.cache_hits += 1
+        else:
+            self.latencies[latency_bucket(latency)] += 1
+        if flags & FLAG_ERROR:
+            self.errors += 1
+
+    def merge(self, other: "Usage"):
+        for name in self.__slots__[:-1]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        latencies = self.latencies
+        for i, count in enumerate(other.latencies):
+            if count:
+                latencies[i] += count
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "response_tokens": self.response_tokens,
+            "thought_tokens": self.thought_tokens,
+            "total_tokens": self.total_tokens,
+            "images": self.images,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "latency_p50": histogram_percentile(self.latencies, 50),
+            "latency_p95": histogram_percentile(self.latencies, 95),
+        }
+
+
+class UsageLedger:
+    """
+    Append-only ledger of the AI requests, with in-memory rollups.
+
+    Each request is a fixed-size binary record (37 bytes). Model names are stored once in a small JSON file
+    next to the ledger and referenced by index. Records are buffered and appended in batches by flush(),
+    which is meant to run in a worker thread. Rollups by hour (for the last 24 hours) and by day and user / model
+    (for the top consumers of a period) are rebuilt from the ledger on load and kept up to date on record(). Their
+    latencies are histograms, so a rollup bucket has a fixed size however many requests it counts, and the buckets
+    older than the reports can ask for (24 hours, MAX_REPORT_DAYS days) are dropped every hour.
+    """
+
+    def __init__(self, path=usage_ledger_file_path):
+        """
+        Args:
+            path: Ledger file. The model names are stored in `<path>.names.json`.
+        """
+        self.path = path
+        self.names_path = f"{path}.names.json"
+        self.models: list[str] = []
+        self.model_ids: dict[str, int] = {}
+        self.pending = bytearray()
+        self.lock = threading.Lock()  # Guards pending, flush() runs in a worker thread
+        self.rollups: dict[str, defaultdict] = {
+            dimension: defaultdict(Usage) for dimension in ("hour", "day_user", "day_model")
+        }
+        self.pruned_hour = None  # Hour of the last prune()
+
+    def _model_id(self, model):
+        model_id = self.model_ids.get(model)
+        if model_id is None and len(self.models) >= 255:  # The last ID is shared by all the models beyond
+            model = "other"
+            model_id = self.model_ids.get(model)
+        if model_id is None:
+            model_id = self.model_ids[model] = len(self.models)
+            self.models.append(model)
+        return model_id
+
+    def _add_to_rollups(self, timestamp, user_id, model, prompt_tokens, response_tokens, thought_tokens, images,
+                        latency, flags):
+        hour = int(timestamp // 3600)
+        day = hour // 24
+        for dimension, key in (("hour", hour), ("day_user", (day, user_id)), ("day_model", (day, model))):
+            self.rollups[dimension][key].add(prompt_tokens, response_tokens, thought_tokens, images, latency, flags)
+
+    def record(self, user_id, command, model, prompt_tokens=0, response_tokens=0, thought_tokens=0, images=0,
+               latency=0.0, cache_hit=False, error=False):
+        """
+        Record one request. Cheap, it only updates memory, the record is written by the next flush().
+
+        Args:
+            user_id: Discord user ID, 0 for requests of the bot itself
+            command: One of COMMANDS
+            model: Model name (the last one tried if the request failed), or "cache" for cache hits
+            prompt_tokens: usage_metadata.prompt_token_count
+            response_tokens: usage_metadata.candidates_token_count
+            thought_tokens: usage_metadata.thoughts_token_count
+            images: Number of images in the prompt
+            latency: Seconds the model call took
+            cache_hit: The reply was served from the response cache
+            error: The model call failed
+        """
+        timestamp = time.time()
+        flags = (FLAG_CACHE_HIT if cache_hit else 0) | (FLAG_ERROR if error else 0)
+        command_id = COMMANDS.index(command) if command in COMMANDS else 0
+        prompt_tokens, response_tokens, thought_tokens = (
+            max(0, int(tokens or 0)) for tokens in (prompt_tokens, response_tokens, thought_tokens)
+        )
+        images = min(images, 0xFFFF)
+        with self.lock:
+            self.pending += _RECORD.pack(
+                timestamp, user_id or 0, command_id, self._model_id(model), prompt_tokens, response_tokens,
+                thought_tokens, images, latency, flags
+            )
+        self._add_to_rollups(timestamp, user_id or 0, model, prompt_tokens, response_tokens, thought_tokens, images,
+                             latency, flags)
+        if int(timestamp // 3600) != self.pruned_hour:
+            self.prune(timestamp)
+
+    def prune(self, current_time=None):
+        """Drop the rollup buckets older than the reports can ask for: 24 hours, MAX_REPORT_DAYS days."""
+        if current_time is None:
+            current_time = time.time()
+        hour = int(current_time // 3600)
+        first_hour = hour - 23
+        first_day = hour // 24 - MAX_REPORT_DAYS + 1
+        hours = self.rollups["hour"]
+        for key in [key for key in hours if key < first_hour]:
+            del hours[key]
+        for dimension in ("day_user", "day_model"):
+            days = self.rollups[dimension]
+            for key in [key for key in days if key[0] < first_day]:
+                del days[key]
+        self.pruned_hour = hour
+
+    def flush(self):
+        """Append the buffered records to the ledger."""
+        with self.lock:
+            if not self.pending:
+                return
+            data = bytes(self.pending)
+            self.pending.clear()
+            models = list(self.models)
+        # Names first, so every record on disk refers to a known model
+        tmp_path = f"{self.names_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # noinspection PyTypeChecker
+            json.dump(models, file)
+        os.replace(tmp_path, self.names_path)
+        with open(self.path, "ab") as file:
+            file.write(data)
+
+    def load(self):
+        """Read the ledger and rebuild the rollups. A partial record left by an interrupted write is ignored."""
+        try:
+            with open(self.names_path, "r", encoding="utf-8") as file:
+                self.models = json.load(file)
+        except FileNotFoundError:
+            self.models = []
+        self.model_ids = {model: i for i, model in enumerate(self.models)}
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % _RECORD.size
+        if usable != len(data):
+            logger.warning(f"Ignoring {len(data) - usable} trailing bytes of the usage ledger.")
+            with open(self.path, "r+b") as file:
+                file.truncate(usable)
+        current_time = time.time()
+        first_timestamp = (int(current_time // 86400) - MAX_REPORT_DAYS + 1) * 86400
+        for (timestamp, user_id, _, model_id, prompt_tokens, response_tokens, thought_tokens, images, latency,
+             flags) in _RECORD.iter_unpack(memoryview(data)[:usable]):
+            if timestamp < first_timestamp:
+                continue
+            model = self.models[model_id] if model_id < len(self.models) else "unknown"
+            self._add_to_rollups(timestamp, user_id, model, prompt_tokens, response_tokens, thought_tokens, images,
+                                 latency, flags)
+        self.prune(current_time)
+        logger.info(f"Loaded {usable // _RECORD.size} usage records.")
+
+    def get_period_report(self, days=7, top=10):
+        """
+        Usage of the latest `days` days (including today, UTC).
+
+        Returns:
+            {"total": summary, "users": [(user ID, summary)] by total tokens, "models": {model: summary},
+             "last_24h": summary}
+        """
+        first_day = int(time.time() // 86400) - days + 1
+        total = Usage()
+        users = defaultdict(Usage)
+        models = defaultdict(Usage)
+        for (day, user_id), usage in self.rollups["day_user"].items():
+            if day >= first_day:
+                users[user_id].merge(usage)
+                total.merge(usage)
+        for (day, model), usage in self.rollups["day_model"].items():
+            if day >= first_day:
+                models[model].merge(usage)
+        last_24h = Usage()
+        first_hour = int(time.time() // 3600) - 23
+        for hour, usage in self.rollups["hour"].items():
+            if hour >= first_hour:
+                last_24h.merge(usage)
+        top_users = sorted(users.items(), key=lambda item: item[1].total_tokens, reverse=True)[:top]
+        return {
+            "total": total.summary(),
+            "users": [(user_id, usage.summary()) for user_id, usage in top_users],
+            "models": {model: usage.summary() for model, usage in models.items()},
+            "last_24h": last_24h.summary(),
+        }